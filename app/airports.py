@@ -0,0 +1,120 @@
+import os
+import re
+import unicodedata
+from bisect import bisect_left
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+# Índice precalculado: lugares + claves ya normalizadas y ordenadas
+DATA_PATH = os.path.join(os.path.dirname(__file__), "data", "airports.tsv")
+
+_IATA = re.compile(r"^[A-Z]{3}$")
+
+
+@dataclass(frozen=True)
+class Place:
+    """Ciudad (uno o más aeropuertos) o aeropuerto puntual del dataset incluido."""
+    codes: Tuple[str, ...]
+    city: str
+    country: str
+    airport: str = ""
+
+    @property
+    def label(self) -> str:
+        """Texto de la opción de autocompletado (≤ 100 caracteres, límite de Discord)."""
+        if self.airport:
+            return f"{self.airport} — {self.city}, {self.country} ({self.codes[0]})"
+        return f"{self.city}, {self.country} ({', '.join(self.codes)})"
+
+    @property
+    def value(self) -> str:
+        return ",".join(self.codes)
+
+
+def normalize(text: str) -> str:
+    """Minúsculas y sin tildes: "Tokio", "tokio" y "Tókio" caen en la misma clave."""
+    text = unicodedata.normalize("NFKD", text)
+    return " ".join("".join(ch for ch in text if not unicodedata.combining(ch)).lower().split())
+
+
+class AirportIndex:
+    """
+    Búsqueda por prefijo sobre un arreglo ordenado de claves (bisect): O(log n)
+    para ubicar el prefijo y luego un recorrido corto. Sin red ni API de
+    locations de Amadeus, así que responde muy dentro de los 3 s del autocompletado.
+    """
+    def __init__(self, places: List[Place], keys: List[str], refs: List[int]):
+        self.places = places
+        self.keys = keys
+        self.refs = refs
+
+    @classmethod
+    def load(cls, path: str = DATA_PATH) -> "AirportIndex":
+        places: List[Place] = []
+        pairs: List[Tuple[str, int]] = []
+        in_keys = False
+        with open(path, encoding="utf-8") as f:
+            for raw in f:
+                line = raw.rstrip("\n")
+                if line.startswith("#"):
+                    continue
+                if not line:
+                    in_keys = True
+                    continue
+                if in_keys:
+                    key, ref = line.split("\t")
+                    pairs.append((key, int(ref)))
+                else:
+                    codes, city, country, airport = line.split("\t")
+                    places.append(Place(tuple(codes.split(",")), city, country, airport))
+        # El archivo ya viene ordenado; si alguien lo editó a mano, se reordena
+        if any(pairs[i] > pairs[i + 1] for i in range(len(pairs) - 1)):
+            pairs.sort()
+        return cls(places, [k for k, _ in pairs], [r for _, r in pairs])
+
+    def search(self, text: str, limit: int = 25) -> List[Place]:
+        """Lugares cuya clave empieza con `text`; las ciudades van antes que sus aeropuertos."""
+        prefix = normalize(text)
+        if not prefix:
+            return []
+        exact = set()
+        refs = set()
+        i = bisect_left(self.keys, prefix)
+        while i < len(self.keys) and self.keys[i].startswith(prefix):
+            refs.add(self.refs[i])
+            if self.keys[i] == prefix:
+                exact.add(self.refs[i])
+            i += 1
+        # Coincidencia exacta primero; luego ciudades; el orden del archivo desempata
+        ranked = sorted(refs, key=lambda r: (r not in exact, bool(self.places[r].airport), r))
+        return [self.places[r] for r in ranked[:limit]]
+
+    def resolve(self, text: str) -> Optional[Place]:
+        """
+        Texto del comando -> lugar. Acepta el valor elegido en el autocompletado
+        ("NRT,HND"), códigos IATA sueltos o un nombre; None si no se reconoce.
+        """
+        codes = tuple(c.strip().upper() for c in text.split(",") if c.strip())
+        is_iata = bool(codes) and all(_IATA.match(c) for c in codes)
+        if is_iata:
+            for place in self.places:
+                if place.codes == codes:
+                    return place
+            # En mayúsculas se asume un código fuera del dataset ("SAN" = San Diego)
+            if text.strip().isupper() or len(codes) > 1:
+                return Place(codes, "/".join(codes), "")
+        hits = self.search(text, limit=1)
+        if hits:
+            return hits[0]
+        return Place(codes, "/".join(codes), "") if is_iata else None
+
+
+_INDEX: Optional[AirportIndex] = None
+
+
+def index() -> AirportIndex:
+    """Carga perezosa: el archivo se lee en el primer autocompletado, no al arrancar."""
+    global _INDEX
+    if _INDEX is None:
+        _INDEX = AirportIndex.load()
+    return _INDEX
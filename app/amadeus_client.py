@@ -1,39 +1,159 @@
-from datetime import datetime, timedelta, UTC
-from typing import Dict, Any, List, Optional
+import asyncio
+import contextvars
+import logging
+from typing import Dict, List, Optional, Set, Tuple
+from urllib.parse import urlsplit
+
 import aiohttp
 
+from . import deadline, diagnostics, metrics, quota
+from .http_session import HttpResponse, HttpSessionManager
+from .offers import Offer, parse_offers, parse_offers_by_route
+from .quota import QuotaPlanner
+from .ratelimit import RetryPolicy, TokenBucket, bucket_for, parse_retry_after
+from .search_cache import CacheKey, SearchCache, batch_key, search_key
+from .token_manager import TokenManager
+
+log = logging.getLogger(__name__)
+
+
+RETRIES = metrics.counter("amadeus_retries_total", "Reintentos contra Amadeus por endpoint y motivo")
+THROTTLED = metrics.counter("amadeus_429_total", "Respuestas 429 (rate limit) de Amadeus por endpoint")
+
+# Aeropuertos por lado en un POST flight-offers: el principal + 2 alternativos
+BATCH_MAX_CODES = 3
+# Tope de maxFlightOffers que acepta Amadeus por búsqueda
+BATCH_MAX_OFFERS = 250
+# Cupo del POST múltiple: max_results × rutas × este factor (hasta el tope)
+_BATCH_HEADROOM = 4
+
+
+def _endpoint(url: str) -> str:
+    return urlsplit(url).path
+
+
+class AmadeusError(RuntimeError):
+    def __init__(self, status: int, body: str):
+        super().__init__(f"Amadeus {status}: {body}")
+        self.status = status
+
+
 class AmadeusClient:
-    def __init__(self, host: str, client_id: Optional[str], client_secret: Optional[str]):
+    def __init__(
+        self,
+        host: str,
+        client_id: Optional[str],
+        client_secret: Optional[str],
+        http: HttpSessionManager,
+        token_cache_path: Optional[str] = None,
+        token_refresh_margin_s: int = 300,
+        cache: Optional[SearchCache] = None,
+        limiter: Optional[TokenBucket] = None,
+        retry: Optional[RetryPolicy] = None,
+        keep_raw: bool = False,
+        quota: Optional[QuotaPlanner] = None,
+    ):
         self.host = host.rstrip("/")
         self.client_id = client_id
         self.client_secret = client_secret
-        self._token: Optional[str] = None
-        self._token_exp: Optional[datetime] = None
+        self.http = http
+        self.limiter = limiter or bucket_for(self.host, rate=8, burst=2)
+        self.retry = retry or RetryPolicy()
+        # Conserva el JSON crudo en cada Offer (solo para depurar)
+        self.keep_raw = keep_raw
+        self.tokens = TokenManager(
+            lambda method, url, **kw: self._send(method, url, authorized=False, **kw),
+            self.host,
+            client_id,
+            client_secret,
+            cache_path=token_cache_path,
+            refresh_margin_s=token_refresh_margin_s,
+        )
+        self.cache = cache
+        self._revalidating: Set[CacheKey] = set()
+        # Referencia fuerte a las revalidaciones en vuelo (el loop solo guarda una débil)
+        self._background: Set[asyncio.Task] = set()
+        # Libro de llamadas del mes + planificador (reserva para los posts programados)
+        self.quota = quota
 
-    async def _ensure_token(self, session: aiohttp.ClientSession):
-        if self._token and self._token_exp and datetime.now(UTC) < self._token_exp:
-            return
-        url = f"{self.host}/v1/security/oauth2/token"
-        headers = {"Content-Type": "application/x-www-form-urlencoded"}
-        data = {
-            "grant_type": "client_credentials",
-            "client_id": self.client_id or "",
-            "client_secret": self.client_secret or "",
-        }
-        async with session.post(url, data=data, headers=headers) as r:
-            text = await r.text()
-            if r.status != 200:
-                print(f"[ERR] Token fail {r.status}: {text[:300]}")
-                raise RuntimeError(f"Amadeus token {r.status}")
-            js = await r.json()
-            self._token = js["access_token"]
-            self._token_exp = datetime.now(UTC) + timedelta(
-                seconds=int(js.get("expires_in", 1800)) - 60
-            )
+    async def close(self) -> None:
+        for task in self._background:
+            task.cancel()
+        if self._background:
+            await asyncio.gather(*self._background, return_exceptions=True)
+        await self.tokens.close()
+        if self.cache is not None:
+            self.cache.close()
+        if self.quota is not None:
+            await self.quota.close()
+
+    async def _send(self, method: str, url: str, *, authorized: bool = True, **kwargs) -> HttpResponse:
+        """
+        Toda llamada a Amadeus pasa por aquí: limitador del host, reintentos con
+        backoff (429/5xx, respetando Retry-After) y un único reintento tras
+        renovar el token si la API responde 401. Un backoff que no cabe en el
+        plazo en curso corta los reintentos.
+        """
+        base_headers = kwargs.pop("headers", None) or {}
+        attempt = 0
+        refreshed = False
+        while True:
+            headers = dict(base_headers)
+            token = None
+            if authorized:
+                token = await self.tokens.get()
+                headers["Authorization"] = f"Bearer {token}"
+            await self.limiter.acquire()
+            diagnostics.AMADEUS_EVENTS.add("request")
+            try:
+                r = await self.http.request(method, url, headers=headers, **kwargs)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt + 1 >= self.retry.max_attempts:
+                    diagnostics.AMADEUS_EVENTS.add("error")
+                    raise
+                delay = self.retry.delay(attempt)
+                deadline.check_sleep(delay)
+                RETRIES.inc(endpoint=_endpoint(url), reason="network")
+                log.warning(
+                    "Amadeus: error de red (%r); se reintenta", e,
+                    extra={"endpoint": _endpoint(url), "method": method, "status": "network",
+                           "attempt": attempt + 1, "retry_in_s": round(delay, 2)},
+                )
+                attempt += 1
+                await asyncio.sleep(delay)
+                continue
+
+            if r.status == 429:
+                THROTTLED.inc(endpoint=_endpoint(url))
+                diagnostics.AMADEUS_EVENTS.add("429")
+            elif authorized:
+                # Lo rechazado por rate limit no consume cuota
+                quota.note_call()
+                if self.quota is not None:
+                    self.quota.record(_endpoint(url))
+            if r.status == 401 and authorized and not refreshed:
+                refreshed = True
+                RETRIES.inc(endpoint=_endpoint(url), reason="401")
+                await self.tokens.invalidate(token)
+                continue
+            if self.retry.should_retry(r.status, attempt):
+                delay = self.retry.delay(attempt, parse_retry_after(r.headers.get("Retry-After")))
+                deadline.check_sleep(delay)
+                RETRIES.inc(endpoint=_endpoint(url), reason=str(r.status))
+                log.warning(
+                    "Amadeus: respuesta reintentable; se reintenta",
+                    extra={"endpoint": _endpoint(url), "method": method, "status": r.status,
+                           "attempt": attempt + 1, "retry_in_s": round(delay, 2)},
+                )
+                attempt += 1
+                await asyncio.sleep(delay)
+                continue
+            if r.status >= 400:
+                diagnostics.AMADEUS_EVENTS.add("error")
+            return r
 
     async def search_round_trip(
         self,
-        session: aiohttp.ClientSession,
         origin: str,
         destination: str,
         departure_date: str,
@@ -42,30 +162,210 @@ class AmadeusClient:
         market: str = "CL",
         adults: int = 1,
         max_results: int = 5,
-    ) -> List[Dict[str, Any]]:
-        await self._ensure_token(session)
+    ) -> List[Offer]:
+        if self.cache is None:
+            self._admit()
+            return await self._search_round_trip_live(
+                origin, destination, departure_date, return_date, currency, adults, max_results
+            )
+
+        key = search_key(origin, destination, departure_date, return_date, currency, adults, max_results)
+        offers, fresh = await self.cache.get(key)
+        if offers is not None:
+            # En ahorro de cuota, lo interactivo se conforma con lo vencido
+            if not fresh and not self._prefer_cache():
+                self._revalidate(key)
+            return offers
+
+        self._admit()
+        offers = await self._search_round_trip_live(
+            origin, destination, departure_date, return_date, currency, adults, max_results
+        )
+        await self.cache.put(key, offers)
+        return offers
+
+    async def search_one_way(
+        self,
+        origin: str,
+        destination: str,
+        departure_date: str,
+        currency: str = "USD",
+        market: str = "CL",
+        adults: int = 1,
+        max_results: int = 5,
+    ) -> List[Offer]:
+        """Solo ida: mismo camino (cache, reintentos) que search_round_trip, sin returnDate."""
+        return await self.search_round_trip(
+            origin, destination, departure_date, "", currency, market, adults, max_results
+        )
+
+    def _admit(self) -> None:
+        if self.quota is not None:
+            self.quota.admit()
+
+    def _prefer_cache(self) -> bool:
+        return self.quota is not None and self.quota.prefer_cache()
+
+    def _revalidate(self, key: CacheKey) -> None:
+        """
+        Refresca en segundo plano una entrada vencida que ya se sirvió (una vez
+        por clave). Corre en un contexto propio: no hereda el plazo del comando
+        que la disparó y cuenta como programada en el libro de cuota.
+        """
+        if key in self._revalidating:
+            return
+        self._revalidating.add(key)
+
+        async def run():
+            try:
+                with quota.purpose(quota.SCHEDULED):
+                    offers = await self._search_round_trip_live(*key)
+                await self.cache.put(key, offers)
+            except Exception as e:
+                log.warning("Revalidación con error: %s", e, extra={"route": f"{key[0]}-{key[1]}"})
+            finally:
+                self._revalidating.discard(key)
+
+        task = asyncio.get_running_loop().create_task(run(), context=contextvars.Context())
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def _search_round_trip_live(
+        self,
+        origin: str,
+        destination: str,
+        departure_date: str,
+        return_date: str,
+        currency: str,
+        adults: int,
+        max_results: int,
+    ) -> List[Offer]:
         url = f"{self.host}/v2/shopping/flight-offers"
-        headers = {"Authorization": f"Bearer {self._token}"}
         params = {
             "originLocationCode": origin,
             "destinationLocationCode": destination,
             "departureDate": departure_date,
-            "returnDate": return_date,
             "adults": str(adults),
             "currencyCode": currency,
             "max": str(max_results),
             "nonStop": "false",
         }
-        async with session.get(url, headers=headers, params=params) as r:
-            if r.status != 200:
-                text = await r.text()
-                raise RuntimeError(f"Amadeus {r.status}: {text}")
-            data = await r.json()
-            offers = data.get("data", [])
-            def price_total(o):
-                try:
-                    return float(o["price"]["grandTotal"])
-                except Exception:
-                    return 9e9
-            offers.sort(key=price_total)
-            return offers[:max_results]
+        # Sin regreso = solo ida (search_one_way)
+        if return_date:
+            params["returnDate"] = return_date
+        r = await self._send("GET", url, params=params)
+        if r.status != 200:
+            raise AmadeusError(r.status, r.text())
+        return parse_offers(r.json().get("data", []), max_results, keep_raw=self.keep_raw)
+
+    async def search_round_trip_batch(
+        self,
+        origins: List[str],
+        destinations: List[str],
+        departure_date: str,
+        return_date: str,
+        currency: str = "USD",
+        adults: int = 1,
+        max_results: int = 5,
+    ) -> Dict[Tuple[str, str], List[Offer]]:
+        """
+        Todas las rutas origins × destinations (mismas fechas) en un solo POST
+        flight-offers con códigos alternativos, repartidas de vuelta por ruta
+        (lista vacía si una ruta no tuvo ofertas). Lee la cache por ruta de
+        search_round_trip y, si no, la propia de los POST (batch_key): si todas
+        están frescas no hay request. Una tajada del POST solo se guarda con la
+        clave de search_round_trip si vino completa (max_results ofertas); una
+        corta puede deberse al cupo compartido y no vale como respuesta del GET.
+        """
+        if len(origins) > BATCH_MAX_CODES or len(destinations) > BATCH_MAX_CODES:
+            raise ValueError(f"Máximo {BATCH_MAX_CODES} aeropuertos por lado en una búsqueda múltiple")
+        routes = [(o, d) for o in origins for d in destinations]
+        keys = {r: search_key(r[0], r[1], departure_date, return_date, currency, adults, max_results) for r in routes}
+        if self.cache is not None:
+            stale_ok = self._prefer_cache()
+            cached: Dict[Tuple[str, str], List[Offer]] = {}
+            for route, key in keys.items():
+                for k in (key, batch_key(key)):
+                    offers, fresh = await self.cache.get(k)
+                    if offers is not None and (fresh or stale_ok):
+                        cached[route] = offers
+                        break
+                else:
+                    break
+            else:
+                return cached
+
+        self._admit()
+        # Amadeus cobra por request, no por oferta: cupo holgado para que las
+        # combinaciones abiertas (que se descartan) no dejen cortas a las rutas
+        pool = min(BATCH_MAX_OFFERS, max_results * len(routes) * _BATCH_HEADROOM)
+        by_route, returned = await self._search_batch_live(
+            origins, destinations, departure_date, return_date, currency, adults, pool
+        )
+        out = {r: by_route.get(r, [])[:max_results] for r in routes}
+        # Con el cupo lleno, una ruta corta puede ser culpa del cupo: esa va por GET.
+        # Si no se llenó, Amadeus devolvió todo lo que tenía y la tajada es completa.
+        full_pool = returned >= pool
+        short = [r for r, offers in out.items() if len(offers) < max_results] if full_pool else []
+        if short:
+            log.info("Búsqueda múltiple con rutas cortas: se completan por GET",
+                     extra={"routes": [f"{o}-{d}" for o, d in short], "pool": pool})
+            fallback = await asyncio.gather(*(
+                self.search_round_trip(o, d, departure_date, return_date, currency, adults=adults, max_results=max_results)
+                for o, d in short
+            ), return_exceptions=True)
+            for route, offers in zip(short, fallback):
+                if isinstance(offers, Exception):
+                    log.warning("GET de respaldo con error: %s", offers, extra={"route": f"{route[0]}-{route[1]}"})
+                else:
+                    out[route] = offers
+        if self.cache is not None:
+            for route, offers in out.items():
+                if route in short:
+                    continue  # el GET ya dejó su entrada
+                await self.cache.put(batch_key(keys[route]), offers)
+                if len(offers) >= max_results or not full_pool:
+                    await self.cache.put(keys[route], offers)
+        return out
+
+    async def _search_batch_live(
+        self,
+        origins: List[str],
+        destinations: List[str],
+        departure_date: str,
+        return_date: str,
+        currency: str,
+        adults: int,
+        max_offers: int,
+    ) -> Tuple[Dict[Tuple[str, str], List[Offer]], int]:
+        """(ofertas por ruta, cantidad de ofertas que devolvió Amadeus en total)."""
+        def leg(od_id: str, frm: List[str], to: List[str], date: str) -> dict:
+            od = {
+                "id": od_id,
+                "originLocationCode": frm[0],
+                "destinationLocationCode": to[0],
+                "departureDateTimeRange": {"date": date},
+            }
+            if len(frm) > 1:
+                od["alternativeOriginsCodes"] = frm[1:]
+            if len(to) > 1:
+                od["alternativeDestinationsCodes"] = to[1:]
+            return od
+
+        url = f"{self.host}/v2/shopping/flight-offers"
+        body = {
+            "currencyCode": currency,
+            "originDestinations": [
+                leg("1", origins, destinations, departure_date),
+                leg("2", destinations, origins, return_date),
+            ],
+            "travelers": [{"id": str(i + 1), "travelerType": "ADULT"} for i in range(adults)],
+            "sources": ["GDS"],
+            "searchCriteria": {"maxFlightOffers": min(BATCH_MAX_OFFERS, max_offers)},
+        }
+        r = await self._send("POST", url, json_body=body, headers={"X-HTTP-Method-Override": "GET"})
+        if r.status != 200:
+            raise AmadeusError(r.status, r.text())
+        # Cada ruta se recorta a max_results en search_round_trip_batch
+        data = r.json().get("data", [])
+        return parse_offers_by_route(data, max_offers, keep_raw=self.keep_raw), len(data)
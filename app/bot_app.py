@@ -1,3 +1,7 @@
+import logging
+import time
+from typing import Optional, Tuple
+
 import discord
 from discord.ext import commands
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
@@ -5,38 +9,144 @@ from apscheduler.triggers.cron import CronTrigger
 
 from .config import Settings
 from .commands import register_commands
+from .http_session import HttpSessionManager
+from .diagnostics import LoopLagMonitor
+from .metrics import MetricsServer
+from .startup import CommandSyncState, StartupTimer, tree_digest
 
+log = logging.getLogger(__name__)
 
-def create_bot(cfg: Settings, flights_service):
-    intents = discord.Intents.default()
-    bot = commands.Bot(command_prefix="!", intents=intents)
-    scheduler = AsyncIOScheduler(timezone=cfg.tz)
 
-    @bot.event
-    async def on_ready():
-        print(f"✅ Bot conectado como {bot.user} (ID: {bot.user.id})")
+class AmadeusBot(commands.Bot):
+    """Bot que además libera los recursos del servicio (tareas, pool HTTP) al apagarse."""
+    def __init__(
+        self,
+        *args,
+        cfg: Settings,
+        flights_service,
+        http_sessions: HttpSessionManager,
+        metrics_server: Optional[MetricsServer] = None,
+        startup: Optional[StartupTimer] = None,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self.cfg = cfg
+        self.flights_service = flights_service
+        self.http_sessions = http_sessions
+        self.metrics_server = metrics_server
+        self.loop_lag = LoopLagMonitor()
+        self.scheduler = AsyncIOScheduler(timezone=cfg.tz)
+        self.startup = startup or StartupTimer()
+        self.sync_state = CommandSyncState(cfg.data_path("command_sync.json"))
+        self._connecting_at: Optional[float] = None
+
+    async def setup_hook(self) -> None:
+        # Una sola vez por proceso, tras el login y antes de conectar al gateway
+        # (on_ready se repite en cada reconexión; aquí no)
+        with self.startup.phase("warm"):
+            # Token y FX en segundo plano: listos para el primer post o comando
+            self.flights_service.warm()
+            self.loop_lag.start()
+            if self.metrics_server is not None:
+                try:
+                    await self.metrics_server.start()
+                except OSError as e:
+                    log.warning("No se pudo abrir el endpoint de métricas: %s", e)
+                    self.metrics_server = None
+        with self.startup.phase("scheduler"):
+            self._schedule_jobs()
+        with self.startup.phase("sync"):
+            await self._sync_commands()
+        self._connecting_at = time.monotonic()
 
+    def _schedule_jobs(self) -> None:
+        cfg, fs = self.cfg, self.flights_service
         # Cron diario 11:00 America/Santiago
         trigger = CronTrigger(hour=11, minute=0, timezone=cfg.tz)
-        for job in scheduler.get_jobs():
-            scheduler.remove_job(job.id)
-        scheduler.add_job(flights_service.publish_daily, trigger, args=[bot], id="daily_flights")
-        if not scheduler.running:
-            scheduler.start()
+        self.scheduler.add_job(fs.publish_daily, trigger, args=[self], id="daily_flights")
+        if cfg.watch_enabled:
+            watch_trigger = CronTrigger(hour=cfg.watch_hour, minute=cfg.watch_minute, timezone=cfg.tz)
+            self.scheduler.add_job(fs.publish_watches, watch_trigger, args=[self], id="watches")
+        # Prefetch: deja búsquedas y FX listos unos minutos antes de cada post
+        lead = cfg.prefetch_lead_minutes
+        if lead > 0:
+            h, m = _minutes_before(11, 0, lead)
+            self.scheduler.add_job(fs.prefetch_daily, CronTrigger(hour=h, minute=m, timezone=cfg.tz),
+                                   id="daily_prefetch")
+            if cfg.watch_enabled:
+                h, m = _minutes_before(cfg.watch_hour, cfg.watch_minute, lead)
+                self.scheduler.add_job(fs.prefetch_watches, CronTrigger(hour=h, minute=m, timezone=cfg.tz),
+                                       id="watches_prefetch")
+        self.scheduler.start()
 
-        # ---- Slash commands: copiar globales al guild y sincronizar ----
+    async def _sync_commands(self) -> None:
+        """Copia los globales al guild (si hay) y sincroniza solo si el árbol cambió desde el último sync."""
+        cfg = self.cfg
+        guild = discord.Object(id=cfg.guild_id) if cfg.guild_id else None
+        if guild is not None:
+            self.tree.clear_commands(guild=guild)
+            self.tree.copy_global_to(guild=guild)
+        scope = f"{self.application_id}:" + (f"guild:{cfg.guild_id}" if guild else "global")
+        digest = tree_digest(self.tree, guild)
+        if cfg.command_sync == "off":
+            log.info("Slash commands: sync desactivado (COMMAND_SYNC=off)")
+            return
+        if cfg.command_sync == "auto" and not self.sync_state.changed(scope, digest):
+            log.info("Slash commands sin cambios desde el último sync: no se sincronizan", extra={"scope": scope})
+            return
         try:
-            if cfg.guild_id:
-                guild_obj = discord.Object(id=cfg.guild_id)
-                bot.tree.clear_commands(guild=guild_obj)
-                bot.tree.copy_global_to(guild=guild_obj)
-                await bot.tree.sync(guild=guild_obj)
-                print("✅ Slash commands sincronizados en guild (copiados desde global)")
-            else:
-                await bot.tree.sync()
-                print("✅ Slash commands sincronizados globalmente (puede tardar unos minutos)")
+            await self.tree.sync(guild=guild)
         except Exception as e:
-            print(f"❌ Error sync: {e}")
+            log.error("Error al sincronizar slash commands: %s", e, extra={"scope": scope})
+            return
+        self.sync_state.mark(scope, digest)
+        if guild is not None:
+            log.info("Slash commands sincronizados en guild (copiados desde global)", extra={"scope": scope})
+        else:
+            log.info("Slash commands sincronizados globalmente (puede tardar unos minutos)", extra={"scope": scope})
+
+    async def on_ready(self) -> None:
+        log.info("Bot conectado como %s", self.user, extra={"user_id": self.user.id})
+        if self._connecting_at is not None:
+            # Solo la primera vez: las reconexiones no son parte del arranque
+            self.startup.record("gateway", time.monotonic() - self._connecting_at)
+            self._connecting_at = None
+            log.info("Arranque completo", extra={"latency_ms": round(self.startup.elapsed() * 1000)})
+
+    async def close(self) -> None:
+        try:
+            await super().close()
+        finally:
+            if self.scheduler.running:
+                self.scheduler.shutdown(wait=False)
+            self.loop_lag.stop()
+            if self.metrics_server is not None:
+                await self.metrics_server.close()
+            await self.flights_service.close()
+            await self.http_sessions.close()
+
+
+def _minutes_before(hour: int, minute: int, lead: int) -> Tuple[int, int]:
+    """(hora, minuto) `lead` minutos antes de hour:minute, dando la vuelta a medianoche."""
+    total = (hour * 60 + minute - lead) % (24 * 60)
+    return total // 60, total % 60
 
+
+def create_bot(
+    cfg: Settings,
+    flights_service,
+    http_sessions: HttpSessionManager,
+    startup: Optional[StartupTimer] = None,
+):
+    intents = discord.Intents.default()
+    bot = AmadeusBot(
+        command_prefix="!",
+        intents=intents,
+        cfg=cfg,
+        flights_service=flights_service,
+        http_sessions=http_sessions,
+        metrics_server=MetricsServer(cfg.metrics_host, cfg.metrics_port) if cfg.metrics_port else None,
+        startup=startup,
+    )
     register_commands(bot, cfg, flights_service)
     return bot
@@ -0,0 +1,102 @@
+import heapq
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from .dates import add_days
+from .offers import Offer, by_price
+
+# (fecha de salida, noches)
+Cell = Tuple[str, int]
+
+
+@dataclass
+class PriceCalendar:
+    """Matriz salida × estadía con la oferta más barata de cada celda buscada."""
+    origin: str
+    dests: List[str]
+    departures: List[str]
+    stays: List[int]
+    # Celda buscada -> oferta más barata (None = sin ofertas)
+    cells: Dict[Cell, Optional[Offer]] = field(default_factory=dict)
+    pruned: Set[Cell] = field(default_factory=set)
+    failed: Set[Cell] = field(default_factory=set)
+    calls: int = 0
+
+    @staticmethod
+    def return_date(cell: Cell) -> str:
+        return add_days(cell[0], cell[1])
+
+    def price(self, cell: Cell) -> Optional[float]:
+        offer = self.cells.get(cell)
+        return offer.price if offer else None
+
+    def best_price(self) -> Optional[float]:
+        prices = [p for p in (self.price(c) for c in self.cells) if p is not None]
+        return min(prices) if prices else None
+
+    def top(self, n: int) -> List[Tuple[Cell, Offer]]:
+        found = [(c, o) for c, o in self.cells.items() if o]
+        return heapq.nsmallest(n, found, key=lambda co: by_price(co[1]))
+
+    def currency(self, default: str) -> str:
+        for offer in self.cells.values():
+            if offer:
+                return offer.currency or default
+        return default
+
+
+def coarse_cells(departures: List[str], stays: List[int], step: int) -> List[Cell]:
+    """Primera pasada: una de cada `step` salidas (incluida la última) × todas las estadías."""
+    step = max(1, step)
+    idx = list(range(0, len(departures), step))
+    if idx[-1] != len(departures) - 1:
+        idx.append(len(departures) - 1)
+    return [(departures[i], s) for i in idx for s in stays]
+
+
+def neighbor_estimate(cal: PriceCalendar, cell: Cell) -> Optional[float]:
+    """
+    Cota de referencia para una celda sin buscar: el mínimo de sus vecinas ya
+    buscadas (salida ±1 día con la misma estadía, misma salida con estadía
+    contigua). Los precios de días contiguos se mueven poco, así que si todas
+    las vecinas están muy por encima del mejor, la celda difícilmente lo bate.
+    """
+    dep, stay = cell
+    d_idx = cal.departures.index(dep)
+    s_idx = cal.stays.index(stay)
+    around: List[Cell] = []
+    for di in (d_idx - 1, d_idx + 1):
+        if 0 <= di < len(cal.departures):
+            around.append((cal.departures[di], stay))
+    for si in (s_idx - 1, s_idx + 1):
+        if 0 <= si < len(cal.stays):
+            around.append((dep, cal.stays[si]))
+    prices = [p for p in (cal.price(c) for c in around) if p is not None]
+    return min(prices) if prices else None
+
+
+def refine_cells(
+    cal: PriceCalendar,
+    candidates: Iterable[Cell],
+    slack: float,
+    max_cells: int,
+) -> List[Cell]:
+    """
+    Segunda pasada: descarta (marca como podadas) las celdas cuyas vecinas
+    superan al mejor precio por más de `slack` y ordena el resto de más a
+    menos prometedora, hasta `max_cells`.
+    """
+    best = cal.best_price()
+    scored: List[Tuple[float, Cell]] = []
+    for cell in candidates:
+        est = neighbor_estimate(cal, cell)
+        if best is not None and est is not None and est > best * (1 + slack):
+            cal.pruned.add(cell)
+            continue
+        # Sin información de vecinas: al final de la cola
+        scored.append((est if est is not None else 9e9, cell))
+    scored.sort()
+    chosen = [c for _, c in scored[: max(0, max_cells)]]
+    for _, cell in scored[max(0, max_cells):]:
+        cal.pruned.add(cell)
+    return chosen
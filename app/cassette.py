@@ -0,0 +1,208 @@
+import asyncio
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+from multidict import CIMultiDict
+
+from .http_session import HttpResponse, HttpSessionManager
+
+log = logging.getLogger(__name__)
+
+# Formato: MAGIC + registros [<II largo_clave, largo_blob>][clave utf-8][zlib(meta JSON \n cuerpo)]
+MAGIC = b"AMCASS1\n"
+_HEADER = struct.Struct("<II")
+
+# Nunca se guardan en el cassette (ni en la clave ni en la respuesta)
+SECRET_FIELDS = frozenset({"client_id", "client_secret", "access_token", "refresh_token", "password"})
+TOKEN_PLACEHOLDER = "cassette-token"
+# Headers de respuesta que importan al bot; el resto (cookies, trazas) se descarta
+_KEEP_HEADERS = ("content-type", "retry-after")
+_KEEP_PREFIXES = ("x-ratelimit", "ama-")
+
+
+class CassetteMiss(RuntimeError):
+    """El request no está grabado en el cassette (modo replay)."""
+
+
+def request_key(
+    method: str,
+    url: str,
+    params: Optional[Dict[str, str]] = None,
+    data: Optional[Dict[str, str]] = None,
+    json_body: Optional[Any] = None,
+) -> str:
+    """
+    Clave normalizada y legible: método, URL sin query, parámetros ordenados
+    (los de la URL y los de `params`), form sin secretos y JSON canónico.
+    """
+    parts = urlsplit(url)
+    query = dict(parse_qsl(parts.query))
+    query.update({k: str(v) for k, v in (params or {}).items()})
+    key = f"{method.upper()} {parts.scheme}://{parts.netloc.lower()}{parts.path}"
+    if query:
+        key += "?" + urlencode(sorted(query.items()))
+    form = {k: v for k, v in (data or {}).items() if k.lower() not in SECRET_FIELDS}
+    if form:
+        key += " form:" + urlencode(sorted(form.items()))
+    if json_body is not None:
+        key += " json:" + json.dumps(json_body, sort_keys=True, separators=(",", ":"))
+    return key
+
+
+def _scrub_body(body: bytes) -> bytes:
+    """Reemplaza tokens en respuestas OAuth; los demás cuerpos quedan intactos."""
+    if b"access_token" not in body:
+        return body
+    try:
+        js = json.loads(body)
+    except ValueError:
+        return body
+    if not isinstance(js, dict):
+        return body
+    for k in SECRET_FIELDS & js.keys():
+        js[k] = TOKEN_PLACEHOLDER
+    return json.dumps(js, separators=(",", ":")).encode()
+
+
+def _keep_header(name: str) -> bool:
+    name = name.lower()
+    return name in _KEEP_HEADERS or name.startswith(_KEEP_PREFIXES)
+
+
+def _encode(r: HttpResponse) -> bytes:
+    meta = {
+        "status": r.status,
+        "latency": round(r.latency, 4),
+        "headers": [[k, v] for k, v in r.headers.items() if _keep_header(k)],
+    }
+    raw = json.dumps(meta, separators=(",", ":")).encode() + b"\n" + _scrub_body(r.body)
+    return zlib.compress(raw, 6)
+
+
+def _decode(blob: bytes) -> HttpResponse:
+    raw = zlib.decompress(blob)
+    head, _, body = raw.partition(b"\n")
+    meta = json.loads(head)
+    return HttpResponse(
+        status=meta["status"],
+        body=body,
+        headers=CIMultiDict(meta.get("headers", [])),
+        latency=meta.get("latency", 0.0),
+    )
+
+
+class CassetteHttp:
+    """
+    Envuelve a HttpSessionManager con la misma interfaz `request()`:
+    - record: hace la llamada real y la agrega al cassette (comprimida, sin secretos);
+    - replay: no toca la red; sirve desde el archivo mapeado en memoria, con la
+      latencia original o cero. Si una clave se grabó varias veces (p. ej. un
+      429 y luego un 200) se reproducen en el mismo orden y después se repite
+      la última.
+    """
+    def __init__(self, inner: HttpSessionManager, path: str, mode: str, latency: str = "original"):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Modo de cassette inválido: {mode}")
+        self.inner = inner
+        self.path = path
+        self.mode = mode
+        self.replay_latency = latency != "zero"
+        self.stats: Dict[str, int] = {"served": 0, "missed": 0, "recorded": 0}
+        self._lock = threading.Lock()
+        self._started = False
+        self._mm: Optional[mmap.mmap] = None
+        self._file = None
+        self._index: Dict[str, List[Tuple[int, int]]] = {}
+        self._cursor: Dict[str, int] = {}
+        if mode == "replay":
+            self._open_replay()
+
+    # ---- replay ----
+    def _open_replay(self) -> None:
+        self._file = open(self.path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        if size < len(MAGIC):
+            raise ValueError(f"Cassette vacío o inválido: {self.path}")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[: len(MAGIC)] != MAGIC:
+            raise ValueError(f"Cassette con formato desconocido: {self.path}")
+        # Solo se indexan las claves; los cuerpos se descomprimen al servirlos
+        pos = len(MAGIC)
+        while pos + _HEADER.size <= size:
+            klen, blen = _HEADER.unpack_from(self._mm, pos)
+            pos += _HEADER.size
+            key = self._mm[pos: pos + klen].decode("utf-8")
+            pos += klen
+            self._index.setdefault(key, []).append((pos, blen))
+            pos += blen
+        log.info("Cassette %s: %d requests grabados", self.path, len(self._index))
+
+    def _replay(self, key: str) -> HttpResponse:
+        entries = self._index.get(key)
+        if not entries:
+            if "/security/oauth2/token" in key:
+                # El token grabado ya estaba reemplazado: se sintetiza uno igual
+                body = json.dumps({"access_token": TOKEN_PLACEHOLDER, "expires_in": 1799}).encode()
+                return HttpResponse(200, body, CIMultiDict({"Content-Type": "application/json"}))
+            self.stats["missed"] += 1
+            raise CassetteMiss(f"No está en el cassette: {key}")
+        i = self._cursor.get(key, 0)
+        self._cursor[key] = i + 1
+        offset, length = entries[min(i, len(entries) - 1)]
+        self.stats["served"] += 1
+        return _decode(self._mm[offset: offset + length])
+
+    # ---- record ----
+    def _append(self, key: str, blob: bytes) -> None:
+        kb = key.encode("utf-8")
+        with self._lock:
+            if not self._started:
+                # Cada sesión de grabación empieza un cassette nuevo
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                self._file = open(self.path, "wb")
+                self._file.write(MAGIC)
+                self._started = True
+            self._file.write(_HEADER.pack(len(kb), len(blob)) + kb + blob)
+            self._file.flush()
+
+    async def request(
+        self,
+        method: str,
+        url: str,
+        *,
+        params: Optional[Dict[str, str]] = None,
+        data: Optional[Dict[str, str]] = None,
+        json_body: Optional[Any] = None,
+        headers: Optional[Dict[str, str]] = None,
+        timeout: Optional[float] = None,
+    ) -> HttpResponse:
+        key = request_key(method, url, params, data, json_body)
+        if self.mode == "replay":
+            r = self._replay(key)
+            if self.replay_latency and r.latency > 0:
+                await asyncio.sleep(r.latency)
+            return r
+
+        r = await self.inner.request(
+            method, url, params=params, data=data, json_body=json_body, headers=headers, timeout=timeout
+        )
+        await asyncio.to_thread(self._append, key, _encode(r))
+        self.stats["recorded"] += 1
+        return r
+
+    async def close(self) -> None:
+        await self.inner.close()
+        with self._lock:
+            if self._mm is not None:
+                self._mm.close()
+                self._mm = None
+            if self._file is not None:
+                self._file.close()
+                self._file = None
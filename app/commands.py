@@ -1,19 +1,79 @@
 import discord
 from discord import app_commands
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import List, Optional, Tuple
+from contextlib import contextmanager
+
+from . import airports, deadline, quota
+from .amadeus_client import BATCH_MAX_CODES
+from .diagnostics import runtime_report
+
+
+# Estadías por /calendario: con 14 salidas, más columnas no caben en 2000 caracteres
+_CALENDAR_MAX_STAYS = 6
 
 
 def register_commands(bot: discord.Client, cfg, flights_service):
     tree = bot.tree
 
+    @contextmanager
+    def interactive():
+        """Plazo de comando + origen INTERACTIVE para el planificador de cuota."""
+        with deadline.budget(cfg.command_deadline_s), quota.purpose(quota.INTERACTIVE):
+            yield
+
+    async def quota_notice(interaction: discord.Interaction):
+        """Si la cuota del mes ya no está en modo normal, lo avisa (ephemeral) antes de buscar."""
+        planner = getattr(flights_service.amadeus, "quota", None)
+        mode = planner.mode() if planner is not None else quota.NORMAL
+        if mode == quota.CACHE_ONLY:
+            msg = ("ℹ️ Lo que queda de la cuota de Amadeus este mes está reservado para los posts "
+                   "programados: solo se muestran resultados en cache.")
+        elif mode == quota.SAVING:
+            msg = "ℹ️ Cuota de Amadeus en ahorro: se reutilizan resultados en cache aunque estén vencidos."
+        else:
+            return
+        await interaction.followup.send(msg, ephemeral=True)
+
+    async def send_city_to_city(
+        interaction: discord.Interaction, origin_codes, dest_codes, title: str, dep: str, ret: str
+    ):
+        """Origen ⇄ destinos al canal: progresivo (placeholder + ediciones) si STREAM_RESULTS."""
+        channel = bot.get_channel(cfg.channel_id)
+        if not channel:
+            await interaction.followup.send("❌ No pude encontrar el canal configurado.", ephemeral=True)
+            return
+        await quota_notice(interaction)
+        with interactive():
+            if cfg.stream_results:
+                await flights_service.stream_city_to_city(channel, origin_codes, dest_codes, title, dep, ret)
+                return
+            msg = await flights_service.fetch_city_to_city_specific_dates(origin_codes, dest_codes, title, dep, ret)
+        await channel.send(msg)
+
     @tree.command(name="probar", description="Publica ahora los vuelos (Tokio y Osaka)")
     async def probar(interaction: discord.Interaction):
+        # Es el mismo post de las 11:00 (corre con su plazo y cuenta como
+        # programado), así que en solo-cache no se adelanta: gastaría su reserva
+        planner = getattr(flights_service.amadeus, "quota", None)
+        if planner is not None and planner.mode() == quota.CACHE_ONLY:
+            await interaction.response.send_message(
+                "ℹ️ Lo que queda de la cuota de Amadeus este mes está reservado para el post "
+                "programado: /probar no está disponible hasta el próximo mes.",
+                ephemeral=True,
+            )
+            return
         await interaction.response.send_message("Enviando resultados al canal…", ephemeral=True)
-        await flights_service.publish_daily(bot)
+        published = await flights_service.publish_daily(bot)
+        if not published:
+            await interaction.followup.send(
+                "ℹ️ Ya había una publicación en curso o recién hecha: no se duplicó.", ephemeral=True
+            )
 
     @tree.command(name="diag", description="Diagnóstico rápido (sin exponer secretos)")
     async def diag(interaction: discord.Interaction):
+        # Solo lee contadores en memoria: responde al instante aunque haya un post en curso
+        runtime = runtime_report(flights_service, getattr(bot, "loop_lag", None))
         msg = (
             f"HOST: {cfg.amadeus_host}\n"
             f"CLIENT_ID_PRESENT: {bool(cfg.amadeus_client_id)}\n"
@@ -29,22 +89,48 @@ def register_commands(bot: discord.Client, cfg, flights_service):
             f"JP_DOM_RETURN: {getattr(cfg, 'jp_dom_return_env', None) or '(auto +1d)'}\n"
             f"CHANNEL_ID: {cfg.channel_id}\n"
             f"GUILD_ID: {cfg.guild_id}\n"
+            f"{runtime}"
         )
         await interaction.response.send_message(f"```{msg}```", ephemeral=True)
 
-    @tree.command(
-        name="hokkaido",
-        description="Tokio ⇄ Sapporo/Hakodate (puedes indicar fecha o usa variables de entorno)",
-    )
-    @app_commands.describe(
-        departure="Fecha de salida (YYYY-MM-DD)",
-        return_date="Fecha de regreso (YYYY-MM-DD, opcional; por defecto +1 día)",
-    )
-    async def hokkaido(
+    async def parse_dates(
         interaction: discord.Interaction,
-        departure: Optional[str] = None,
-        return_date: Optional[str] = None,
+        dep_str: str,
+        ret_str: Optional[str],
+        names: Tuple[str, str] = ("departure", "return_date"),
+        stay_days: int = 1,
+    ) -> Optional[Tuple[str, str]]:
+        """Valida salida/regreso (regreso por defecto: salida + stay_days); si no sirven, avisa y devuelve None."""
+        dep_name, ret_name = names
+        try:
+            d_dep = datetime.fromisoformat(dep_str).date()
+        except Exception:
+            await interaction.response.send_message(f"❗ `{dep_name}` inválida (usa YYYY-MM-DD).", ephemeral=True)
+            return None
+
+        if ret_str:
+            try:
+                d_ret = datetime.fromisoformat(ret_str).date()
+            except Exception:
+                await interaction.response.send_message(f"❗ `{ret_name}` inválida (usa YYYY-MM-DD).", ephemeral=True)
+                return None
+            if d_ret <= d_dep:
+                await interaction.response.send_message(
+                    f"❗ `{ret_name}` debe ser posterior a `{dep_name}`.", ephemeral=True
+                )
+                return None
+        else:
+            d_ret = d_dep + timedelta(days=stay_days)
+        return d_dep.isoformat(), d_ret.isoformat()
+
+    async def jp_domestic(
+        interaction: discord.Interaction,
+        departure: Optional[str],
+        return_date: Optional[str],
+        dest_codes,
+        title: str,
     ):
+        """Tokio ⇄ destino doméstico con fechas del comando o de JP_DOMESTIC_*."""
         dep_str = departure or getattr(cfg, "jp_dom_depart_env", None)
         ret_str = return_date or getattr(cfg, "jp_dom_return_env", None)
 
@@ -55,36 +141,32 @@ def register_commands(bot: discord.Client, cfg, flights_service):
             )
             return
 
-        try:
-            d_dep = datetime.fromisoformat(dep_str).date()
-        except Exception:
-            await interaction.response.send_message("❗ `departure` inválida (usa YYYY-MM-DD).", ephemeral=True)
+        dates = await parse_dates(interaction, dep_str, ret_str)
+        if not dates:
             return
-
-        if ret_str:
-            try:
-                d_ret = datetime.fromisoformat(ret_str).date()
-            except Exception:
-                await interaction.response.send_message("❗ `return_date` inválida (usa YYYY-MM-DD).", ephemeral=True)
-                return
-            if d_ret <= d_dep:
-                await interaction.response.send_message("❗ `return_date` debe ser posterior a `departure`.", ephemeral=True)
-                return
-        else:
-            d_ret = d_dep + timedelta(days=1)
-
         await interaction.response.send_message("Enviando resultados al canal…", ephemeral=True)
-        title = "✈️ Tokio ⇄ Hokkaidō (CTS/HKD) — Fecha seleccionada"
-        msg = await flights_service.fetch_city_to_city_specific_dates(
-            cfg.tokyo_codes,
+        await send_city_to_city(interaction, cfg.tokyo_codes, dest_codes, title, *dates)
+
+    @tree.command(
+        name="hokkaido",
+        description="Tokio ⇄ Sapporo/Hakodate (puedes indicar fecha o usa variables de entorno)",
+    )
+    @app_commands.describe(
+        departure="Fecha de salida (YYYY-MM-DD)",
+        return_date="Fecha de regreso (YYYY-MM-DD, opcional; por defecto +1 día)",
+    )
+    async def hokkaido(
+        interaction: discord.Interaction,
+        departure: Optional[str] = None,
+        return_date: Optional[str] = None,
+    ):
+        await jp_domestic(
+            interaction,
+            departure,
+            return_date,
             getattr(cfg, "hokkaido_codes", ["CTS", "HKD"]),
-            title,
-            d_dep.isoformat(),
-            d_ret.isoformat(),
+            "✈️ Tokio ⇄ Hokkaidō (CTS/HKD) — Fecha seleccionada",
         )
-        channel = bot.get_channel(cfg.channel_id)
-        if channel: await channel.send(msg)
-        else: await interaction.followup.send("❌ No pude encontrar el canal configurado.", ephemeral=True)
 
     @tree.command(
         name="okinawa",
@@ -99,43 +181,288 @@ def register_commands(bot: discord.Client, cfg, flights_service):
         departure: Optional[str] = None,
         return_date: Optional[str] = None,
     ):
-        dep_str = departure or getattr(cfg, "jp_dom_depart_env", None)
-        ret_str = return_date or getattr(cfg, "jp_dom_return_env", None)
+        await jp_domestic(
+            interaction,
+            departure,
+            return_date,
+            getattr(cfg, "okinawa_codes", ["OKA"]),
+            "✈️ Tokio ⇄ Okinawa (OKA) — Fecha seleccionada",
+        )
 
-        if not dep_str:
-            await interaction.response.send_message(
-                "❗ Debes pasar `departure` (YYYY-MM-DD) o configurar `JP_DOMESTIC_DEPART_DATE`.",
-                ephemeral=True,
-            )
+    @tree.command(name="buscar", description="Ida y vuelta entre dos ciudades o aeropuertos cualesquiera")
+    @app_commands.describe(
+        origen="Ciudad o aeropuerto de origen (ej: Santiago, SCL)",
+        destino="Ciudad o aeropuerto de destino (ej: Tokio, HND)",
+        salida="Fecha de salida (YYYY-MM-DD; por defecto la del post diario)",
+        regreso="Fecha de regreso (YYYY-MM-DD; por defecto, las noches del post diario)",
+    )
+    async def buscar(
+        interaction: discord.Interaction,
+        origen: str,
+        destino: str,
+        salida: Optional[str] = None,
+        regreso: Optional[str] = None,
+    ):
+        index = airports.index()
+        places = []
+        for name, text in (("origen", origen), ("destino", destino)):
+            place = index.resolve(text)
+            if place is None:
+                await interaction.response.send_message(
+                    f"❗ No reconozco `{text}` como {name}: elige una opción de la lista o usa códigos IATA.",
+                    ephemeral=True,
+                )
+                return
+            # Con búsqueda múltiple, hasta BATCH_MAX_CODES por lado: cada fecha
+            # sigue siendo un solo POST. Sin ella se busca ruta por ruta (GET).
+            if cfg.amadeus_batch_search and len(place.codes) > BATCH_MAX_CODES:
+                await interaction.response.send_message(
+                    f"❗ Máximo {BATCH_MAX_CODES} aeropuertos por lado (`{name}` tiene {len(place.codes)}).",
+                    ephemeral=True,
+                )
+                return
+            places.append(place)
+        src, dst = places
+        if set(src.codes) & set(dst.codes):
+            await interaction.response.send_message("❗ Origen y destino no pueden compartir aeropuertos.", ephemeral=True)
             return
 
-        try:
-            d_dep = datetime.fromisoformat(dep_str).date()
-        except Exception:
-            await interaction.response.send_message("❗ `departure` inválida (usa YYYY-MM-DD).", ephemeral=True)
+        dep, ret = flights_service.default_dates()
+        stay = (datetime.fromisoformat(ret) - datetime.fromisoformat(dep)).days
+        dates = await parse_dates(
+            interaction, salida or dep, regreso or (None if salida else ret), ("salida", "regreso"), stay
+        )
+        if not dates:
             return
+        await interaction.response.send_message("Enviando resultados al canal…", ephemeral=True)
+        title = f"🔎 {src.city} ⇄ {dst.city} ({'/'.join(dst.codes)}) — Búsqueda"
+        await send_city_to_city(interaction, list(src.codes), list(dst.codes), title, *dates)
 
-        if ret_str:
+    @buscar.autocomplete("origen")
+    @buscar.autocomplete("destino")
+    async def buscar_place(interaction: discord.Interaction, current: str) -> List[app_commands.Choice[str]]:
+        # Índice local en memoria: responde en microsegundos, sin la API de locations
+        return [app_commands.Choice(name=p.label, value=p.value) for p in airports.index().search(current)]
+
+    @tree.command(
+        name="calendario",
+        description="Calendario de precios con fechas flexibles (salidas × noches)",
+    )
+    @app_commands.describe(
+        destino="Ciudad de destino",
+        salida="Fecha de salida central (YYYY-MM-DD; por defecto la del post diario)",
+        dias="Cantidad de fechas de salida a barrer",
+        noches=f"Estadías a probar, separadas por coma (ej: 12,14,16; hasta {_CALENDAR_MAX_STAYS})",
+    )
+    @app_commands.choices(
+        destino=[
+            app_commands.Choice(name="Tokio", value="tokyo"),
+            app_commands.Choice(name="Osaka", value="osaka"),
+        ]
+    )
+    async def calendario(
+        interaction: discord.Interaction,
+        destino: app_commands.Choice[str],
+        salida: Optional[str] = None,
+        dias: Optional[app_commands.Range[int, 1, 14]] = None,
+        noches: Optional[str] = None,
+    ):
+        if salida:
             try:
-                d_ret = datetime.fromisoformat(ret_str).date()
+                datetime.fromisoformat(salida)
             except Exception:
-                await interaction.response.send_message("❗ `return_date` inválida (usa YYYY-MM-DD).", ephemeral=True)
+                await interaction.response.send_message("❗ `salida` inválida (usa YYYY-MM-DD).", ephemeral=True)
                 return
-            if d_ret <= d_dep:
-                await interaction.response.send_message("❗ `return_date` debe ser posterior a `departure`.", ephemeral=True)
+
+        stays = None
+        if noches:
+            try:
+                stays = [int(x) for x in noches.split(",") if x.strip()]
+            except ValueError:
+                stays = None
+            if not stays or any(n < 1 or n > 60 for n in stays):
+                await interaction.response.send_message("❗ `noches` inválidas (ej: 12,14,16).", ephemeral=True)
+                return
+            stays = sorted(set(stays))
+            if len(stays) > _CALENDAR_MAX_STAYS:
+                await interaction.response.send_message(
+                    f"❗ Como máximo {_CALENDAR_MAX_STAYS} estadías en `noches` (la matriz no cabe en un mensaje).",
+                    ephemeral=True,
+                )
                 return
-        else:
-            d_ret = d_dep + timedelta(days=1)
 
-        await interaction.response.send_message("Enviando resultados al canal…", ephemeral=True)
-        title = "✈️ Tokio ⇄ Okinawa (OKA) — Fecha seleccionada"
-        msg = await flights_service.fetch_city_to_city_specific_dates(
-            cfg.tokyo_codes,
-            getattr(cfg, "okinawa_codes", ["OKA"]),
-            title,
-            d_dep.isoformat(),
-            d_ret.isoformat(),
-        )
+        codes = cfg.tokyo_codes if destino.value == "tokyo" else cfg.osaka_codes
+        await interaction.response.send_message("Armando el calendario… (puede tardar unos segundos)", ephemeral=True)
+        title = f"📅 {cfg.origin} ⇄ {destino.name} ({'/'.join(codes)}) — Calendario de precios"
+        await quota_notice(interaction)
+        with interactive():
+            msg = await flights_service.fetch_price_calendar(codes, title, center=salida, days=dias, stays=stays)
+        channel = bot.get_channel(cfg.channel_id)
+        if not channel:
+            await interaction.followup.send("❌ No pude encontrar el canal configurado.", ephemeral=True)
+            return
+        try:
+            await channel.send(msg)
+        except discord.HTTPException as e:
+            await interaction.followup.send(f"❌ No pude publicar el calendario: {e.text or e.status}", ephemeral=True)
+
+    @tree.command(
+        name="openjaw",
+        description="Entrar por Tokio y salir por Osaka (o al revés), con el tramo interno",
+    )
+    @app_commands.describe(
+        salida="Fecha de salida (YYYY-MM-DD; por defecto la del post diario)",
+        noches="Noches de estadía (por defecto las del post diario)",
+        tramo="Sumar el tramo interno Tokio ⇄ Osaka (vuelo o Shinkansen)",
+    )
+    async def openjaw(
+        interaction: discord.Interaction,
+        salida: Optional[str] = None,
+        noches: Optional[app_commands.Range[int, 1, 60]] = None,
+        tramo: Optional[bool] = None,
+    ):
+        dep, ret = flights_service.default_dates()
+        if salida:
+            try:
+                datetime.fromisoformat(salida)
+            except Exception:
+                await interaction.response.send_message("❗ `salida` inválida (usa YYYY-MM-DD).", ephemeral=True)
+                return
+            stay = noches or (datetime.fromisoformat(ret) - datetime.fromisoformat(dep)).days
+            dep = salida
+            ret = (datetime.fromisoformat(salida) + timedelta(days=stay)).date().isoformat()
+        elif noches:
+            ret = (datetime.fromisoformat(dep) + timedelta(days=noches)).date().isoformat()
+
+        await interaction.response.send_message("Combinando idas y vueltas… (puede tardar unos segundos)", ephemeral=True)
+        title = f"🔀 {cfg.origin} → Tokio / Osaka → {cfg.origin} — Open-jaw"
+        await quota_notice(interaction)
+        with interactive():
+            msg = await flights_service.fetch_open_jaw(title, dep, ret, hop=tramo)
         channel = bot.get_channel(cfg.channel_id)
         if channel: await channel.send(msg)
         else: await interaction.followup.send("❌ No pude encontrar el canal configurado.", ephemeral=True)
+
+    @tree.command(name="history", description="Histórico de precios por ruta (mínimo, mediana y tendencia)")
+    @app_commands.describe(
+        destino="Ruta a consultar",
+        dias="Días hacia atrás (por defecto 30)",
+    )
+    @app_commands.choices(
+        destino=[
+            app_commands.Choice(name="SCL ⇄ Tokio", value="tokyo"),
+            app_commands.Choice(name="SCL ⇄ Osaka", value="osaka"),
+            app_commands.Choice(name="Tokio ⇄ Hokkaidō", value="hokkaido"),
+            app_commands.Choice(name="Tokio ⇄ Okinawa", value="okinawa"),
+        ]
+    )
+    async def history(
+        interaction: discord.Interaction,
+        destino: app_commands.Choice[str],
+        dias: Optional[app_commands.Range[int, 1, 3650]] = None,
+    ):
+        routes = {
+            "tokyo": ([cfg.origin], cfg.tokyo_codes),
+            "osaka": ([cfg.origin], cfg.osaka_codes),
+            "hokkaido": (cfg.tokyo_codes, getattr(cfg, "hokkaido_codes", ["CTS", "HKD"])),
+            "okinawa": (cfg.tokyo_codes, getattr(cfg, "okinawa_codes", ["OKA"])),
+        }
+        origins, dests = routes[destino.value]
+        if destino.value in ("hokkaido", "okinawa"):
+            dates = flights_service.domestic_history_dates()
+        else:
+            dates = flights_service.history_dates()
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        title = f"📈 {destino.name} ({'/'.join(origins)}→{'/'.join(dests)}) — Histórico"
+        with deadline.budget(cfg.command_deadline_s):
+            msg = await flights_service.history_report(origins, dests, title, dias or 30, dates)
+        await interaction.followup.send(msg, ephemeral=True)
+
+    # ---- /watch add|list|remove ----
+    watch = app_commands.Group(name="watch", description="Sigue una ruta y recibe el mejor precio cada día")
+
+    @watch.command(name="add", description="Seguir una ruta (ida y vuelta) en una ventana de fechas")
+    @app_commands.describe(
+        origen="Aeropuerto de origen (IATA, ej: SCL)",
+        destino="Aeropuerto de destino (IATA, ej: NRT)",
+        salida="Primera fecha de salida (YYYY-MM-DD)",
+        noches="Noches de estadía",
+        flex="Días extra de salida a considerar desde `salida`",
+        precio_max="Solo avisarme si el mejor precio es menor o igual a esto",
+    )
+    async def watch_add(
+        interaction: discord.Interaction,
+        origen: str,
+        destino: str,
+        salida: str,
+        noches: app_commands.Range[int, 1, 60] = 14,
+        flex: app_commands.Range[int, 0, 14] = 0,
+        precio_max: Optional[app_commands.Range[float, 1, None]] = None,
+    ):
+        store = flights_service.watches
+        if store is None:
+            await interaction.response.send_message("❗ Las watches están desactivadas (WATCH_ENABLED).", ephemeral=True)
+            return
+        origen, destino = origen.strip().upper(), destino.strip().upper()
+        if not (len(origen) == 3 and origen.isalpha() and len(destino) == 3 and destino.isalpha()) or origen == destino:
+            await interaction.response.send_message("❗ Usa códigos IATA de 3 letras distintos (ej: SCL, NRT).", ephemeral=True)
+            return
+        try:
+            d_dep = datetime.fromisoformat(salida).date()
+        except Exception:
+            await interaction.response.send_message("❗ `salida` inválida (usa YYYY-MM-DD).", ephemeral=True)
+            return
+        if d_dep + timedelta(days=flex) <= datetime.now(cfg.tz).date():
+            await interaction.response.send_message("❗ La ventana de salida ya pasó.", ephemeral=True)
+            return
+        if flex > cfg.watch_max_flex_days:
+            await interaction.response.send_message(
+                f"❗ `flex` máximo: {cfg.watch_max_flex_days} días.", ephemeral=True
+            )
+            return
+
+        w, reason = await store.add(
+            interaction.user.id, origen, destino, d_dep.isoformat(), flex, noches, precio_max
+        )
+        if w is None:
+            await interaction.response.send_message(f"❗ No se agregó: {reason}.", ephemeral=True)
+            return
+        await interaction.response.send_message(
+            f"👀 Watch #{w.id}: {w.origin} ⇄ {w.destination}, salida {w.departure}"
+            f"{f' +{w.flex_days}d' if w.flex_days else ''}, {w.nights} noches"
+            f"{f', ≤ {w.max_price:,.2f} {cfg.primary_currency}' if w.max_price else ''}. "
+            f"Se revisa todos los días a las {cfg.watch_hour:02d}:{cfg.watch_minute:02d}.",
+            ephemeral=True,
+        )
+
+    @watch.command(name="list", description="Ver las rutas que sigues")
+    async def watch_list(interaction: discord.Interaction):
+        store = flights_service.watches
+        if store is None:
+            await interaction.response.send_message("❗ Las watches están desactivadas (WATCH_ENABLED).", ephemeral=True)
+            return
+        items = await store.list(interaction.user.id)
+        if not items:
+            await interaction.response.send_message("No sigues ninguna ruta. Usa `/watch add`.", ephemeral=True)
+            return
+        lines = [
+            f"#{w.id} {w.origin} ⇄ {w.destination} | salida {w.departure}"
+            f"{f' +{w.flex_days}d' if w.flex_days else ''} | {w.nights} noches"
+            f"{f' | ≤ {w.max_price:,.2f}' if w.max_price else ''}"
+            for w in items
+        ]
+        await interaction.response.send_message("```" + "\n".join(lines) + "```", ephemeral=True)
+
+    @watch.command(name="remove", description="Dejar de seguir una ruta")
+    @app_commands.describe(id="Número de la watch (ver /watch list)")
+    async def watch_remove(interaction: discord.Interaction, id: int):
+        store = flights_service.watches
+        if store is None:
+            await interaction.response.send_message("❗ Las watches están desactivadas (WATCH_ENABLED).", ephemeral=True)
+            return
+        if await store.remove(interaction.user.id, id):
+            await interaction.response.send_message(f"🗑️ Watch #{id} eliminada.", ephemeral=True)
+        else:
+            await interaction.response.send_message(f"❗ No tienes una watch #{id}.", ephemeral=True)
+
+    tree.add_command(watch)
@@ -13,18 +13,49 @@ def _split_csv(name: str, default: str = "") -> List[str]:
     return [x.strip() for x in raw.split(",") if x.strip()]
 
 
+def _int(name: str, default: int) -> int:
+    return int(_env(name, str(default)) or default)
+
+
+def _float(name: str, default: float) -> float:
+    return float(_env(name, str(default)) or default)
+
+
+def _bool(name: str, default: bool) -> bool:
+    raw = _env(name)
+    if raw is None or raw == "":
+        return default
+    return raw.lower() in ("1", "true", "yes", "y")
+
+
 @dataclass
 class Settings:
     # --- Discord ---
     token: str = field(default_factory=lambda: _env("DISCORD_TOKEN", ""))
     channel_id: int = field(default_factory=lambda: int((_env("DISCORD_CHANNEL_ID", "0") or "0")))
     guild_id: int = field(default_factory=lambda: int((_env("GUILD_ID", "0") or "0")))
+    # auto = sincroniza slash commands solo si cambió su hash; always | off
+    command_sync: str = field(default_factory=lambda: (_env("COMMAND_SYNC", "auto") or "auto").lower())
 
     # --- Amadeus (requeridos) ---
     amadeus_host: str = field(default_factory=lambda: _env("AMADEUS_HOST", "https://test.api.amadeus.com"))
     amadeus_client_id: str = field(default_factory=lambda: _env("AMADEUS_CLIENT_ID", ""))
     amadeus_client_secret: str = field(default_factory=lambda: _env("AMADEUS_CLIENT_SECRET", ""))
 
+    # --- Límite de tasa y reintentos contra Amadeus ---
+    amadeus_tps: float = field(default_factory=lambda: _float("AMADEUS_TPS", 8))
+    amadeus_burst: int = field(default_factory=lambda: _int("AMADEUS_BURST", 2))
+    amadeus_max_attempts: int = field(default_factory=lambda: _int("AMADEUS_MAX_ATTEMPTS", 4))
+    amadeus_backoff_base_s: float = field(default_factory=lambda: _float("AMADEUS_BACKOFF_BASE_SECONDS", 0.5))
+    amadeus_backoff_max_s: float = field(default_factory=lambda: _float("AMADEUS_BACKOFF_MAX_SECONDS", 8))
+    # Llamadas gratuitas por mes (libro + planificador de cuota; 0 = solo contar)
+    amadeus_monthly_quota: int = field(default_factory=lambda: _int("AMADEUS_MONTHLY_QUOTA", 2000))
+    # Llamadas por día reservadas para los posts programados (mínimo; si el ritmo real es mayor, manda ese)
+    quota_reserve_per_day: float = field(default_factory=lambda: _float("QUOTA_RESERVE_PER_DAY", 10))
+    # % de la cuota (uso + reserva) desde el que lo interactivo ahorra / queda solo en cache
+    quota_soft_pct: float = field(default_factory=lambda: _float("QUOTA_SOFT_PCT", 80))
+    quota_hard_pct: float = field(default_factory=lambda: _float("QUOTA_HARD_PCT", 100))
+
     # --- Búsqueda (acepta nombres nuevos y antiguos) ---
     amadeus_market: str = field(default_factory=lambda: _env("AMADEUS_MARKET", _env("MARKET", "CL")) or "CL")
     amadeus_currency: str = field(default_factory=lambda: _env("AMADEUS_CURRENCY", _env("CURRENCY", "USD")) or "USD")
@@ -34,10 +65,76 @@ class Settings:
     days_ahead: int = field(default_factory=lambda: int(_env("DAYS_AHEAD", "60") or "60"))
     stay_nights: int = field(default_factory=lambda: int(_env("STAY_NIGHTS", "14") or "14"))
     max_results: int = field(default_factory=lambda: int(_env("MAX_RESULTS", "5") or "5"))
+    # Máximo de búsquedas simultáneas contra Amadeus (origen×destino×fechas)
+    search_concurrency: int = field(default_factory=lambda: _int("SEARCH_CONCURRENCY", 4))
+    # Rutas con las mismas fechas (p. ej. NRT/HND) en un solo POST flight-offers
+    amadeus_batch_search: bool = field(default_factory=lambda: _bool("AMADEUS_BATCH_SEARCH", True))
+
+    # --- Prefetch: búsquedas y FX se adelantan este lapso antes de cada post (0 = desactivado) ---
+    prefetch_lead_minutes: int = field(default_factory=lambda: _int("PREFETCH_LEAD_MINUTES", 10))
+    # Más viejo que esto, el post ignora lo adelantado y consulta en vivo
+    prefetch_max_age_minutes: int = field(default_factory=lambda: _int("PREFETCH_MAX_AGE_MINUTES", 30))
+
+    # --- Plazos: cota dura de latencia; lo que no llega a tiempo sale marcado (0 = sin plazo) ---
+    publish_deadline_s: float = field(default_factory=lambda: _float("PUBLISH_DEADLINE_SECONDS", 90))
+    command_deadline_s: float = field(default_factory=lambda: _float("COMMAND_DEADLINE_SECONDS", 30))
+
+    # --- Deduplicación: off | inflight (solo en curso) | reuse (en curso + COALESCE_REUSE_SECONDS después) ---
+    coalesce: str = field(default_factory=lambda: (_env("COALESCE", "reuse") or "reuse").lower())
+    coalesce_reuse_s: float = field(default_factory=lambda: _float("COALESCE_REUSE_SECONDS", 60))
+
+    # --- Respuestas progresivas: se publica al instante y se edita a medida que llegan piernas ---
+    stream_results: bool = field(default_factory=lambda: _bool("STREAM_RESULTS", True))
+    # Mínimo entre ediciones de un mismo mensaje (Discord limita las ediciones por canal)
+    stream_edit_interval_s: float = field(default_factory=lambda: _float("STREAM_EDIT_INTERVAL_SECONDS", 1.0))
+
+    # --- Calendario de precios (fechas flexibles) ---
+    calendar_days: int = field(default_factory=lambda: _int("CALENDAR_DAYS", 7))
+    calendar_stays: List[int] = field(default_factory=lambda: [int(x) for x in _split_csv("CALENDAR_STAYS", "12,14,16")])
+    # Presupuesto de llamadas a Amadeus por calendario (cada celda cuesta 1 por destino)
+    calendar_max_calls: int = field(default_factory=lambda: _int("CALENDAR_MAX_CALLS", 40))
+    calendar_coarse_step: int = field(default_factory=lambda: _int("CALENDAR_COARSE_STEP", 2))
+    calendar_prune_slack: float = field(default_factory=lambda: _float("CALENDAR_PRUNE_SLACK", 0.15))
+    calendar_offers_per_cell: int = field(default_factory=lambda: _int("CALENDAR_OFFERS_PER_CELL", 3))
+    calendar_in_daily: bool = field(default_factory=lambda: _bool("CALENDAR_IN_DAILY", False))
+
+    # --- Open-jaw: entrar por Tokio y salir por Osaka (o al revés) ---
+    openjaw_results: int = field(default_factory=lambda: _int("OPENJAW_RESULTS", 3))
+    # Incluir el tramo interno Tokio⇄Osaka (vuelo o Shinkansen) a mitad de la estadía
+    openjaw_hop: bool = field(default_factory=lambda: _bool("OPENJAW_HOP", True))
+    # Tarifa fija del Shinkansen en la moneda primaria (0 = solo vuelos internos)
+    shinkansen_fare: float = field(default_factory=lambda: _float("SHINKANSEN_FARE", 100))
+    openjaw_in_daily: bool = field(default_factory=lambda: _bool("OPENJAW_IN_DAILY", False))
+
+    # --- Histórico de precios y alertas ---
+    history_enabled: bool = field(default_factory=lambda: _bool("HISTORY_ENABLED", True))
+    # Ofertas crudas (el resumen diario se conserva; 0 = para siempre)
+    history_retention_days: int = field(default_factory=lambda: _int("HISTORY_RETENTION_DAYS", 180))
+    history_daily_retention_days: int = field(default_factory=lambda: _int("HISTORY_DAILY_RETENTION_DAYS", 0))
+    history_alert_percentile: float = field(default_factory=lambda: _float("HISTORY_ALERT_PERCENTILE", 10))
+    history_alert_window_days: int = field(default_factory=lambda: _int("HISTORY_ALERT_WINDOW_DAYS", 30))
+    history_alert_min_samples: int = field(default_factory=lambda: _int("HISTORY_ALERT_MIN_SAMPLES", 7))
+
+    # --- Watches (/watch): rutas seguidas por usuario ---
+    watch_enabled: bool = field(default_factory=lambda: _bool("WATCH_ENABLED", True))
+    watch_max_per_user: int = field(default_factory=lambda: _int("WATCH_MAX_PER_USER", 10))
+    # Cada día de flexibilidad es una consulta más por ruta
+    watch_max_flex_days: int = field(default_factory=lambda: _int("WATCH_MAX_FLEX_DAYS", 3))
+    watch_hour: int = field(default_factory=lambda: _int("WATCH_HOUR", 11))
+    watch_minute: int = field(default_factory=lambda: _int("WATCH_MINUTE", 5))
 
     # --- Monedas ---
     second_currency: str = field(default_factory=lambda: (_env("SECOND_CURRENCY", "CLP") or "CLP"))
     fx_usdclp: Optional[str] = field(default_factory=lambda: _env("FX_USDCLP"))
+    fx_cache_hours: int = field(default_factory=lambda: _int("FX_CACHE_HOURS", 12))
+    fx_refresh_margin_minutes: int = field(default_factory=lambda: _int("FX_REFRESH_MARGIN_MINUTES", 30))
+    fx_persist: bool = field(default_factory=lambda: _bool("FX_PERSIST", True))
+    fx_hedge_min_ms: int = field(default_factory=lambda: _int("FX_HEDGE_MIN_MS", 300))
+    fx_hedge_max_ms: int = field(default_factory=lambda: _int("FX_HEDGE_MAX_MS", 3000))
+    fx_breaker_failures: int = field(default_factory=lambda: _int("FX_BREAKER_FAILURES", 3))
+    fx_breaker_cooldown_s: int = field(default_factory=lambda: _int("FX_BREAKER_COOLDOWN_SECONDS", 300))
+    fx_dinero_url: str = field(default_factory=lambda: _env("FX_DINERO_URL", "https://cdn.dinero.today/api/latest.json"))
+    fx_exchangerate_url: str = field(default_factory=lambda: _env("FX_EXCHANGERATE_URL", "https://api.exchangerate.host/latest"))
 
     # --- Fechas (nombres nuevos y antiguos) ---
     depart_date_env: Optional[str] = field(default_factory=lambda: _env("DEPART_DATE") or _env("DEPARTURE_DATE"))
@@ -49,8 +146,50 @@ class Settings:
     jp_dom_return_env: Optional[str] = field(default_factory=lambda: _env("JP_DOMESTIC_RETURN_DATE"))
     okinawa_codes: List[str] = field(default_factory=lambda: _split_csv("OKINAWA_CODES", "OKA"))  # ← NUEVO
 
+    # --- Cache de búsquedas (TTL 0 = desactivada) ---
+    search_cache_ttl_s: int = field(default_factory=lambda: _int("SEARCH_CACHE_TTL_SECONDS", 1800))
+    search_cache_stale_s: int = field(default_factory=lambda: _int("SEARCH_CACHE_STALE_SECONDS", 600))
+    search_cache_max_entries: int = field(default_factory=lambda: _int("SEARCH_CACHE_MAX_ENTRIES", 256))
+    search_cache_disk: bool = field(default_factory=lambda: _bool("SEARCH_CACHE_DISK", False))
+
+    # --- Token OAuth ---
+    # Se renueva en segundo plano este margen antes de vencer
+    token_refresh_margin_s: int = field(default_factory=lambda: _int("TOKEN_REFRESH_MARGIN_SECONDS", 300))
+    token_persist: bool = field(default_factory=lambda: _bool("TOKEN_PERSIST", True))
+
+    # --- HTTP (pool compartido por Amadeus y FX) ---
+    http_limit: int = field(default_factory=lambda: _int("HTTP_LIMIT", 20))
+    http_limit_per_host: int = field(default_factory=lambda: _int("HTTP_LIMIT_PER_HOST", 8))
+    http_keepalive_s: float = field(default_factory=lambda: _float("HTTP_KEEPALIVE_SECONDS", 30))
+    http_dns_ttl_s: int = field(default_factory=lambda: _int("HTTP_DNS_TTL_SECONDS", 300))
+    http_timeout_s: float = field(default_factory=lambda: _float("HTTP_TIMEOUT_SECONDS", 35))
+    http_connect_timeout_s: float = field(default_factory=lambda: _float("HTTP_CONNECT_TIMEOUT_SECONDS", 10))
+
+    # --- Cassettes HTTP (off | record | replay) ---
+    cassette_mode: str = field(default_factory=lambda: (_env("CASSETTE_MODE", "off") or "off").lower())
+    cassette_path: Optional[str] = field(default_factory=lambda: _env("CASSETTE_PATH"))
+    # original = misma latencia que al grabar; zero = sin esperas
+    cassette_latency: str = field(default_factory=lambda: (_env("CASSETTE_LATENCY", "original") or "original").lower())
+
+    # --- Métricas (Prometheus en /metrics; puerto 0 = desactivado) ---
+    metrics_host: str = field(default_factory=lambda: _env("METRICS_HOST", "127.0.0.1") or "127.0.0.1")
+    metrics_port: int = field(default_factory=lambda: _int("METRICS_PORT", 9108))
+
+    # --- Logs (JSON por una cola a un hilo escritor; ver app/logs.py) ---
+    log_level: str = field(default_factory=lambda: (_env("LOG_LEVEL", "INFO") or "INFO").upper())
+    # json | text
+    log_format: str = field(default_factory=lambda: (_env("LOG_FORMAT", "json") or "json").lower())
+    # Avisos repetidos: pasan LOG_SAMPLE_BURST por ventana de LOG_SAMPLE_WINDOW_SECONDS (0 = sin muestreo)
+    log_sample_burst: int = field(default_factory=lambda: _int("LOG_SAMPLE_BURST", 5))
+    log_sample_window_s: float = field(default_factory=lambda: _float("LOG_SAMPLE_WINDOW_SECONDS", 60))
+    log_queue_size: int = field(default_factory=lambda: _int("LOG_QUEUE_SIZE", 10000))
+
     # --- Otros ---
+    # Estado persistente (token, caches, históricos…)
+    data_dir: str = field(default_factory=lambda: _env("DATA_DIR", ".data") or ".data")
     timezone_str: str = field(default_factory=lambda: _env("TIMEZONE", "America/Santiago"))
+    # Conserva el JSON crudo de cada oferta (memoria extra; solo para depurar)
+    debug_raw_offers: bool = field(default_factory=lambda: _bool("DEBUG_RAW_OFFERS", False))
     echo_verify: bool = field(default_factory=lambda: (_env("ECHO_VERIFY", "false") or "false").lower() in ("1", "true", "yes", "y"))
 
     def __post_init__(self):
@@ -61,11 +200,23 @@ class Settings:
             missing.append("AMADEUS_CLIENT_SECRET")
         if missing:
             raise ValueError("Faltan variables de entorno obligatorias: " + ", ".join(missing))
+        if self.cassette_mode not in ("off", "record", "replay"):
+            raise ValueError(f"CASSETTE_MODE inválido: {self.cassette_mode} (off | record | replay)")
+        if self.log_format not in ("json", "text"):
+            raise ValueError(f"LOG_FORMAT inválido: {self.log_format} (json | text)")
+        if self.command_sync not in ("auto", "always", "off"):
+            raise ValueError(f"COMMAND_SYNC inválido: {self.command_sync} (auto | always | off)")
+        if self.coalesce not in ("off", "inflight", "reuse"):
+            raise ValueError(f"COALESCE inválido: {self.coalesce} (off | inflight | reuse)")
 
         self.amadeus_host = self.amadeus_host.rstrip("/")
         self.amadeus_market = (self.amadeus_market or "CL").upper()
         self.amadeus_currency = (self.amadeus_currency or "USD").upper()
         self.second_currency = (self.second_currency or "CLP").upper()
+        self.search_concurrency = max(1, self.search_concurrency)
+
+    def data_path(self, name: str) -> str:
+        return os.path.join(self.data_dir, name)
 
     # ---- Compatibilidad con el resto del código ----
     @property
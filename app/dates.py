@@ -1,7 +1,10 @@
+import logging
 from datetime import datetime, timedelta
-from typing import Optional, Tuple
+from typing import List, Optional, Tuple
 import pytz
 
+log = logging.getLogger(__name__)
+
 def parse_env_dates(dep_env: str, ret_env: str) -> Optional[Tuple[str, str]]:
     if not dep_env or not ret_env:
         return None
@@ -9,11 +12,11 @@ def parse_env_dates(dep_env: str, ret_env: str) -> Optional[Tuple[str, str]]:
         d1 = datetime.fromisoformat(dep_env).date()
         d2 = datetime.fromisoformat(ret_env).date()
         if d1 >= d2:
-            print("[WARN] RETURN_DATE debe ser posterior a DEPARTURE_DATE; se ignorarán fechas fijas.")
+            log.warning("RETURN_DATE debe ser posterior a DEPARTURE_DATE; se ignorarán fechas fijas.")
             return None
         return d1.isoformat(), d2.isoformat()
     except ValueError:
-        print("[WARN] Formato inválido en DEPARTURE_DATE/RETURN_DATE (usa YYYY-MM-DD).")
+        log.warning("Formato inválido en DEPARTURE_DATE/RETURN_DATE (usa YYYY-MM-DD).")
         return None
 
 def compute_dates(days_ahead: int, stay_nights: int, tz: pytz.timezone) -> Tuple[str, str]:
@@ -21,3 +24,25 @@ def compute_dates(days_ahead: int, stay_nights: int, tz: pytz.timezone) -> Tuple
     dpt = (today + timedelta(days=days_ahead)).date()
     rtn = dpt + timedelta(days=stay_nights)
     return dpt.isoformat(), rtn.isoformat()
+
+def jp_domestic_dates(dep_env: Optional[str], ret_env: Optional[str]) -> Optional[Tuple[str, str]]:
+    """Fechas de JP_DOMESTIC_*: la salida es obligatoria y el regreso por defecto es +1 día."""
+    if not dep_env:
+        return None
+    try:
+        d1 = datetime.fromisoformat(dep_env).date()
+        d2 = datetime.fromisoformat(ret_env).date() if ret_env else d1 + timedelta(days=1)
+    except ValueError:
+        return None
+    if d2 <= d1:
+        return None
+    return d1.isoformat(), d2.isoformat()
+
+def add_days(iso_date: str, days: int) -> str:
+    return (datetime.fromisoformat(iso_date).date() + timedelta(days=days)).isoformat()
+
+def departure_window(center: str, days: int, tz: pytz.timezone) -> List[str]:
+    """`days` fechas de salida centradas en `center`, nunca antes de mañana."""
+    tomorrow = (datetime.now(tz) + timedelta(days=1)).date()
+    start = max(datetime.fromisoformat(center).date() - timedelta(days=days // 2), tomorrow)
+    return [(start + timedelta(days=i)).isoformat() for i in range(max(1, days))]
@@ -0,0 +1,77 @@
+import asyncio
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Awaitable, Iterator, Optional, TypeVar
+
+T = TypeVar("T")
+
+# Instante (time.monotonic) en que vence la operación en curso. Lo fija el post
+# diario o el slash command; las tareas hijas (piernas, FX, reintentos) lo heredan.
+DEADLINE: ContextVar[Optional[float]] = ContextVar("deadline", default=None)
+
+
+class DeadlineExceeded(asyncio.TimeoutError):
+    """Se agotó el plazo de la operación (la pierna queda marcada como sin respuesta)."""
+
+
+@contextmanager
+def budget(seconds: float) -> Iterator[None]:
+    """Plazo de `seconds` para el bloque; si ya había uno más corto, manda ese. 0 = sin plazo."""
+    if seconds <= 0:
+        yield
+        return
+    current = DEADLINE.get()
+    until = time.monotonic() + seconds
+    token = DEADLINE.set(until if current is None else min(current, until))
+    try:
+        yield
+    finally:
+        DEADLINE.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """Segundos que quedan (puede ser negativo) o None si no hay plazo."""
+    until = DEADLINE.get()
+    return None if until is None else until - time.monotonic()
+
+
+def clamp(timeout: Optional[float]) -> Optional[float]:
+    """Recorta un timeout de I/O a lo que queda del plazo; si ya venció, lo avisa."""
+    left = remaining()
+    if left is None:
+        return timeout
+    if left <= 0:
+        raise DeadlineExceeded("plazo agotado")
+    return left if timeout is None else min(timeout, left)
+
+
+def check_sleep(delay: float) -> None:
+    """Antes de un backoff: no tiene sentido dormir si el reintento no alcanza a terminar."""
+    left = remaining()
+    if left is not None and delay >= left:
+        raise DeadlineExceeded(f"sin plazo para reintentar ({left:.1f}s restantes)")
+
+
+async def bounded(aw: Awaitable[T]) -> T:
+    """Espera `aw` hasta el plazo; si vence, lo cancela y lanza DeadlineExceeded."""
+    left = remaining()
+    if left is None:
+        return await aw
+    try:
+        return await asyncio.wait_for(aw, max(0.0, left))
+    except DeadlineExceeded:
+        raise
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded("plazo agotado") from None
+
+
+async def within(aw: Awaitable[T], default: T) -> T:
+    """Espera `aw` hasta el plazo; si vence, lo cancela y devuelve `default`."""
+    left = remaining()
+    if left is None:
+        return await aw
+    try:
+        return await asyncio.wait_for(aw, max(0.0, left))
+    except asyncio.TimeoutError:
+        return default
@@ -0,0 +1,179 @@
+import asyncio
+import os
+import resource
+import sys
+import time
+from collections import deque
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from datetime import datetime, UTC
+from typing import Deque, Dict, Optional, Tuple
+
+# Estado en memoria que lee /diag: todo se actualiza en el camino normal
+# (sin I/O), así que armar el reporte es instantáneo.
+
+# (origen, destino, salida, regreso) — mismo formato que flights_service.Leg
+Leg = Tuple[str, str, str, str]
+
+# Piernas de la corrida en curso (lo fija publish_daily; las tareas hijas lo heredan)
+LEG_TIMINGS: ContextVar[Optional[Dict[Leg, Tuple[float, bool]]]] = ContextVar("leg_timings", default=None)
+
+
+def note_leg(leg: Leg, seconds: float, ok: bool) -> None:
+    timings = LEG_TIMINGS.get()
+    if timings is not None:
+        timings[leg] = (seconds, ok)
+
+
+@dataclass
+class PublishStats:
+    started_at: datetime
+    total_s: float
+    # "SCL-NRT" -> (segundos, ok)
+    legs: Dict[str, Tuple[float, bool]] = field(default_factory=dict)
+
+    @property
+    def failed(self) -> int:
+        return sum(1 for _, ok in self.legs.values() if not ok)
+
+
+class EventWindow:
+    """Eventos con timestamp en una ventana móvil (requests, 429, errores de la última hora)."""
+    def __init__(self, window_s: float = 3600, max_events: int = 50_000):
+        self.window_s = window_s
+        self._events: Deque[Tuple[float, str]] = deque(maxlen=max_events)
+
+    def add(self, kind: str) -> None:
+        self._events.append((time.monotonic(), kind))
+
+    def counts(self) -> Dict[str, int]:
+        cutoff = time.monotonic() - self.window_s
+        while self._events and self._events[0][0] < cutoff:
+            self._events.popleft()
+        out: Dict[str, int] = {}
+        for _, kind in self._events:
+            out[kind] = out.get(kind, 0) + 1
+        return out
+
+
+AMADEUS_EVENTS = EventWindow()
+
+
+class LoopLagMonitor:
+    """Mide cuánto se atrasa el loop respecto de un sleep periódico."""
+    def __init__(self, interval_s: float = 0.5, window: int = 240):
+        self.interval_s = interval_s
+        self._samples: Deque[float] = deque(maxlen=window)
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            t0 = loop.time()
+            await asyncio.sleep(self.interval_s)
+            self._samples.append(max(0.0, loop.time() - t0 - self.interval_s))
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def summary(self) -> Optional[Tuple[float, float, float]]:
+        """(último, p95, máximo) en segundos sobre la ventana (~2 min por defecto)."""
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        p95 = ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]
+        return self._samples[-1], p95, ordered[-1]
+
+
+def rss_bytes() -> Tuple[Optional[int], str]:
+    """RSS actual (Linux) o, si no se puede leer, el pico informado por getrusage."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE"), "actual"
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux informa KiB, macOS bytes
+        return (peak if sys.platform == "darwin" else peak * 1024), "pico"
+    except (OSError, ValueError):
+        return None, ""
+
+
+def _fmt_age(seconds: float) -> str:
+    seconds = int(max(0, seconds))
+    if seconds < 120:
+        return f"{seconds}s"
+    if seconds < 7200:
+        return f"{seconds // 60}m"
+    return f"{seconds // 3600}h{(seconds % 3600) // 60:02d}m"
+
+
+def runtime_report(flights_service, loop_lag: Optional[LoopLagMonitor]) -> str:
+    """Líneas KEY: valor con el estado en vivo (token, FX, cache, último post, errores, loop, memoria)."""
+    now = datetime.now(UTC)
+    lines = []
+
+    tokens = getattr(flights_service.amadeus, "tokens", None)
+    if tokens is not None and tokens.token and tokens.expires_at:
+        age = (now - tokens.issued_at).total_seconds() if tokens.issued_at else 0
+        left = (tokens.expires_at - now).total_seconds()
+        lines.append(f"TOKEN: edad {_fmt_age(age)}, vence en {_fmt_age(left)}")
+    else:
+        lines.append("TOKEN: (sin token)")
+
+    fx = flights_service.fx
+    snap = getattr(fx, "snapshot", None)
+    if snap is not None:
+        breakers = ", ".join(f"{p.name}={p.breaker.state}" for p in getattr(fx, "providers", []))
+        lines.append(f"FX: foto {snap.source} edad {_fmt_age(snap.age().total_seconds())} ({breakers})")
+    else:
+        lines.append("FX: (sin foto)")
+
+    cache = getattr(flights_service.amadeus, "cache", None)
+    if cache is not None:
+        st = cache.stats()
+        lines.append(
+            f"SEARCH_CACHE: {st['size']}/{st['max']} entradas, hits={st['hits']} "
+            f"stale={st['stale_hits']} misses={st['misses']} ({st['hit_rate']:.0%})"
+        )
+    else:
+        lines.append("SEARCH_CACHE: (desactivada)")
+
+    last: Optional[PublishStats] = getattr(flights_service, "last_publish", None)
+    if last is not None:
+        legs = " ".join(
+            f"{route}={secs:.1f}s" + ("" if ok else "✗") for route, (secs, ok) in sorted(last.legs.items())
+        )
+        lines.append(
+            f"ÚLTIMO_POST: {last.started_at:%Y-%m-%d %H:%M} total {last.total_s:.1f}s, "
+            f"{len(last.legs)} piernas ({last.failed} con error)"
+        )
+        if legs:
+            lines.append(f"  PIERNAS: {legs}")
+    else:
+        lines.append("ÚLTIMO_POST: (ninguno desde el arranque)")
+
+    ev = AMADEUS_EVENTS.counts()
+    lines.append(
+        f"AMADEUS_1H: requests={ev.get('request', 0)} 429={ev.get('429', 0)} errores={ev.get('error', 0)}"
+    )
+    quota = getattr(flights_service.amadeus, "quota", None)
+    if quota is not None:
+        lines.extend(quota.report())
+
+    lag = loop_lag.summary() if loop_lag is not None else None
+    if lag is not None:
+        lines.append(f"EVENT_LOOP_LAG: último {lag[0] * 1000:.0f}ms, p95 {lag[1] * 1000:.0f}ms, máx {lag[2] * 1000:.0f}ms")
+
+    rss, kind = rss_bytes()
+    if rss is not None:
+        lines.append(f"RSS: {rss / 2**20:.1f} MiB ({kind})")
+    return "\n".join(lines) + "\n"
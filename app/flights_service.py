@@ -1,75 +1,515 @@
-from typing import List, Dict, Any, Optional
-import aiohttp
+import asyncio
+import contextvars
+import heapq
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, List, Dict, Any, Optional, Set, Tuple
 
+from . import deadline, diagnostics, metrics, quota
 from .config import Settings
-from .amadeus_client import AmadeusClient
+from .amadeus_client import BATCH_MAX_CODES, AmadeusClient
 from .fx import FXConverter
-from .formatting import build_message
-from .dates import parse_env_dates, compute_dates
+from .formatting import (
+    build_message,
+    build_calendar_message,
+    build_history_message,
+    build_price_alert,
+    build_watch_message,
+    build_openjaw_message,
+)
+from .dates import add_days, parse_env_dates, compute_dates, departure_window, jp_domestic_dates
+from .calendar_search import Cell, PriceCalendar, coarse_cells, refine_cells
+from .history import DateFilter, PriceHistory, route_key
+from .offers import Offer, by_price, top_k
+from .openjaw import OpenJawTrip, best_trips, cheapest_trips, shinkansen_offer, sorted_hops
+from .singleflight import SingleFlight
+from .streaming import ProgressiveMessage
+from .watchlist import WatchStore, plan
+
+# (origen, destino, salida, regreso); regreso "" = solo ida
+Leg = Tuple[str, str, str, str]
+# Avisado por cada pierna terminada (ofertas vacías si falló)
+LegCallback = Callable[[Leg, List[Offer]], None]
+# Recibe el mensaje parcial ya armado (respuestas progresivas)
+Progress = Callable[[str], None]
+
+log = logging.getLogger(__name__)
+
+SEARCH_LEG_SECONDS = metrics.histogram("search_leg_seconds", "Duración de cada pierna de búsqueda (incluye espera de cupo)")
+FORMAT_SECONDS = metrics.histogram("format_seconds", "Tiempo armando mensajes por tipo")
+SEND_SECONDS = metrics.histogram("discord_send_seconds", "Duración de channel.send")
+PUBLISH_SECONDS = metrics.histogram("publish_seconds", "Duración total del post diario")
+
+
+def pack_legs(legs: List[Leg], max_codes: int) -> List[List[Leg]]:
+    """
+    Agrupa piernas compatibles (mismas fechas) en productos origen × destino
+    de a lo más `max_codes` aeropuertos por lado; cada grupo cabe en un POST.
+    Solo se juntan orígenes con el mismo conjunto de destinos, así ningún
+    grupo pide rutas que nadie buscó.
+    """
+    by_dates: Dict[Tuple[str, str], Dict[str, List[str]]] = {}
+    for o_code, d_code, dep, ret in legs:
+        by_dates.setdefault((dep, ret), {}).setdefault(o_code, []).append(d_code)
+    batches: List[List[Leg]] = []
+    for (dep, ret), dests_by_origin in by_dates.items():
+        same_dests: Dict[Tuple[str, ...], List[str]] = {}
+        for o_code, dests in dests_by_origin.items():
+            same_dests.setdefault(tuple(dict.fromkeys(dests)), []).append(o_code)
+        for dests, origins in same_dests.items():
+            for i in range(0, len(origins), max_codes):
+                for j in range(0, len(dests), max_codes):
+                    batches.append([
+                        (o_code, d_code, dep, ret)
+                        for o_code in origins[i: i + max_codes]
+                        for d_code in dests[j: j + max_codes]
+                    ])
+    return batches
+
+
+def _detached_context(purpose: str = quota.SCHEDULED) -> contextvars.Context:
+    """
+    Contexto limpio para trabajo compartido (posts, búsquedas deduplicadas):
+    sin el plazo de quien llegó primero y con un origen explícito. Cada
+    llamador acota su propia espera; el post diario pone su propio plazo
+    (PUBLISH_DEADLINE_SECONDS) y cuenta como programado. Solo se arrastra el
+    contador de llamadas: lo que dispara este llamador se le cobra a él.
+    """
+    ctx = contextvars.Context()
+    ctx.run(quota.PURPOSE.set, purpose)
+    ctx.run(quota.CALLS.set, quota.CALLS.get())
+    return ctx
+
+
+# Menciones por mensaje de watch (para no pasar el límite de 2000 caracteres)
+_MENTIONS_PER_MESSAGE = 25
 
 
 class FlightsService:
-    def __init__(self, cfg: Settings, amadeus: AmadeusClient, fx: FXConverter):
+    def __init__(
+        self,
+        cfg: Settings,
+        amadeus: AmadeusClient,
+        fx: FXConverter,
+        history: Optional[PriceHistory] = None,
+        watches: Optional[WatchStore] = None,
+    ):
         self.cfg = cfg
         self.amadeus = amadeus
         self.fx = fx
+        self.history = history
+        self.watches = watches
+        # Compartido por todas las consultas en curso: acota el fan-out total
+        # aunque se publiquen varias ciudades a la vez.
+        self._search_sem = asyncio.Semaphore(cfg.search_concurrency)
+        self._background: Set[asyncio.Task] = set()
+        # Para /diag: duración total y por pierna del último post diario
+        self.last_publish: Optional[diagnostics.PublishStats] = None
+        # Lo que dejó listo el prefetch: (pierna, max) -> (instante monotónico, ofertas)
+        self._prefetched: Dict[Tuple[Leg, int], Tuple[float, List[Offer]]] = {}
+        # Posts y búsquedas idénticas en curso (o recién terminadas, según COALESCE) se comparten
+        reuse_s = cfg.coalesce_reuse_s if cfg.coalesce == "reuse" else 0.0
+        self._publishes = SingleFlight("publish", reuse_s, enabled=cfg.coalesce != "off")
+        self._searches = SingleFlight("search", reuse_s, enabled=cfg.coalesce != "off")
+
+    async def close(self) -> None:
+        # Deja terminar las escrituras pendientes (histórico) antes de cerrar
+        if self._background:
+            await asyncio.gather(*self._background, return_exceptions=True)
+        await self.amadeus.close()
+        await self.fx.close()
+        if self.history is not None:
+            self.history.close()
+        if self.watches is not None:
+            self.watches.close()
+
+    def warm(self) -> None:
+        """Precalienta lo que no depende de la consulta (token OAuth, foto FX) sin bloquear."""
+        self.fx.warm()
+        tokens = getattr(self.amadeus, "tokens", None)
+        if tokens is not None:
+            self._spawn(tokens.get(), "Token: no se pudo precalentar")
+
+    def _spawn(self, coro: Awaitable[Any], what: str) -> None:
+        """Tarea en segundo plano con referencia fuerte; los errores se loguean."""
+        task = asyncio.ensure_future(coro)
+        self._background.add(task)
+
+        def done(t: asyncio.Task) -> None:
+            self._background.discard(t)
+            if not t.cancelled() and t.exception() is not None:
+                log.warning("%s: %s", what, t.exception())
+
+        task.add_done_callback(done)
+
+    def _record(self, results: Dict[Leg, List[Offer]]) -> None:
+        """Guarda la corrida en el histórico sin bloquear la respuesta (solo ida y vuelta)."""
+        round_trips = {leg: offers for leg, offers in results.items() if leg[3]}
+        if self.history is not None and round_trips:
+            self._spawn(self.history.record(round_trips), "Histórico: no se pudo guardar la corrida")
 
-    async def _fetch_city_codes(self, dest_codes: List[str], title: str) -> str:
+    def default_dates(self) -> Tuple[str, str]:
+        """Fechas del post diario (DEPART_DATE/RETURN_DATE o DAYS_AHEAD + STAY_NIGHTS)."""
         dep_env = getattr(self.cfg, "depart_date_env", None)
         ret_env = getattr(self.cfg, "return_date_env", None)
         env_dates = parse_env_dates(dep_env, ret_env)
+        if env_dates:
+            return env_dates
+        return compute_dates(self.cfg.days_ahead, self.cfg.stay_nights, self.cfg.tz)
 
+    def history_dates(self) -> DateFilter:
+        """
+        Las fechas del post diario, para comparar entre días: el par fijo de
+        DEPART_DATE/RETURN_DATE o, si ruedan, misma anticipación y estadía.
+        """
+        dep_env = getattr(self.cfg, "depart_date_env", None)
+        ret_env = getattr(self.cfg, "return_date_env", None)
+        env_dates = parse_env_dates(dep_env, ret_env)
         if env_dates:
-            dep, ret = env_dates
+            return DateFilter(departure=env_dates[0], return_date=env_dates[1])
+        return DateFilter(lead_days=self.cfg.days_ahead, stay=self.cfg.stay_nights)
+
+    def domestic_history_dates(self) -> DateFilter:
+        """Hokkaidō/Okinawa: el par de JP_DOMESTIC_* si está fijo; si no, la estadía por defecto (1 noche)."""
+        jp = jp_domestic_dates(
+            getattr(self.cfg, "jp_dom_depart_env", None), getattr(self.cfg, "jp_dom_return_env", None)
+        )
+        if jp:
+            return DateFilter(departure=jp[0], return_date=jp[1])
+        return DateFilter(stay=1)
+
+    async def _search_leg(
+        self,
+        leg: Leg,
+        max_results: Optional[int] = None,
+        live: Optional[Callable[[], Awaitable[List[Offer]]]] = None,
+    ) -> Tuple[Leg, List[Offer], Optional[Exception]]:
+        """
+        Una pierna; `live` reemplaza al GET (su tajada de un POST múltiple).
+        La búsqueda compartida corre en un contexto propio, con el origen de
+        cuota del llamador y sin plazo: cada uno espera solo hasta su propio
+        plazo. La clave incluye el origen, así el cron nunca queda sujeto al
+        modo solo-cache de un comando interactivo (ni al revés).
+        """
+        o_code, d_code, dep, ret = leg
+        mr = max_results or self.cfg.max_results
+        who = quota.PURPOSE.get()
+        started = time.perf_counter()
+        ok = False
+        try:
+            # Misma ruta y fechas ya en curso (otro comando o el post, por GET o
+            # dentro de un POST múltiple): se espera esa
+            offers, _ = await deadline.bounded(self._searches.do(
+                (leg, mr, who), live or (lambda: self._search_live(leg, mr)), context=_detached_context(who)
+            ))
+            ok = True
+            return leg, offers, None
+        except Exception as e:
+            return leg, [], e
+        finally:
+            self._leg_done(leg, time.perf_counter() - started, ok)
+
+    @staticmethod
+    def _leg_fields(leg: Leg) -> Dict[str, str]:
+        """Campos estructurados de log para una pierna."""
+        o_code, d_code, dep, ret = leg
+        return {"route": route_key(o_code, d_code), "leg": f"{dep}/{ret}" if ret else dep}
+
+    def _leg_done(self, leg: Leg, elapsed: float, ok: bool) -> None:
+        SEARCH_LEG_SECONDS.observe(elapsed, route=route_key(leg[0], leg[1]))
+        diagnostics.note_leg(leg, elapsed, ok)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Pierna terminada", extra={
+                **self._leg_fields(leg), "latency_ms": round(elapsed * 1000), "status": "ok" if ok else "error",
+            })
+
+    async def _search_batch(
+        self, batch: List[Leg], max_results: Optional[int] = None
+    ) -> List[Tuple[Leg, List[Offer], Optional[Exception]]]:
+        """
+        Varias rutas con las mismas fechas en un solo POST; una sola, por GET
+        como siempre. La deduplicación es por pierna, igual que en
+        _search_leg: las que ya estén en curso se esperan y no viajan en el
+        POST, y mientras el POST corre cada pierna queda registrada con su
+        propia clave, así que un GET concurrente de la misma ruta se suma a él.
+        """
+        mr = max_results or self.cfg.max_results
+        who = quota.PURPOSE.get()
+        rest = [leg for leg in batch if (leg, mr, who) not in self._searches]
+        if len(rest) < 2:
+            return list(await asyncio.gather(*(self._search_leg(leg, mr) for leg in batch)))
+
+        post = asyncio.get_running_loop().create_task(
+            self._search_batch_live(rest, mr), context=_detached_context(who)
+        )
+        # Si todas las piernas se cancelan (plazo), el POST igual termina y deja la cache
+        self._background.add(post)
+
+        def done(t: asyncio.Task) -> None:
+            self._background.discard(t)
+            if not t.cancelled():
+                t.exception()  # ya lo reporta cada pierna; aquí solo se marca como visto
+
+        post.add_done_callback(done)
+
+        async def slice_of(leg: Leg) -> List[Offer]:
+            by_route = await asyncio.shield(post)
+            return by_route.get((leg[0], leg[1]), [])
+
+        slices = {leg: (lambda leg=leg: slice_of(leg)) for leg in rest}
+        # Registro sin ceder el loop: un GET que llegue ahora ya se suma al POST
+        for leg, fn in slices.items():
+            self._searches.start((leg, mr, who), fn, context=_detached_context(who))
+        return list(await asyncio.gather(*(self._search_leg(leg, mr, slices.get(leg)) for leg in batch)))
+
+    async def _search_batch_live(self, batch: List[Leg], max_results: int) -> Dict[Tuple[str, str], List[Offer]]:
+        _, _, dep, ret = batch[0]
+        async with self._search_sem:
+            return await self.amadeus.search_round_trip_batch(
+                origins=list(dict.fromkeys(leg[0] for leg in batch)),
+                destinations=list(dict.fromkeys(leg[1] for leg in batch)),
+                departure_date=dep,
+                return_date=ret,
+                currency=self.cfg.primary_currency,
+                max_results=max_results,
+            )
+
+    async def _search_live(self, leg: Leg, max_results: int) -> List[Offer]:
+        o_code, d_code, dep, ret = leg
+        async with self._search_sem:
+            if not ret:
+                return await self.amadeus.search_one_way(
+                    origin=o_code,
+                    destination=d_code,
+                    departure_date=dep,
+                    currency=self.cfg.primary_currency,
+                    market=self.cfg.market,
+                    max_results=max_results,
+                )
+            return await self.amadeus.search_round_trip(
+                origin=o_code,
+                destination=d_code,
+                departure_date=dep,
+                return_date=ret,
+                currency=self.cfg.primary_currency,
+                market=self.cfg.market,
+                max_results=max_results,
+            )
+
+    async def _search_legs(
+        self,
+        legs: List[Leg],
+        max_results: Optional[int] = None,
+        use_prefetch: bool = True,
+        on_leg: Optional[LegCallback] = None,
+    ) -> Tuple[Dict[Leg, List[Offer]], Dict[Leg, Exception]]:
+        """
+        Lanza todas las piernas a la vez (acotadas por SEARCH_CONCURRENCY) y
+        junta las ofertas por pierna a medida que llegan. Con
+        AMADEUS_BATCH_SEARCH, las compatibles viajan juntas en un solo POST. Un error en una
+        pierna queda registrado aparte y no frena al resto. Las piernas que
+        el prefetch dejó listas (y no vencidas) no se vuelven a consultar.
+        Si hay un plazo en curso (deadline.budget), al vencer se cancelan las
+        que sigan pendientes y quedan en `errors` como DeadlineExceeded.
+        `on_leg` se llama al terminar cada pierna (para respuestas progresivas).
+        """
+        ready = self._from_prefetch(legs, max_results or self.cfg.max_results) if use_prefetch else {}
+        if on_leg is not None:
+            for leg, offers in ready.items():
+                on_leg(leg, offers)
+        results: Dict[Leg, List[Offer]] = {}
+        errors: Dict[Leg, Exception] = {}
+        live = [leg for leg in legs if leg not in ready]
+        if self.cfg.amadeus_batch_search:
+            # El POST múltiple es solo para ida y vuelta; las de solo ida van por GET
+            batches = pack_legs([leg for leg in live if leg[3]], BATCH_MAX_CODES)
+            batches += [[leg] for leg in live if not leg[3]]
         else:
-            dep, ret = compute_dates(self.cfg.days_ahead, self.cfg.stay_nights, self.cfg.tz)
+            batches = [[leg] for leg in live]
+        pending = {asyncio.create_task(self._search_batch(batch, max_results)): batch for batch in batches}
+        while pending:
+            done, _ = await asyncio.wait(pending, timeout=deadline.remaining(), return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                break
+            for task in done:
+                del pending[task]
+                for leg, offers, err in task.result():
+                    if err is not None:
+                        log.warning("Pierna con error: %s", err, extra={**self._leg_fields(leg), "status": "error"})
+                        errors[leg] = err
+                    else:
+                        results[leg] = offers
+                    if on_leg is not None:
+                        on_leg(leg, offers)
+        if pending:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            late = [leg for batch in pending.values() for leg in batch]
+            for leg in late:
+                errors[leg] = deadline.DeadlineExceeded("plazo agotado")
+            log.warning(
+                "Plazo agotado: %d pierna(s) canceladas", len(late),
+                extra={"routes": [route_key(l[0], l[1]) for l in late], "status": "timeout"},
+            )
+        # Lo adelantado ya quedó en el histórico cuando se buscó
+        self._record(results)
+        results.update(ready)
+        return results, errors
 
-        aggregate: List[Dict[str, Any]] = []
-        rate: Optional[float] = None
+    # ---- prefetch ----
+    def _from_prefetch(self, legs: List[Leg], max_results: int) -> Dict[Leg, List[Offer]]:
+        if not self._prefetched:
+            return {}
+        max_age = self.cfg.prefetch_max_age_minutes * 60
+        now = time.monotonic()
+        out: Dict[Leg, List[Offer]] = {}
+        for leg in legs:
+            hit = self._prefetched.get((leg, max_results))
+            if hit is not None and now - hit[0] <= max_age:
+                out[leg] = hit[1]
+        return out
 
-        timeout = aiohttp.ClientTimeout(total=35)
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            for code in dest_codes:
-                try:
-                    offers = await self.amadeus.search_round_trip(
-                        session,
-                        origin=self.cfg.origin,
-                        destination=code,
-                        departure_date=dep,
-                        return_date=ret,
-                        currency=self.cfg.primary_currency,
-                        market=self.cfg.market,
-                        max_results=self.cfg.max_results,
-                    )
-                    aggregate.extend(offers)
-
-                    if rate is None and offers and self.cfg.second_currency:
-                        offer_ccy = (offers[0].get("price", {}).get("currency") or self.cfg.primary_currency).upper()
-                        rate = await self.fx.get_rate(session, offer_ccy, self.cfg.second_currency.upper())
-                except Exception as e:
-                    print(f"[WARN] Dest {code} error: {e}")
-
-        def price_total(o: Dict[str, Any]) -> float:
-            try:
-                return float(o["price"]["grandTotal"])
-            except Exception:
-                return 9e9
-
-        aggregate.sort(key=price_total)
-        top = aggregate[: self.cfg.max_results]
-
-        return build_message(
-            title=title,
-            offers=top,
-            origin=self.cfg.origin,
-            dests=dest_codes,
-            dep=dep,
-            ret=ret,
-            primary_currency=self.cfg.primary_currency,
-            second_currency=self.cfg.second_currency,
-            rate=rate,
+    async def prefetch(self, legs: List[Leg]) -> None:
+        """Busca `legs` y renueva el FX por adelantado; el próximo post los toma de memoria."""
+        cfg = self.cfg
+        # La foto FX tiene que seguir vigente cuando salga el post
+        fx_task = asyncio.create_task(self.fx.ensure_fresh(timedelta(minutes=cfg.prefetch_lead_minutes + 5)))
+        results, errors = await self._search_legs(legs, use_prefetch=False)
+        fetched_at = time.monotonic()
+        max_age = cfg.prefetch_max_age_minutes * 60
+        self._prefetched = {k: v for k, v in self._prefetched.items() if fetched_at - v[0] <= max_age}
+        for leg, offers in results.items():
+            self._prefetched[(leg, cfg.max_results)] = (fetched_at, offers)
+        await fx_task
+        log.info("Prefetch listo", extra={"legs": len(legs), "ready": len(results), "errors": len(errors)})
+
+    def daily_legs(self) -> List[Leg]:
+        """Piernas del post diario más /hokkaido y /okinawa con las fechas JP_DOMESTIC_*."""
+        cfg = self.cfg
+        dep, ret = self.default_dates()
+        legs = [(cfg.origin, code, dep, ret) for code in cfg.tokyo_codes + cfg.osaka_codes]
+        jp = jp_domestic_dates(cfg.jp_dom_depart_env, cfg.jp_dom_return_env)
+        if jp:
+            for dest in cfg.hokkaido_codes + cfg.okinawa_codes:
+                legs.extend((o_code, dest, jp[0], jp[1]) for o_code in cfg.tokyo_codes)
+        return list(dict.fromkeys(legs))
+
+    async def prefetch_daily(self) -> None:
+        await self.prefetch(self.daily_legs())
+
+    async def prefetch_watches(self) -> None:
+        if self.watches is None:
+            return
+        today = datetime.now(self.cfg.tz).date()
+        legs, _ = plan(await self.watches.active(today), today)
+        if legs:
+            await self.prefetch(legs)
+
+    async def _rate(self, from_ccy: str, to_ccy: str) -> Optional[float]:
+        """Tasa FX dentro del plazo en curso; si no alcanza, el mensaje sale sin conversión."""
+        return await deadline.within(self.fx.get_rate(from_ccy, to_ccy), None)
+
+    @staticmethod
+    def _missing(errors: Dict[Leg, Exception]) -> Tuple[List[str], List[str]]:
+        """Rutas sin resultado, separadas en (plazo agotado, error)."""
+        timed_out = sorted(f"{o}→{d}" for (o, d, _, _), e in errors.items() if isinstance(e, deadline.DeadlineExceeded))
+        failed = sorted(f"{o}→{d}" for (o, d, _, _), e in errors.items() if not isinstance(e, deadline.DeadlineExceeded))
+        return timed_out, failed
+
+    async def _collect(
+        self,
+        legs: List[Leg],
+        partial: Optional[Callable[[List[Offer], Optional[float], int], None]] = None,
+    ) -> Tuple[List[Offer], Optional[float], Tuple[List[str], List[str]]]:
+        """
+        Busca todas las piernas y devuelve (top ofertas, tasa a moneda secundaria,
+        rutas faltantes). Con `partial`, cada pierna terminada re-rankea el top
+        con lo que ya llegó: partial(top, tasa si ya está, piernas listas).
+        """
+        primary = self.cfg.primary_currency
+        second = (self.cfg.second_currency or "").upper()
+
+        # El FX corre en paralelo con las búsquedas (las ofertas vienen en la moneda pedida)
+        fx_task = asyncio.create_task(self._rate(primary, second)) if second else None
+
+        on_leg: Optional[LegCallback] = None
+        if partial is not None:
+            done: Dict[Leg, List[Offer]] = {}
+
+            def on_leg(leg: Leg, offers: List[Offer]) -> None:
+                done[leg] = offers
+                rate = None
+                if fx_task is not None and fx_task.done() and not fx_task.cancelled() and fx_task.exception() is None:
+                    rate = fx_task.result()
+                partial(top_k(done.values(), self.cfg.max_results), rate, len(done))
+
+        results, errors = await self._search_legs(legs, on_leg=on_leg)
+        # Cada pierna ya viene ordenada: merge por heap, sin re-ordenar todo
+        top = top_k(results.values(), self.cfg.max_results)
+        rate = await fx_task if fx_task else None
+
+        if second and top:
+            offer_ccy = top[0].currency or primary
+            if offer_ccy != primary:
+                rate = await self._rate(offer_ccy, second)
+
+        return top, rate, self._missing(errors)
+
+    async def _fetch_city_codes(self, dest_codes: List[str], title: str, progress: Optional[Progress] = None) -> str:
+        msg, _, _ = await self._city_report(dest_codes, title, progress)
+        return msg
+
+    def _offers_message(
+        self,
+        title: str,
+        offers: List[Offer],
+        origin: str,
+        dests: List[str],
+        dep: str,
+        ret: str,
+        rate: Optional[float],
+        missing: Tuple[List[str], List[str]] = ([], []),
+        pending: Optional[Tuple[int, int]] = None,
+    ) -> str:
+        with metrics.span(FORMAT_SECONDS, kind="offers" if pending is None else "partial"):
+            return build_message(
+                title=title,
+                offers=offers,
+                origin=origin,
+                dests=dests,
+                dep=dep,
+                ret=ret,
+                primary_currency=self.cfg.primary_currency,
+                second_currency=self.cfg.second_currency,
+                rate=rate,
+                timed_out=missing[0],
+                failed=missing[1],
+                pending=pending,
+            )
+
+    def _partial(
+        self, progress: Optional[Progress], total: int, title: str, origin: str, dests: List[str], dep: str, ret: str
+    ) -> Optional[Callable[[List[Offer], Optional[float], int], None]]:
+        """Adapta `progress` (mensaje parcial) al callback de _collect."""
+        if progress is None:
+            return None
+        return lambda top, rate, done: progress(
+            self._offers_message(title, top, origin, dests, dep, ret, rate, pending=(done, total))
         )
 
+    async def _city_report(
+        self, dest_codes: List[str], title: str, progress: Optional[Progress] = None
+    ) -> Tuple[str, List[Offer], Optional[float]]:
+        origin = self.cfg.origin
+        dep, ret = self.default_dates()
+        legs = [(origin, code, dep, ret) for code in dest_codes]
+        partial = self._partial(progress, len(legs), title, origin, dest_codes, dep, ret)
+        top, rate, missing = await self._collect(legs, partial)
+        msg = self._offers_message(title, top, origin, dest_codes, dep, ret, rate, missing)
+        return msg, top, rate
+
     async def fetch_city_to_city_specific_dates(
         self,
         origin_codes: List[str],
@@ -77,70 +517,387 @@ class FlightsService:
         title: str,
         dep: str,
         ret: str,
+        progress: Optional[Progress] = None,
     ) -> str:
         """Consulta combinando varios orígenes y destinos para fechas fijas."""
-        aggregate: List[Dict[str, Any]] = []
-        rate: Optional[float] = None
-
-        timeout = aiohttp.ClientTimeout(total=35)
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            for o_code in origin_codes:
-                for d_code in dest_codes:
-                    try:
-                        offers = await self.amadeus.search_round_trip(
-                            session,
-                            origin=o_code,
-                            destination=d_code,
-                            departure_date=dep,
-                            return_date=ret,
-                            currency=self.cfg.primary_currency,
-                            market=self.cfg.market,
-                            max_results=self.cfg.max_results,
-                        )
-                        aggregate.extend(offers)
-
-                        if rate is None and offers and self.cfg.second_currency:
-                            offer_ccy = (offers[0].get("price", {}).get("currency") or self.cfg.primary_currency).upper()
-                            rate = await self.fx.get_rate(session, offer_ccy, self.cfg.second_currency.upper())
-                    except Exception as e:
-                        print(f"[WARN] {o_code}->{d_code} error: {e}")
-
-        def price_total(o: Dict[str, Any]) -> float:
-            try:
-                return float(o["price"]["grandTotal"])
-            except Exception:
-                return 9e9
-
-        aggregate.sort(key=price_total)
-        top = aggregate[: self.cfg.max_results]
-
+        legs = [(o_code, d_code, dep, ret) for o_code in origin_codes for d_code in dest_codes]
         origin_label = "/".join(origin_codes)
-        dest_label = "/".join(dest_codes)
+        dests = ["/".join(dest_codes)]
+        partial = self._partial(progress, len(legs), title, origin_label, dests, dep, ret)
+        top, rate, missing = await self._collect(legs, partial)
+        return self._offers_message(title, top, origin_label, dests, dep, ret, rate, missing)
+
+    async def stream_city_to_city(
+        self,
+        channel,
+        origin_codes: List[str],
+        dest_codes: List[str],
+        title: str,
+        dep: str,
+        ret: str,
+    ) -> None:
+        """Como fetch_city_to_city_specific_dates, pero publica al instante y edita a medida que llegan piernas."""
+        origin_label, dests = "/".join(origin_codes), ["/".join(dest_codes)]
+        total = len(origin_codes) * len(dest_codes)
+        live = ProgressiveMessage(channel, self.cfg.stream_edit_interval_s)
+        # La búsqueda arranca antes de publicar el placeholder: no espera a Discord
+        search = asyncio.ensure_future(
+            self.fetch_city_to_city_specific_dates(origin_codes, dest_codes, title, dep, ret, live.update)
+        )
+        placeholder = self._offers_message(title, [], origin_label, dests, dep, ret, None, pending=(0, total))
+        await self._start_live(search, [(live, placeholder)])
+        await live.finish(await search)
+
+    @staticmethod
+    async def _start_live(search: asyncio.Future, placeholders: List[Tuple[ProgressiveMessage, str]]) -> None:
+        """Publica los placeholders en orden; si Discord falla, no deja la búsqueda colgando."""
+        try:
+            for live, content in placeholders:
+                await live.start(content)
+        except BaseException:
+            search.cancel()
+            raise
+
+    @staticmethod
+    def _hop_date(dep: str, ret: str) -> str:
+        """El tramo interno va a mitad de la estadía."""
+        nights = (datetime.fromisoformat(ret) - datetime.fromisoformat(dep)).days
+        return add_days(dep, max(0, nights // 2))
+
+    async def open_jaw(
+        self, dep: str, ret: str, hop: bool = True
+    ) -> Tuple[List[OpenJawTrip], Optional[float], Tuple[List[str], List[str]]]:
+        """
+        Entrar por una ciudad y salir por la otra (Tokio→Osaka y Osaka→Tokio):
+        tramos de solo ida por aeropuerto y, con `hop`, el tramo interno más
+        barato (vuelo o Shinkansen). Las combinaciones salen de un k-smallest
+        por heap, sin armar el producto completo.
+        """
+        cfg = self.cfg
+        k = cfg.openjaw_results
+        hop_date = self._hop_date(dep, ret)
+        cities = [("Tokio", cfg.tokyo_codes), ("Osaka", cfg.osaka_codes)]
+        directions = [(cities[0], cities[1]), (cities[1], cities[0])]
+
+        legs: List[Leg] = []
+        for _, codes in cities:
+            legs += [(cfg.origin, code, dep, "") for code in codes]
+            legs += [(code, cfg.origin, ret, "") for code in codes]
+        if hop:
+            for (_, in_codes), (_, out_codes) in directions:
+                legs += [(a, b, hop_date, "") for a in in_codes for b in out_codes]
+
+        second = (cfg.second_currency or "").upper()
+        fx_task = asyncio.create_task(self._rate(cfg.primary_currency, second)) if second else None
+        results, errors = await self._search_legs(legs)
+        rate = await fx_task if fx_task else None
 
-        return build_message(
-            title=title,
-            offers=top,
-            origin=origin_label,
-            dests=[dest_label],
+        def merged(origins: List[str], dests: List[str], day: str) -> List[Offer]:
+            return top_k([results.get((o, d, day, ""), []) for o in origins for d in dests], k)
+
+        candidates = []
+        for (in_city, in_codes), (out_city, out_codes) in directions:
+            hops = None
+            if hop:
+                train = None
+                if cfg.shinkansen_fare > 0:
+                    train = shinkansen_offer(cfg.shinkansen_fare, cfg.primary_currency, in_city, out_city)
+                hops = sorted_hops(merged(in_codes, out_codes, hop_date), train)
+            outbound = merged([cfg.origin], in_codes, dep)
+            inbound = merged(out_codes, [cfg.origin], ret)
+            candidates.append(cheapest_trips(outbound, inbound, k, hops))
+        return best_trips(candidates, k), rate, self._missing(errors)
+
+    async def fetch_open_jaw(self, title: str, dep: str, ret: str, hop: Optional[bool] = None) -> str:
+        hop = self.cfg.openjaw_hop if hop is None else hop
+        trips, rate, (timed_out, failed) = await self.open_jaw(dep, ret, hop)
+        with metrics.span(FORMAT_SECONDS, kind="openjaw"):
+            return build_openjaw_message(
+                title,
+                trips,
+                dep,
+                self._hop_date(dep, ret),
+                ret,
+                self.cfg.primary_currency,
+                self.cfg.second_currency,
+                rate,
+                timed_out=timed_out,
+                failed=failed,
+            )
+
+    async def _search_cells(self, cal: PriceCalendar, cells: List[Cell]) -> None:
+        async def one(cell: Cell) -> None:
+            ret = cal.return_date(cell)
+            legs = [(cal.origin, d, cell[0], ret) for d in cal.dests]
+            with quota.counting() as count:
+                results, errors = await self._search_legs(legs, self.cfg.calendar_offers_per_cell)
+            cal.calls += count.n
+            if len(errors) == len(legs):
+                cal.failed.add(cell)
+                return
+            cheapest = top_k(results.values(), 1)
+            cal.cells[cell] = cheapest[0] if cheapest else None
+
+        await asyncio.gather(*(one(c) for c in cells))
+
+    async def price_calendar(
+        self,
+        dest_codes: List[str],
+        origin: Optional[str] = None,
+        center: Optional[str] = None,
+        days: Optional[int] = None,
+        stays: Optional[List[int]] = None,
+    ) -> Tuple[PriceCalendar, Optional[float]]:
+        """
+        Barre salidas × estadías para una ruta dentro de CALENDAR_MAX_CALLS:
+        primero una grilla gruesa (todas en paralelo) y luego solo las celdas
+        cuyas vecinas pueden competir con el mejor precio encontrado.
+        """
+        cfg = self.cfg
+        center = center or self.default_dates()[0]
+        departures = departure_window(center, days or cfg.calendar_days, cfg.tz)
+        stays = sorted(set(stays or cfg.calendar_stays))
+        cal = PriceCalendar(origin or cfg.origin, list(dest_codes), departures, stays)
+
+        second = (cfg.second_currency or "").upper()
+        fx_task = asyncio.create_task(self._rate(cfg.primary_currency, second)) if second else None
+
+        budget = max(1, cfg.calendar_max_calls // max(1, len(dest_codes)))
+        first = coarse_cells(departures, stays, cfg.calendar_coarse_step)[:budget]
+        await self._search_cells(cal, first)
+
+        searched = set(first)
+        rest = [(d, s) for d in departures for s in stays if (d, s) not in searched]
+        second_pass = refine_cells(cal, rest, cfg.calendar_prune_slack, budget - len(first))
+        await self._search_cells(cal, second_pass)
+
+        rate = await fx_task if fx_task else None
+        ccy = cal.currency(cfg.primary_currency)
+        if second and ccy != cfg.primary_currency:
+            rate = await self._rate(ccy, second)
+        return cal, rate
+
+    async def fetch_price_calendar(self, dest_codes: List[str], title: str, **kwargs) -> str:
+        cal, rate = await self.price_calendar(dest_codes, **kwargs)
+        with metrics.span(FORMAT_SECONDS, kind="calendar"):
+            return build_calendar_message(
+                title=title,
+                cal=cal,
+                primary_currency=self.cfg.primary_currency,
+                second_currency=self.cfg.second_currency,
+                rate=rate,
+                top_n=self.cfg.max_results,
+            )
+
+    async def history_report(
+        self,
+        origin_codes: List[str],
+        dest_codes: List[str],
+        title: str,
+        days: int,
+        dates: Optional[DateFilter] = None,
+    ) -> str:
+        """Serie de mínimos diarios de las rutas; por defecto, solo las fechas del post diario."""
+        if self.history is None:
+            return f"**{title}**\n_El histórico de precios está desactivado (HISTORY_ENABLED)._"
+        routes = [route_key(o, d) for o in origin_codes for d in dest_codes]
+        stats = await self.history.route_stats(routes, days, dates or self.history_dates())
+        second = (self.cfg.second_currency or "").upper()
+        rate = None
+        if second and stats.series:
+            rate = await self._rate(stats.currency or self.cfg.primary_currency, second)
+        return build_history_message(title, stats, self.cfg.primary_currency, self.cfg.second_currency, rate)
+
+    async def _price_alert(
+        self,
+        city: str,
+        dest_codes: List[str],
+        top: List[Offer],
+        rate: Optional[float],
+    ) -> Optional[str]:
+        """Alerta si el mejor precio de hoy cae bajo el percentil móvil del histórico."""
+        if self.history is None or not top:
+            return None
+        cfg = self.cfg
+        routes = [route_key(cfg.origin, d) for d in dest_codes]
+        # Solo contra los mismos pares de fechas que el post (no calendarios ni watches)
+        threshold, samples = await self.history.baseline(
+            routes, cfg.history_alert_window_days, cfg.history_alert_percentile, self.history_dates()
+        )
+        best = top[0].price
+        if threshold is None or samples < cfg.history_alert_min_samples or best >= threshold:
+            return None
+        dep, ret = self.default_dates()
+        return build_price_alert(
+            title=f"📉 {cfg.origin} ⇄ {city}: precio bajo el p{cfg.history_alert_percentile:g} de {cfg.history_alert_window_days} días",
+            offer=top[0],
+            threshold=threshold,
+            samples=samples,
+            primary_currency=cfg.primary_currency,
+            second_currency=cfg.second_currency,
+            rate=rate,
             dep=dep,
             ret=ret,
-            primary_currency=self.cfg.primary_currency,
-            second_currency=self.cfg.second_currency,
-            rate=rate,
         )
 
-    async def publish_daily(self, bot) -> None:
+    async def _send(self, channel, msg: str) -> None:
+        with metrics.span(SEND_SECONDS):
+            await channel.send(msg)
+
+    async def publish_daily(self, bot) -> bool:
+        """
+        Post diario. Si ya hay uno en curso (/probar junto al cron, dos /probar)
+        o según COALESCE terminó hace muy poco, no se repite: se espera ese y
+        devuelve False (no publicó nada nuevo).
+        """
+        _, shared = await self._publishes.do(
+            "daily", lambda: self._timed_publish(bot), context=_detached_context()
+        )
+        return not shared
+
+    async def _timed_publish(self, bot) -> None:
+        timings: Dict[Leg, Tuple[float, bool]] = {}
+        token = diagnostics.LEG_TIMINGS.set(timings)
+        started_at = datetime.now(self.cfg.tz)
+        started = time.perf_counter()
+        try:
+            # Cota dura: lo que no llegue a tiempo sale marcado en el mensaje
+            with deadline.budget(self.cfg.publish_deadline_s):
+                await self._publish_daily(bot)
+        finally:
+            diagnostics.LEG_TIMINGS.reset(token)
+            total = time.perf_counter() - started
+            PUBLISH_SECONDS.observe(total)
+            self.last_publish = diagnostics.PublishStats(
+                started_at, total, {route_key(leg[0], leg[1]): t for leg, t in timings.items()}
+            )
+
+    async def _publish_daily(self, bot) -> None:
         channel = bot.get_channel(self.cfg.channel_id)
         if channel is None:
-            print("❌ Canal no encontrado. Revisa DISCORD_CHANNEL_ID.")
+            log.error("Canal no encontrado. Revisa DISCORD_CHANNEL_ID.", extra={"channel_id": self.cfg.channel_id})
             return
 
-        msg_tokyo = await self._fetch_city_codes(
-            self.cfg.tokyo_codes, "✈️ SCL ⇄ Tokio (NRT/HND) — Ofertas más baratas"
-        )
-        msg_osaka = await self._fetch_city_codes(
-            self.cfg.osaka_codes, "✈️ SCL ⇄ Osaka (KIX/ITM) — Ofertas más baratas"
-        )
+        cities = [
+            ("Tokio", self.cfg.tokyo_codes, "✈️ SCL ⇄ Tokio (NRT/HND) — Ofertas más baratas"),
+            ("Osaka", self.cfg.osaka_codes, "✈️ SCL ⇄ Osaka (KIX/ITM) — Ofertas más baratas"),
+        ]
+        # Todas las ciudades en paralelo: el tiempo total ≈ una latencia de Amadeus
+        if self.cfg.stream_results:
+            reports = await self._stream_city_reports(channel, cities)
+        else:
+            reports = await asyncio.gather(*(self._city_report(codes, title) for _, codes, title in cities))
+            for msg, _, _ in reports:
+                await self._send(channel, msg)
+
+        if self.cfg.openjaw_in_daily:
+            dep, ret = self.default_dates()
+            await self._send(channel, await self.fetch_open_jaw(
+                f"🔀 {self.cfg.origin} → Tokio / Osaka → {self.cfg.origin} — Open-jaw", dep, ret
+            ))
+
+        if self.cfg.calendar_in_daily:
+            cal_tokyo, cal_osaka = await asyncio.gather(
+                self.fetch_price_calendar(self.cfg.tokyo_codes, "📅 SCL ⇄ Tokio — Calendario de precios"),
+                self.fetch_price_calendar(self.cfg.osaka_codes, "📅 SCL ⇄ Osaka — Calendario de precios"),
+            )
+            await self._send(channel, cal_tokyo)
+            await self._send(channel, cal_osaka)
+
+        if self.history is not None:
+            for (city, codes, _), (_, top, rate) in zip(cities, reports):
+                try:
+                    alert = await self._price_alert(city, codes, top, rate)
+                except Exception as e:
+                    log.warning("Alerta de precio con error: %s", e, extra={"city": city})
+                    continue
+                if alert:
+                    await self._send(channel, alert)
+            self._spawn(self.history.compact(), "Histórico: compactación")
+
+    async def _stream_city_reports(
+        self, channel, cities: List[Tuple[str, List[str], str]]
+    ) -> List[Tuple[str, List[Offer], Optional[float]]]:
+        """Un mensaje por ciudad, publicado al instante y editado a medida que responden sus piernas."""
+        cfg = self.cfg
+        dep, ret = self.default_dates()
+        lives = [ProgressiveMessage(channel, cfg.stream_edit_interval_s) for _ in cities]
+        search = asyncio.ensure_future(asyncio.gather(*(
+            self._city_report(codes, title, live.update) for (_, codes, title), live in zip(cities, lives)
+        )))
+        await self._start_live(search, [
+            (live, self._offers_message(title, [], cfg.origin, codes, dep, ret, None, pending=(0, len(codes))))
+            for (_, codes, title), live in zip(cities, lives)
+        ])
+        reports = await search
+        for live, (msg, _, _) in zip(lives, reports):
+            await live.finish(msg)
+        return reports
+
+    async def publish_watches(self, bot) -> bool:
+        """
+        Evalúa las watches de todos los usuarios: primero las colapsa en piernas
+        únicas (el costo en Amadeus crece con las rutas distintas, no con los
+        usuarios) y luego reparte cada resultado a todos sus suscriptores.
+        Como publish_daily, no se duplica si ya hay uno en curso.
+        """
+        async def run() -> None:
+            with deadline.budget(self.cfg.publish_deadline_s):
+                await self._publish_watches(bot)
+
+        _, shared = await self._publishes.do("watches", run, context=_detached_context())
+        return not shared
+
+    async def _publish_watches(self, bot) -> None:
+        if self.watches is None:
+            return
+        channel = bot.get_channel(self.cfg.channel_id)
+        if channel is None:
+            log.error("Canal no encontrado. Revisa DISCORD_CHANNEL_ID.", extra={"channel_id": self.cfg.channel_id})
+            return
+
+        cfg = self.cfg
+        today = datetime.now(cfg.tz).date()
+        watches = await self.watches.active(today)
+        if not watches:
+            return
+        legs, groups = plan(watches, today)
+        log.info("Watches planificadas", extra={
+            "watches": len(watches), "users": len({w.user_id for w in watches}),
+            "routes": len(groups), "legs": len(legs),
+        })
+
+        second = (cfg.second_currency or "").upper()
+        fx_task = asyncio.create_task(self._rate(cfg.primary_currency, second)) if second else None
+        results, errors = await self._search_legs(legs)
+        rate = await fx_task if fx_task else None
+        timed_out = {leg for leg, e in errors.items() if isinstance(e, deadline.DeadlineExceeded)}
 
-        await channel.send(msg_tokyo)
-        await channel.send(msg_osaka)
+        for (origin, dest, start, flex, nights), subs in groups.items():
+            group_legs = subs[0].legs(today)
+            candidates = [
+                (dep, ret, offer)
+                for (_, _, dep, ret) in group_legs
+                for offer in results.get((origin, dest, dep, ret), [])
+            ]
+            late = [dep for (_, _, dep, ret) in group_legs if (origin, dest, dep, ret) in timed_out]
+            picks = heapq.nsmallest(cfg.max_results, candidates, key=lambda c: by_price(c[2]))
+            best = picks[0][2].price if picks else None
+            # Con precio máximo, solo se avisa a quien lo ve cumplido
+            notify = [w for w in subs if w.max_price is None or (best is not None and best <= w.max_price)]
+            if not notify:
+                continue
+            window = start if flex == 0 else f"{start} +{flex}d"
+            title = f"👀 {origin} ⇄ {dest} — salida {window}, {nights} noches"
+            mentions = [f"<@{uid}>" for uid in sorted({w.user_id for w in notify})]
+            for i in range(0, len(mentions), _MENTIONS_PER_MESSAGE):
+                msg = build_watch_message(
+                    title,
+                    mentions[i: i + _MENTIONS_PER_MESSAGE],
+                    picks,
+                    cfg.primary_currency,
+                    cfg.second_currency,
+                    rate,
+                    timed_out=late,
+                )
+                await self._send(channel, msg)
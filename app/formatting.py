@@ -1,8 +1,25 @@
-from typing import Dict, Any, List, Optional
+from typing import List, Optional, Sequence, Tuple
+
+from .calendar_search import PriceCalendar
+from .history import RouteStats
+from .offers import Offer
+from .openjaw import SHINKANSEN, OpenJawTrip
+
+# Límite de caracteres de un mensaje de Discord
+DISCORD_MAX_CHARS = 2000
 
 def format_clp(amount: float) -> str:
     return f"{int(round(amount)):,.0f}".replace(",", ".") + " CLP"
 
+def second_currency_suffix(amount: float, second_currency: Optional[str], rate: Optional[float]) -> str:
+    """Sufijo ' (≈ 1.234.567 CLP)' si hay moneda secundaria y tasa; vacío si no."""
+    if not second_currency or not rate or amount <= 0:
+        return ""
+    eq = amount * rate
+    if second_currency.upper() == "CLP":
+        return f" (≈ {format_clp(eq)})"
+    return f" (≈ {eq:,.2f} {second_currency.upper()})"
+
 def flight_search_link(
     origin_iata: str,
     dest_iata: str,
@@ -11,55 +28,55 @@ def flight_search_link(
     tld: str = "com",   # cambia a "cl" si prefieres kayak.cl
 ) -> str:
     """
-    Deep link a Kayak (round trip), ordenado por precio ascendente:
+    Deep link a Kayak (round trip, o solo ida si ret_date es ""), ordenado por precio ascendente:
     https://www.kayak.<tld>/flights/ORIG-DEST/YYYY-MM-DD/YYYY-MM-DD?sort=price_a
     """
     o = (origin_iata or "").upper()
     d = (dest_iata or "").upper()
     if not o or not d or o == "?" or d == "?":
         return ""
-    return f"https://www.kayak.{tld}/flights/{o}-{d}/{dep_date}/{ret_date}?sort=price_a"
+    dates = f"{dep_date}/{ret_date}" if ret_date else dep_date
+    return f"https://www.kayak.{tld}/flights/{o}-{d}/{dates}?sort=price_a"
 
 def fmt_offer(
-    offer: Dict[str, Any],
+    offer: Offer,
     primary_currency: str,
     second_currency: Optional[str],
     rate: Optional[float],
     dep_date: str,
     ret_date: str,
+    label: Optional[str] = None,
 ) -> str:
-    price = offer.get("price", {})
-    amount = float(price.get("grandTotal", "0") or 0)
-    currency = (price.get("currency") or primary_currency).upper()
-
-    itin = (offer.get("itineraries") or [{}])[0]
-    dur = itin.get("duration", "")
-    segs = itin.get("segments", [])
-    first = segs[0] if segs else {}
-    last = segs[-1] if segs else {}
-    dep = first.get("departure", {}).get("iataCode", "?")
-    arr = last.get("arrival", {}).get("iataCode", "?")
-    stops = max(0, len(segs) - 1)
+    amount = offer.price
+    currency = offer.currency or primary_currency.upper()
+    dur = offer.duration
+    dep = offer.origin
+    arr = offer.destination
+    stops = offer.stops
 
     primary_str = f"{amount:,.2f} {currency}"
     url = flight_search_link(dep, arr, dep_date=dep_date, ret_date=ret_date)
 
-    line = f"• {dep}→{arr} | {stops} escala(s) | {dur} | {primary_str}"
-    if second_currency and rate and amount > 0:
-        eq = amount * rate
-        if second_currency.upper() == "CLP":
-            line += f" (≈ {format_clp(eq)})"
-        else:
-            line += f" (≈ {eq:,.2f} {second_currency.upper()})"
+    line = f"• {label + ' | ' if label else ''}{dep}→{arr} | {stops} escala(s) | {dur} | {primary_str}"
+    line += second_currency_suffix(amount, second_currency, rate)
 
     if url:
         # En ángulos para que sea clickeable sin unfurl gigante
         line += f" | 🔗 <{url}>"
     return line
 
+def missing_routes_note(timed_out: Sequence[str], failed: Sequence[str]) -> List[str]:
+    """Líneas al pie para las rutas que no entraron al mensaje (plazo agotado o error)."""
+    lines = []
+    if timed_out:
+        lines.append(f"_⏱️ Sin respuesta a tiempo: {', '.join(timed_out)}_")
+    if failed:
+        lines.append(f"_⚠️ Con error: {', '.join(failed)}_")
+    return lines
+
 def build_message(
     title: str,
-    offers: List[Dict[str, Any]],
+    offers: List[Offer],
     origin: str,
     dests: List[str],
     dep: str,
@@ -67,10 +84,197 @@ def build_message(
     primary_currency: str,
     second_currency: Optional[str],
     rate: Optional[float],
+    timed_out: Sequence[str] = (),
+    failed: Sequence[str] = (),
+    pending: Optional[Tuple[int, int]] = None,
 ) -> str:
+    """
+    `timed_out`/`failed`: rutas ("SCL→NRT") que faltan en el resultado; se avisan al pie.
+    `pending`: (listas, total) mientras la búsqueda sigue en curso (mensaje parcial).
+    """
+    note = missing_routes_note(timed_out, failed)
+    if pending is not None:
+        note.append(f"_⏳ Buscando… {pending[0]}/{pending[1]} rutas listas_")
+        if not offers:
+            return "\n".join([f"**{title}** _(salida {dep}, regreso {ret})_"] + note)
     if not offers:
-        return f"**{title}**\n_No se encontraron ofertas para {origin}→{','.join(dests)} ({dep} / {ret})._"
+        return "\n".join(
+            [f"**{title}**\n_No se encontraron ofertas para {origin}→{','.join(dests)} ({dep} / {ret})._"] + note
+        )
     lines = [f"**{title}** _(salida {dep}, regreso {ret})_"]
     for o in offers:
         lines.append(fmt_offer(o, primary_currency, second_currency, rate, dep, ret))
+    return "\n".join(lines + note)
+
+def build_calendar_message(
+    title: str,
+    cal: PriceCalendar,
+    primary_currency: str,
+    second_currency: Optional[str],
+    rate: Optional[float],
+    top_n: int = 5,
+) -> str:
+    """
+    Matriz salida × noches (precio total en la moneda primaria, sin decimales)
+    más el top-N de combinaciones. `*` marca la más barata, `·` celda podada,
+    `—` sin ofertas y `✗` error.
+    """
+    header = f"**{title}** _({cal.origin}→{'/'.join(cal.dests)}, {cal.calls} consultas)_"
+    top = cal.top(top_n)
+    if not top:
+        return f"{header}\n_No se encontraron ofertas en la ventana {cal.departures[0]} … {cal.departures[-1]}._"
+
+    best = top[0][0]
+    def cell_str(dep: str, stay: int) -> str:
+        cell = (dep, stay)
+        if cell in cal.failed:
+            return "✗"
+        if cell in cal.pruned or cell not in cal.cells:
+            return "·"
+        price = cal.price(cell)
+        if price is None:
+            return "—"
+        return f"{price:,.0f}" + ("*" if cell == best else "")
+
+    rows = [["Salida"] + [f"{s}n" for s in cal.stays]]
+    for dep in cal.departures:
+        rows.append([dep[5:]] + [cell_str(dep, s) for s in cal.stays])
+    widths = [max(len(r[i]) for r in rows) for i in range(len(rows[0]))]
+    table_lines = [
+        "  ".join(c.ljust(widths[0]) if i == 0 else c.rjust(widths[i]) for i, c in enumerate(r))
+        for r in rows
+    ]
+
+    ccy = cal.currency(primary_currency)
+    legend = f"_Precios en {ccy}; * más barata, · podada, — sin ofertas, ✗ error._"
+    def body(table: List[str]) -> str:
+        return f"{header}\n```\n" + "\n".join(table) + f"\n```\n{legend}"
+
+    # Debe caber en un mensaje: primero se recortan filas de la matriz (solo si
+    # ni ella cabe) y después el top-N, que se corta donde se pasaría
+    msg = body(table_lines)
+    while len(msg) > DISCORD_MAX_CHARS and len(table_lines) > 2:
+        table_lines = table_lines[:-2] + ["…"]
+        msg = body(table_lines)
+    for (dep, stay), offer in top:
+        ret = cal.return_date((dep, stay))
+        line = fmt_offer(offer, primary_currency, second_currency, rate, dep, ret, label=f"{dep} → {ret} ({stay}n)")
+        if len(msg) + 1 + len(line) > DISCORD_MAX_CHARS:
+            break
+        msg += "\n" + line
+    return msg[:DISCORD_MAX_CHARS]
+
+_SPARK = "▁▂▃▄▅▆▇█"
+
+def sparkline(values: List[float]) -> str:
+    if not values:
+        return ""
+    lo, hi = min(values), max(values)
+    if hi == lo:
+        return _SPARK[3] * len(values)
+    return "".join(_SPARK[int((v - lo) / (hi - lo) * (len(_SPARK) - 1))] for v in values)
+
+def build_history_message(
+    title: str,
+    stats: RouteStats,
+    primary_currency: str,
+    second_currency: Optional[str],
+    rate: Optional[float],
+) -> str:
+    dates = f" ({stats.dates.label})" if stats.dates else ""
+    if not stats.series:
+        return f"**{title}**\n_Sin datos en los últimos {stats.days} días para {', '.join(stats.routes)}{dates}._"
+    ccy = (stats.currency or primary_currency).upper()
+
+    def money(v: float) -> str:
+        return f"{v:,.2f} {ccy}" + second_currency_suffix(v, second_currency, rate)
+
+    slope = stats.slope_per_day
+    if slope is None or abs(slope) < 0.5:
+        trend = "→ estable"
+    elif slope < 0:
+        trend = f"↘ bajando ~{abs(slope):,.2f} {ccy}/día"
+    else:
+        trend = f"↗ subiendo ~{slope:,.2f} {ccy}/día"
+
+    last_day, last = stats.series[-1]
+    lines = [
+        f"**{title}** _(últimos {stats.days} días, {len(stats.series)} con datos; fechas: {stats.dates.label if stats.dates else 'todas'})_",
+        f"• Mínimo: {money(stats.min)}",
+        f"• Mediana: {money(stats.median)}",
+        f"• Último ({last_day}): {money(last)}",
+        f"• Tendencia: {trend}",
+        f"`{sparkline([p for _, p in stats.series])}`",
+    ]
     return "\n".join(lines)
+
+def build_price_alert(
+    title: str,
+    offer: Offer,
+    threshold: float,
+    samples: int,
+    primary_currency: str,
+    second_currency: Optional[str],
+    rate: Optional[float],
+    dep: str,
+    ret: str,
+) -> str:
+    ccy = offer.currency or primary_currency.upper()
+    return "\n".join([
+        f"**{title}**",
+        f"_Referencia: {threshold:,.2f} {ccy} (mínimos diarios de {samples} días)_",
+        fmt_offer(offer, primary_currency, second_currency, rate, dep, ret),
+    ])
+
+def build_watch_message(
+    title: str,
+    mentions: List[str],
+    picks: List[Tuple[str, str, Offer]],
+    primary_currency: str,
+    second_currency: Optional[str],
+    rate: Optional[float],
+    timed_out: Sequence[str] = (),
+) -> str:
+    """
+    Un mensaje por ruta seguida, con todos sus suscriptores mencionados.
+    picks = (salida, regreso, oferta); `timed_out` = salidas que no alcanzaron a responder.
+    """
+    lines = [f"**{title}**", " ".join(mentions)]
+    if not picks:
+        lines.append("_Sin ofertas por ahora en esa ventana._")
+    for dep, ret, offer in picks:
+        lines.append(fmt_offer(offer, primary_currency, second_currency, rate, dep, ret, label=f"{dep} → {ret}"))
+    return "\n".join(lines + missing_routes_note(timed_out, ()))
+
+def build_openjaw_message(
+    title: str,
+    trips: List[OpenJawTrip],
+    dep: str,
+    hop_date: str,
+    ret: str,
+    primary_currency: str,
+    second_currency: Optional[str],
+    rate: Optional[float],
+    timed_out: Sequence[str] = (),
+    failed: Sequence[str] = (),
+) -> str:
+    """Itinerarios open-jaw: total arriba y cada tramo de solo ida debajo (↗ ida, ↔ interno, ↘ vuelta)."""
+    note = missing_routes_note(timed_out, failed)
+    if not trips:
+        return "\n".join([f"**{title}**\n_No se encontraron combinaciones open-jaw ({dep} / {ret})._"] + note)
+
+    def leg(icon: str, offer: Offer, day: str) -> str:
+        if offer.carrier == SHINKANSEN:
+            return f"  • {icon} {day} | {offer.origin}→{offer.destination} | 🚄 Shinkansen | {offer.price:,.2f} {offer.currency}"
+        return "  " + fmt_offer(offer, primary_currency, None, None, day, "", label=f"{icon} {day}")
+
+    lines = [f"**{title}** _(ida {dep}, vuelta {ret})_"]
+    for n, trip in enumerate(trips, 1):
+        ccy = trip.outbound.currency or primary_currency.upper()
+        total = f"{trip.price:,.2f} {ccy}" + second_currency_suffix(trip.price, second_currency, rate)
+        lines.append(f"**{n}.** {total} — entra por {trip.outbound.destination}, sale por {trip.inbound.origin}")
+        lines.append(leg("↗", trip.outbound, dep))
+        if trip.hop is not None:
+            lines.append(leg("↔", trip.hop, hop_date))
+        lines.append(leg("↘", trip.inbound, ret))
+    return "\n".join(lines + note)
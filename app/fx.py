@@ -1,97 +1,343 @@
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass, field
 from datetime import datetime, timedelta, UTC
-from typing import Dict, Tuple, Optional
-import aiohttp
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+from . import deadline, metrics
+from .http_session import HttpSessionManager
+from .resilience import CircuitBreaker, LatencyTracker
+
+log = logging.getLogger(__name__)
 
 DINERO_TODAY_URL = "https://cdn.dinero.today/api/latest.json"
+EXCHANGERATE_HOST_URL = "https://api.exchangerate.host/latest"
+
+FX_LOOKUP_SECONDS = metrics.histogram("fx_lookup_seconds", "Duración de get_rate (incluye la descarga en frío)")
+FX_PROVIDER_SECONDS = metrics.histogram("fx_provider_seconds", "Duración de la descarga de tasas por proveedor y resultado")
+
+
+@dataclass
+class RateSnapshot:
+    """Tabla completa de tasas con una base común (USD)."""
+    base: str
+    rates: Dict[str, float]
+    fetched_at: datetime
+    source: str
+
+    def cross(self, base: str, target: str) -> Optional[float]:
+        """
+        rate(A->B) = rates[B] / rates[A], con rates[base] = 1:
+        - rate(USD->X) = rates[X]
+        - rate(X->USD) = 1 / rates[X]
+        """
+        b_val = 1.0 if base == self.base else self.rates.get(base)
+        t_val = 1.0 if target == self.base else self.rates.get(target)
+        if not b_val or not t_val:
+            return None
+        return t_val / b_val
+
+    def age(self) -> timedelta:
+        return datetime.now(UTC) - self.fetched_at
+
+    def to_json(self) -> Dict:
+        return {
+            "base": self.base,
+            "rates": self.rates,
+            "fetched_at": self.fetched_at.isoformat(),
+            "source": self.source,
+        }
+
+    @classmethod
+    def from_json(cls, js: Dict) -> "RateSnapshot":
+        return cls(
+            base=js["base"],
+            rates={k: float(v) for k, v in js["rates"].items()},
+            fetched_at=datetime.fromisoformat(js["fetched_at"]),
+            source=js.get("source", "?"),
+        )
+
+
+def _parse_rates(js: Dict, base: str, source: str) -> Optional[RateSnapshot]:
+    rates = js.get("rates", {})
+    if not isinstance(rates, dict):
+        return None
+    clean: Dict[str, float] = {}
+    for code, val in rates.items():
+        try:
+            f = float(val)
+        except (TypeError, ValueError):
+            continue
+        if f > 0:
+            clean[code.upper()] = f
+    if not clean:
+        return None
+    return RateSnapshot(base=base, rates=clean, fetched_at=datetime.now(UTC), source=source)
+
+
+@dataclass
+class _Provider:
+    name: str
+    fetch: Callable[[], Awaitable[Optional[RateSnapshot]]]
+    breaker: CircuitBreaker
+    latency: LatencyTracker = field(default_factory=LatencyTracker)
 
 
 class FXConverter:
     """
-    Convierte montos entre monedas, con cache de 12h.
-    Prioriza dinero.today; si falla, usa exchangerate.host.
+    Convierte montos entre monedas a partir de una foto completa de tasas
+    (base USD), válida 12h: cualquier par se deriva en memoria.
+    Prioriza dinero.today; si no contesta dentro de su p95 lanza también
+    exchangerate.host (hedging) y se queda con la primera respuesta válida.
+    Cada proveedor tiene un cortocircuito que lo salta durante un cooldown.
+    La foto se renueva con una sola descarga en vuelo, en segundo plano antes
+    de vencer, y se guarda en disco para servir al instante tras un reinicio.
     Permite override USD->CLP via FX_USDCLP.
     """
-    def __init__(self, usdclp_override: Optional[str] = None, cache_hours: int = 12):
-        self._cache: Dict[Tuple[str, str], Tuple[float, datetime]] = {}
+    def __init__(
+        self,
+        http: HttpSessionManager,
+        usdclp_override: Optional[str] = None,
+        cache_hours: int = 12,
+        cache_path: Optional[str] = None,
+        refresh_margin_minutes: int = 30,
+        hedge_min_s: float = 0.3,
+        hedge_max_s: float = 3.0,
+        breaker_failures: int = 3,
+        breaker_cooldown_s: float = 300,
+        dinero_url: str = DINERO_TODAY_URL,
+        exchangerate_url: str = EXCHANGERATE_HOST_URL,
+    ):
+        self.http = http
+        self.dinero_url = dinero_url
+        self.exchangerate_url = exchangerate_url
         self._usdclp_override = usdclp_override
         self._cache_ttl = timedelta(hours=cache_hours)
+        self._refresh_margin = timedelta(minutes=refresh_margin_minutes)
+        self.cache_path = cache_path
+        self.snapshot: Optional[RateSnapshot] = self._load()
+        self._inflight: Optional[asyncio.Task] = None
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._hedge_min_s = hedge_min_s
+        self._hedge_max_s = hedge_max_s
+        # En orden de preferencia
+        self.providers: List[_Provider] = [
+            _Provider("dinero.today", self._from_dinero_today,
+                      CircuitBreaker("FX dinero.today", breaker_failures, breaker_cooldown_s)),
+            _Provider("exchangerate.host", self._from_exchangerate_host,
+                      CircuitBreaker("FX exchangerate.host", breaker_failures, breaker_cooldown_s)),
+        ]
 
-    async def _from_dinero_today(self, session: aiohttp.ClientSession, base: str, target: str) -> Optional[float]:
-        """
-        dinero.today expone rates con BASE=USD en latest.json:
-        - rate(USD->X) = rates[X]
-        - rate(X->USD) = 1 / rates[X]
-        - rate(A->B) = rates[B] / rates[A]
-        """
+    # ---- proveedores (tabla completa, base USD) ----
+    async def _from_dinero_today(self) -> Optional[RateSnapshot]:
+        try:
+            r = await self.http.request("GET", self.dinero_url, timeout=10)
+            if r.status != 200:
+                log.warning("FX: respuesta inesperada", extra={"provider": "dinero.today", "status": r.status})
+                return None
+            return _parse_rates(r.json(), "USD", "dinero.today")
+        except deadline.DeadlineExceeded:
+            raise  # plazo de quien espera, no falla del proveedor
+        except Exception as e:
+            log.warning("FX: error del proveedor: %s", e, extra={"provider": "dinero.today", "status": "error"})
+            return None
+
+    async def _from_exchangerate_host(self) -> Optional[RateSnapshot]:
         try:
-            async with session.get(DINERO_TODAY_URL, timeout=10) as r:
-                if r.status != 200:
-                    return None
-                js = await r.json()
-            rates = js.get("rates", {})
-            if not isinstance(rates, dict):
+            r = await self.http.request("GET", self.exchangerate_url, params={"base": "USD"}, timeout=10)
+            if r.status != 200:
+                log.warning("FX: respuesta inesperada", extra={"provider": "exchangerate.host", "status": r.status})
                 return None
+            return _parse_rates(r.json(), "USD", "exchangerate.host")
+        except deadline.DeadlineExceeded:
+            raise  # plazo de quien espera, no falla del proveedor
+        except Exception as e:
+            log.warning("FX: error del proveedor: %s", e, extra={"provider": "exchangerate.host", "status": "error"})
+            return None
+
+    # ---- foto de tasas ----
+    def _fresh(self) -> bool:
+        return self.snapshot is not None and self.snapshot.age() < self._cache_ttl
 
-            if base == "USD":
-                val = rates.get(target)
-                return float(val) if val else None
-            if target == "USD":
-                val = rates.get(base)
-                return (1.0 / float(val)) if val else None
+    def _start_fetch(self) -> asyncio.Task:
+        """
+        La descarga compartida corre en un contexto propio: no hereda el plazo
+        del comando o post que la disparó (cada uno acota su propia espera).
+        """
+        if self._inflight is None or self._inflight.done():
+            self._inflight = asyncio.get_running_loop().create_task(
+                self._fetch_snapshot(), context=contextvars.Context()
+            )
+        return self._inflight
 
-            t_val = rates.get(target)
-            b_val = rates.get(base)
-            if t_val and b_val:
-                return float(t_val) / float(b_val)
+    async def refresh(self) -> Optional[RateSnapshot]:
+        """Descarga una foto nueva; los llamadores concurrentes comparten la misma descarga."""
+        return await asyncio.shield(self._start_fetch())
+
+    async def _call(self, prov: _Provider) -> Optional[RateSnapshot]:
+        started = time.perf_counter()
+        try:
+            snap = await prov.fetch()
+        except BaseException:
+            # Perdedor del hedge cancelado o plazo agotado: sin veredicto,
+            # pero la prueba del semiabierto no puede quedar tomada para siempre
+            prov.breaker.release()
+            raise
+        elapsed = time.perf_counter() - started
+        FX_PROVIDER_SECONDS.observe(elapsed, provider=prov.name, result="ok" if snap else "error")
+        if snap is None:
+            prov.breaker.record_failure()
+        else:
+            prov.breaker.record_success()
+            prov.latency.add(elapsed)
+        return snap
 
+    async def _hedged_fetch(self) -> Optional[RateSnapshot]:
+        """
+        Lanza el primer proveedor disponible; si no respondió (bien) dentro de
+        su p95, lanza además el siguiente. Gana la primera foto válida y las
+        llamadas perdedoras se cancelan. El cortocircuito de cada proveedor se
+        consulta (allow) solo al lanzarlo: uno que nunca se llegó a usar no
+        gasta la llamada de prueba del semiabierto.
+        """
+        providers = self.providers
+        if not any(p.breaker.available() for p in providers):
+            log.warning("FX: todos los proveedores están en cooldown")
             return None
-        except Exception as e:
-            print(f"[WARN] FX dinero.today error: {e}")
+        loop = asyncio.get_running_loop()
+        pending: Set[asyncio.Task] = set()
+        try:
+            for i, prov in enumerate(providers):
+                if not prov.breaker.allow():
+                    continue
+                pending.add(asyncio.create_task(self._call(prov)))
+                is_last = not any(p.breaker.available() for p in providers[i + 1:])
+                hedge_at = None if is_last else loop.time() + prov.latency.hedge_delay(
+                    self._hedge_min_s, self._hedge_max_s, default_s=1.0
+                )
+                while pending:
+                    timeout = None if hedge_at is None else max(0.0, hedge_at - loop.time())
+                    done, pending = await asyncio.wait(
+                        pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                    )
+                    if not done:
+                        break  # venció el hedge delay: se suma el siguiente proveedor
+                    for t in done:
+                        snap = t.result()
+                        if snap is not None:
+                            return snap
+                    if hedge_at is not None:
+                        break  # falló rápido: no tiene sentido esperar, al siguiente
+            # El siguiente dejó de estar disponible entre medio: se espera a los ya lanzados
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for t in done:
+                    snap = t.result()
+                    if snap is not None:
+                        return snap
             return None
+        finally:
+            for t in pending:
+                t.cancel()
 
-    async def _from_exchangerate_host(self, session: aiohttp.ClientSession, base: str, target: str) -> Optional[float]:
-        url = f"https://api.exchangerate.host/latest?base={base}&symbols={target}"
+    async def _fetch_snapshot(self) -> Optional[RateSnapshot]:
         try:
-            async with session.get(url, timeout=10) as r:
-                if r.status != 200:
-                    print(f"[WARN] FX {base}->{target} status={r.status}")
-                    return None
-                js = await r.json()
-                rate = js.get("rates", {}).get(target)
-                return float(rate) if rate else None
-        except Exception as e:
-            print(f"[WARN] FX exchangerate.host error: {e}")
-            return None
+            snap = await self._hedged_fetch()
+        except deadline.DeadlineExceeded:
+            log.warning("FX: plazo agotado; se mantiene la última foto")
+            return self.snapshot
+        if snap is None:
+            log.warning("FX: ningún proveedor respondió; se mantiene la última foto")
+            return self.snapshot
+        self.snapshot = snap
+        self._schedule_refresh()
+        await asyncio.to_thread(self._save, snap)
+        return snap
+
+    def _schedule_refresh(self) -> None:
+        if self._refresh_task is not None and not self._refresh_task.done():
+            if self._refresh_task is not asyncio.current_task():
+                self._refresh_task.cancel()
+        # Dispara ~11 h después: sin el plazo (ya vencido) de quien la programó
+        self._refresh_task = asyncio.get_running_loop().create_task(
+            self._refresh_later(), context=contextvars.Context()
+        )
 
-    async def get_rate(self, session: aiohttp.ClientSession, base: str, target: str) -> Optional[float]:
+    async def _refresh_later(self) -> None:
+        delay = (self._cache_ttl - self._refresh_margin - self.snapshot.age()).total_seconds()
+        await asyncio.sleep(max(0.0, delay))
+        await self.refresh()
+
+    async def ensure_fresh(self, within: timedelta) -> None:
+        """Renueva ya si la foto falta o vencería dentro de `within` (p. ej. antes del próximo post)."""
+        snap = self.snapshot
+        if snap is None or snap.age() + within >= self._cache_ttl:
+            await self.refresh()
+
+    def warm(self) -> None:
+        """Si la foto falta o venció, la renueva en segundo plano (no bloquea)."""
+        if not self._fresh():
+            self._start_fetch()
+        elif self._refresh_task is None:
+            self._schedule_refresh()
+
+    async def get_rate(self, base: str, target: str) -> Optional[float]:
+        with metrics.span(FX_LOOKUP_SECONDS):
+            return await self._get_rate(base, target)
+
+    async def _get_rate(self, base: str, target: str) -> Optional[float]:
         base = base.upper()
         target = target.upper()
         if base == target:
             return 1.0
 
-        key = (base, target)
-        now = datetime.now(UTC)
-        cached = self._cache.get(key)
-        if cached and now < cached[1]:
-            return cached[0]
-
         if self._usdclp_override and base == "USD" and target == "CLP":
             try:
-                rate = float(self._usdclp_override)
-                self._cache[key] = (rate, now + self._cache_ttl)
-                return rate
+                return float(self._usdclp_override)
             except ValueError:
                 pass
 
-        rate = await self._from_dinero_today(session, base, target)
-        if rate and rate > 0:
-            self._cache[key] = (rate, now + self._cache_ttl)
-            return rate
+        snap = self.snapshot
+        if snap is None:
+            # Arranque en frío sin foto en disco: única vez que se espera al proveedor
+            snap = await self.refresh()
+        else:
+            # Vencida: se sirve la última conocida y se renueva por detrás
+            self.warm()
 
-        rate = await self._from_exchangerate_host(session, base, target)
-        if rate and rate > 0:
-            self._cache[key] = (rate, now + self._cache_ttl)
-            return rate
+        rate = snap.cross(base, target) if snap else None
+        if rate is None:
+            log.warning("FX: sin tasa", extra={"pair": f"{base}-{target}"})
+        return rate
 
-        print(f"[WARN] FX no rate for {base}->{target}")
-        return None
+    # ---- persistencia ----
+    def _load(self) -> Optional[RateSnapshot]:
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return None
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                return RateSnapshot.from_json(json.load(f))
+        except Exception as e:
+            log.warning("FX: cache ilegible (%s): %s", self.cache_path, e)
+            return None
+
+    def _save(self, snap: RateSnapshot) -> None:
+        if not self.cache_path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.cache_path) or ".", exist_ok=True)
+            tmp = f"{self.cache_path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(snap.to_json(), f, separators=(",", ":"))
+            os.replace(tmp, self.cache_path)
+        except Exception as e:
+            log.warning("FX: no se pudo guardar la foto: %s", e)
+
+    async def close(self) -> None:
+        for task in (self._refresh_task, self._inflight):
+            if task is not None and not task.done():
+                task.cancel()
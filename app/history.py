@@ -0,0 +1,287 @@
+import asyncio
+import os
+import sqlite3
+import statistics
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from .offers import Offer
+
+# (origen, destino, salida, regreso) — mismo formato que flights_service.Leg
+Leg = Tuple[str, str, str, str]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS offers (
+    id           INTEGER PRIMARY KEY,
+    route        TEXT NOT NULL,
+    departure    TEXT NOT NULL,
+    return_date  TEXT NOT NULL,
+    observed_at  REAL NOT NULL,
+    observed_day TEXT NOT NULL,
+    price        REAL NOT NULL,
+    currency     TEXT NOT NULL,
+    carrier      TEXT,
+    stops        INTEGER,
+    duration     TEXT
+);
+-- Las ofertas crudas solo se leen al compactar (por observed_at); las
+-- consultas por ruta y fechas van contra `daily` y su clave primaria
+DROP INDEX IF EXISTS ix_offers_route_dates;
+CREATE INDEX IF NOT EXISTS ix_offers_observed ON offers (observed_at);
+
+-- Resumen diario: lo que consultan /history y las alertas. Se mantiene al
+-- escribir, así que las consultas no dependen del volumen de ofertas crudas.
+CREATE TABLE IF NOT EXISTS daily (
+    route       TEXT NOT NULL,
+    departure   TEXT NOT NULL,
+    return_date TEXT NOT NULL,
+    day         TEXT NOT NULL,
+    min_price   REAL NOT NULL,
+    currency    TEXT NOT NULL,
+    samples     INTEGER NOT NULL,
+    PRIMARY KEY (route, departure, return_date, day)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS ix_daily_route_day ON daily (route, day);
+
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+"""
+
+
+def route_key(origin: str, destination: str) -> str:
+    return f"{origin.upper()}-{destination.upper()}"
+
+
+def percentile(values: Sequence[float], pct: float) -> float:
+    """Percentil con interpolación lineal (pct en 0..100)."""
+    ordered = sorted(values)
+    if len(ordered) == 1:
+        return ordered[0]
+    pos = (len(ordered) - 1) * min(max(pct, 0.0), 100.0) / 100.0
+    lo = int(pos)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (pos - lo)
+
+
+@dataclass(frozen=True)
+class DateFilter:
+    """
+    Qué pares de fechas comparar entre días: el histórico guarda también
+    calendarios, watches y /buscar, y mezclar fechas distintas no dice nada.
+
+    - `departure`/`return_date`: un par fijo (usa la clave de `daily`).
+    - `lead_days`: salida a N días del día observado (fechas que ruedan, como
+      las del post diario con DAYS_AHEAD).
+    - `stay`: regreso a N noches de la salida.
+    """
+    departure: Optional[str] = None
+    return_date: Optional[str] = None
+    lead_days: Optional[int] = None
+    stay: Optional[int] = None
+
+    def sql(self) -> Tuple[str, List[Any]]:
+        clauses: List[str] = []
+        params: List[Any] = []
+        if self.departure:
+            clauses.append("departure = ?")
+            params.append(self.departure)
+        if self.return_date:
+            clauses.append("return_date = ?")
+            params.append(self.return_date)
+        if self.lead_days is not None:
+            clauses.append("departure = date(day, ?)")
+            params.append(f"+{self.lead_days} days")
+        if self.stay is not None:
+            clauses.append("return_date = date(departure, ?)")
+            params.append(f"+{self.stay} days")
+        return "".join(f" AND {c}" for c in clauses), params
+
+    @property
+    def label(self) -> str:
+        parts = []
+        if self.departure and self.return_date:
+            parts.append(f"{self.departure} → {self.return_date}")
+        elif self.departure:
+            parts.append(f"salida {self.departure}")
+        if self.lead_days is not None:
+            parts.append(f"salida a {self.lead_days} días")
+        if self.stay is not None:
+            parts.append(f"{self.stay} noches")
+        return ", ".join(parts) or "todas las fechas"
+
+
+@dataclass
+class RouteStats:
+    routes: List[str]
+    days: int
+    # (día, mínimo del día) en orden cronológico
+    series: List[Tuple[str, float]]
+    currency: str
+    dates: Optional[DateFilter] = None
+
+    @property
+    def min(self) -> Optional[float]:
+        return min(p for _, p in self.series) if self.series else None
+
+    @property
+    def median(self) -> Optional[float]:
+        return statistics.median(p for _, p in self.series) if self.series else None
+
+    @property
+    def last(self) -> Optional[float]:
+        return self.series[-1][1] if self.series else None
+
+    @property
+    def slope_per_day(self) -> Optional[float]:
+        """Pendiente por mínimos cuadrados del mínimo diario (moneda/día)."""
+        if len(self.series) < 2:
+            return None
+        base = datetime.fromisoformat(self.series[0][0])
+        xs = [(datetime.fromisoformat(d) - base).days for d, _ in self.series]
+        ys = [p for _, p in self.series]
+        mx, my = statistics.fmean(xs), statistics.fmean(ys)
+        den = sum((x - mx) ** 2 for x in xs)
+        if den == 0:
+            return None
+        return sum((x - mx) * (y - my) for x, y in zip(xs, ys)) / den
+
+
+class PriceHistory:
+    """
+    Histórico de precios embebido en SQLite.
+
+    Cada corrida escribe sus ofertas en un solo lote/transacción y actualiza el
+    resumen diario. `compact()` borra las ofertas crudas más viejas que la
+    retención (el resumen diario se conserva) y recupera espacio.
+    """
+    def __init__(self, path: str, tz, retention_days: int = 180, daily_retention_days: int = 0):
+        self.path = path
+        self.tz = tz
+        self.retention_days = retention_days
+        self.daily_retention_days = daily_retention_days
+        self._db: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    # ---- conexión (se usa desde to_thread) ----
+    def _conn(self) -> sqlite3.Connection:
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            db = sqlite3.connect(self.path, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            db.executescript(_SCHEMA)
+            self._db = db
+        return self._db
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    # ---- escritura ----
+    async def record(self, results: Dict[Leg, List[Offer]]) -> int:
+        """Guarda todas las ofertas de una corrida en un único lote."""
+        now = time.time()
+        day = datetime.now(self.tz).date().isoformat()
+        rows = []
+        for (o_code, d_code, dep, ret), offers in results.items():
+            route = route_key(o_code, d_code)
+            for o in offers:
+                rows.append((route, dep, ret, now, day, o.price, o.currency, o.carrier, o.stops, o.duration))
+        if not rows:
+            return 0
+        await asyncio.to_thread(self._insert, rows)
+        return len(rows)
+
+    def _insert(self, rows: List[tuple]) -> None:
+        with self._lock, self._conn() as db:
+            db.executemany(
+                "INSERT INTO offers (route, departure, return_date, observed_at, observed_day,"
+                " price, currency, carrier, stops, duration) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            db.executemany(
+                "INSERT INTO daily (route, departure, return_date, day, min_price, currency, samples)"
+                " VALUES (?, ?, ?, ?, ?, ?, 1)"
+                " ON CONFLICT (route, departure, return_date, day) DO UPDATE SET"
+                " min_price = MIN(min_price, excluded.min_price), samples = samples + 1",
+                [(r[0], r[1], r[2], r[4], r[5], r[6]) for r in rows],
+            )
+
+    # ---- consultas ----
+    async def route_stats(
+        self, routes: Iterable[str], days: int, dates: Optional[DateFilter] = None
+    ) -> RouteStats:
+        routes = sorted(set(routes))
+        since = (datetime.now(self.tz).date() - timedelta(days=days - 1)).isoformat()
+        rows = await asyncio.to_thread(self._daily_mins, routes, since, None, dates)
+        currency = rows[0][2] if rows else ""
+        return RouteStats(routes, days, [(d, p) for d, p, _ in rows], currency, dates)
+
+    async def baseline(
+        self,
+        routes: Iterable[str],
+        window_days: int,
+        pct: float,
+        dates: Optional[DateFilter] = None,
+        exclude_today: bool = True,
+    ) -> Tuple[Optional[float], int]:
+        """
+        Percentil `pct` de los mínimos diarios de la ventana (sin contar hoy),
+        solo con los pares de fechas de `dates`. Devuelve (valor, n).
+        """
+        routes = sorted(set(routes))
+        today = datetime.now(self.tz).date()
+        since = (today - timedelta(days=window_days)).isoformat()
+        until = today.isoformat() if exclude_today else None
+        rows = await asyncio.to_thread(self._daily_mins, routes, since, until, dates)
+        values = [p for _, p, _ in rows]
+        if not values:
+            return None, 0
+        return percentile(values, pct), len(values)
+
+    def _daily_mins(
+        self, routes: List[str], since: str, until: Optional[str], dates: Optional[DateFilter] = None
+    ) -> List[Tuple[str, float, str]]:
+        if not routes:
+            return []
+        marks = ",".join("?" for _ in routes)
+        date_sql, date_params = dates.sql() if dates else ("", [])
+        sql = (
+            f"SELECT day, MIN(min_price), MIN(currency) FROM daily"
+            f" WHERE route IN ({marks}){date_sql} AND day >= ?"
+            + (" AND day < ?" if until else "")
+            + " GROUP BY day ORDER BY day"
+        )
+        params: List[Any] = [*routes, *date_params, since] + ([until] if until else [])
+        with self._lock:
+            return self._conn().execute(sql, params).fetchall()
+
+    # ---- mantenimiento ----
+    async def compact(self) -> None:
+        await asyncio.to_thread(self._compact)
+
+    def _compact(self) -> None:
+        with self._lock:
+            db = self._conn()
+            today = datetime.now(self.tz).date()
+            last = db.execute("SELECT value FROM meta WHERE key = 'last_compact'").fetchone()
+            if last and last[0] == today.isoformat():
+                return
+            with db:
+                if self.retention_days > 0:
+                    cutoff = time.time() - self.retention_days * 86400
+                    db.execute("DELETE FROM offers WHERE observed_at < ?", (cutoff,))
+                if self.daily_retention_days > 0:
+                    cutoff_day = (today - timedelta(days=self.daily_retention_days)).isoformat()
+                    db.execute("DELETE FROM daily WHERE day < ?", (cutoff_day,))
+                db.execute(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES ('last_compact', ?)",
+                    (today.isoformat(),),
+                )
+            db.execute("PRAGMA incremental_vacuum")
+            db.execute("PRAGMA optimize")
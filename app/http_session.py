@@ -0,0 +1,100 @@
+import json
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional
+from urllib.parse import urlsplit
+
+import aiohttp
+from multidict import CIMultiDict
+
+from . import deadline, metrics
+from .config import Settings
+
+HTTP_SECONDS = metrics.histogram("http_request_seconds", "Latencia de requests HTTP salientes por endpoint")
+HTTP_ERRORS = metrics.counter("http_request_errors_total", "Requests HTTP salientes sin respuesta (red/timeout)")
+
+
+@dataclass
+class HttpResponse:
+    """Respuesta ya leída completa: el socket vuelve al pool antes de parsear."""
+    status: int
+    body: bytes
+    headers: CIMultiDict = field(default_factory=CIMultiDict)
+    latency: float = 0.0
+
+    def text(self) -> str:
+        return self.body.decode("utf-8", errors="replace")
+
+    def json(self) -> Any:
+        return json.loads(self.body)
+
+
+class HttpSessionManager:
+    """
+    Dueño de la ClientSession de larga vida (keep-alive, cache DNS y límites
+    por host). Se crea en main y se cierra al apagar el bot; AmadeusClient y
+    FXConverter la piden prestada en cada request.
+    """
+    def __init__(self, cfg: Settings):
+        self.cfg = cfg
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def session(self) -> aiohttp.ClientSession:
+        # Se crea perezosamente: aiohttp necesita el loop ya corriendo
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.cfg.http_limit,
+                limit_per_host=self.cfg.http_limit_per_host,
+                keepalive_timeout=self.cfg.http_keepalive_s,
+                ttl_dns_cache=self.cfg.http_dns_ttl_s,
+                use_dns_cache=True,
+            )
+            timeout = aiohttp.ClientTimeout(
+                total=self.cfg.http_timeout_s,
+                connect=self.cfg.http_connect_timeout_s,
+            )
+            self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        return self._session
+
+    async def request(
+        self,
+        method: str,
+        url: str,
+        *,
+        params: Optional[Dict[str, str]] = None,
+        data: Optional[Dict[str, str]] = None,
+        json_body: Optional[Any] = None,
+        headers: Optional[Dict[str, str]] = None,
+        timeout: Optional[float] = None,
+    ) -> HttpResponse:
+        session = await self.session()
+        # Nunca más allá del plazo del post o comando en curso
+        timeout = deadline.clamp(timeout)
+        kwargs: Dict[str, Any] = {}
+        if timeout is not None:
+            kwargs["timeout"] = aiohttp.ClientTimeout(
+                total=timeout, connect=min(timeout, self.cfg.http_connect_timeout_s)
+            )
+        parts = urlsplit(url)
+        started = time.perf_counter()
+        try:
+            async with session.request(
+                method, url, params=params, data=data, json=json_body, headers=headers, **kwargs
+            ) as r:
+                body = await r.read()
+                resp = HttpResponse(
+                    status=r.status,
+                    body=body,
+                    headers=CIMultiDict(r.headers),
+                    latency=time.perf_counter() - started,
+                )
+        except Exception as e:
+            HTTP_ERRORS.inc(host=parts.netloc, path=parts.path, kind=type(e).__name__)
+            raise
+        HTTP_SECONDS.observe(resp.latency, host=parts.netloc, path=parts.path, status=resp.status)
+        return resp
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
@@ -0,0 +1,160 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+from datetime import datetime, UTC
+from typing import Dict, Optional, Tuple
+
+from . import metrics
+
+DROPPED = metrics.counter("log_records_dropped_total", "Registros de log descartados (sampled = muestreo, queue_full = cola llena)")
+
+# Atributos propios de LogRecord: todo lo demás vino por `extra` y va como campo
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "suppressed"}
+
+_LEVEL_TAGS = {"WARNING": "WARN", "ERROR": "ERR", "CRITICAL": "ERR"}
+
+
+def _fields(record: logging.LogRecord) -> Dict[str, object]:
+    return {k: v for k, v in vars(record).items() if k not in _RESERVED and not k.startswith("_")}
+
+
+class JsonFormatter(logging.Formatter):
+    """Una línea JSON por registro: ts, level, logger, msg y los campos de `extra` (route, leg, latency_ms, status…)."""
+    def format(self, record: logging.LogRecord) -> str:
+        out: Dict[str, object] = {
+            "ts": datetime.fromtimestamp(record.created, UTC).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        out.update(_fields(record))
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            out["suppressed"] = suppressed
+        if record.exc_text:
+            out["exc"] = record.exc_text
+        return json.dumps(out, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Para desarrollo local: "[WARN] mensaje route=SCL-NRT status=429"."""
+    def format(self, record: logging.LogRecord) -> str:
+        tag = _LEVEL_TAGS.get(record.levelname, record.levelname)
+        parts = [f"[{tag}] {record.getMessage()}"]
+        parts += [f"{k}={v}" for k, v in _fields(record).items()]
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            parts.append(f"(+{suppressed} similares omitidos)")
+        line = " ".join(parts)
+        return f"{line}\n{record.exc_text}" if record.exc_text else line
+
+
+class SampleFilter(logging.Filter):
+    """
+    Muestreo de avisos repetidos: por (logger, plantilla del mensaje) pasan los
+    primeros `burst` de cada ventana de `window_s`; el resto se descarta y se
+    informa como `suppressed` en el primero de la ventana siguiente. Los ERROR
+    y superiores pasan siempre. Corre antes de encolar, así que lo descartado
+    no cuesta nada más.
+    """
+    def __init__(self, burst: int = 5, window_s: float = 60.0):
+        super().__init__()
+        self.burst = burst
+        self.window_s = window_s
+        # clave -> (inicio de ventana, emitidos, descartados)
+        self._seen: Dict[Tuple[str, str], Tuple[float, int, int]] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.burst <= 0 or record.levelno >= logging.ERROR:
+            return True
+        key = (record.name, str(record.msg))
+        now = time.monotonic()
+        start, sent, dropped = self._seen.get(key, (now, 0, 0))
+        if now - start >= self.window_s:
+            if dropped:
+                record.suppressed = dropped
+            start, sent, dropped = now, 0, 0
+        if sent >= self.burst:
+            self._seen[key] = (start, sent, dropped + 1)
+            DROPPED.inc(reason="sampled")
+            return False
+        self._seen[key] = (start, sent + 1, dropped)
+        if len(self._seen) > 1024:
+            # Plantillas dinámicas (f-strings) no deberían llegar aquí, pero por si acaso
+            for k in [k for k, (at, _, _) in self._seen.items() if now - at >= self.window_s]:
+                del self._seen[k]
+        return True
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """Encola sin bloquear nunca: con la cola llena, el registro se descarta y se cuenta."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # El mensaje se resuelve aquí (los args pueden cambiar después); el
+        # formato JSON/texto, en el hilo del listener
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        record.stack_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DROPPED.inc(reason="queue_full")
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_lock = threading.Lock()
+
+
+def setup(
+    level: str = "INFO",
+    fmt: str = "json",
+    sample_burst: int = 5,
+    sample_window_s: float = 60.0,
+    queue_size: int = 10_000,
+) -> None:
+    """
+    Logging del proceso: el event loop solo encola (QueueHandler) y un hilo
+    aparte (QueueListener) formatea y escribe en stdout, así que un pico de
+    logs no frena el loop ni el heartbeat del gateway. Incluye los loggers de
+    discord.py (se propagan a la raíz). Idempotente.
+    """
+    global _listener
+    with _lock:
+        if _listener is not None:
+            return
+        out = logging.StreamHandler(sys.stdout)
+        out.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+        q: "queue.Queue" = queue.Queue(maxsize=max(1, queue_size))
+        handler = _QueueHandler(q)
+        handler.addFilter(SampleFilter(sample_burst, sample_window_s))
+
+        root = logging.getLogger()
+        for h in list(root.handlers):
+            root.removeHandler(h)
+        root.addHandler(handler)
+        root.setLevel(level.upper())
+
+        _listener = logging.handlers.QueueListener(q, out, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown)
+
+
+def shutdown() -> None:
+    """Vacía la cola y detiene el hilo escritor."""
+    global _listener
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
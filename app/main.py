@@ -1,26 +1,127 @@
 from dotenv import load_dotenv
 load_dotenv()
 
+import logging
+from typing import Tuple
+
 from .config import Settings
+from .http_session import HttpSessionManager
+from .cassette import CassetteHttp
+from .search_cache import SearchCache
+from .quota import QuotaPlanner
 from .amadeus_client import AmadeusClient
+from .offers import offers_from_json, offers_to_json
+from .ratelimit import RetryPolicy, bucket_for
 from .fx import FXConverter
+from .history import PriceHistory
+from .watchlist import WatchStore
 from .flights_service import FlightsService
 from .bot_app import create_bot
+from .startup import StartupTimer
+from . import logs
+
+log = logging.getLogger(__name__)
+
+
+def build_services(cfg: Settings) -> Tuple[FlightsService, HttpSessionManager]:
+    """Arma el grafo de dependencias (pool HTTP, cache, Amadeus, FX, histórico, watches, servicio)."""
+    http = HttpSessionManager(cfg)
+    if cfg.cassette_mode != "off":
+        http = CassetteHttp(
+            http,
+            cfg.cassette_path or cfg.data_path("cassette.amc"),
+            cfg.cassette_mode,
+            latency=cfg.cassette_latency,
+        )
+    search_cache = None
+    if cfg.search_cache_ttl_s > 0:
+        search_cache = SearchCache(
+            ttl_s=cfg.search_cache_ttl_s,
+            max_entries=cfg.search_cache_max_entries,
+            stale_s=cfg.search_cache_stale_s,
+            disk_path=cfg.data_path("search_cache.sqlite3") if cfg.search_cache_disk else None,
+            dump=offers_to_json,
+            load=offers_from_json,
+        )
+    amadeus = AmadeusClient(
+        cfg.amadeus_host,
+        cfg.amadeus_client_id,
+        cfg.amadeus_client_secret,
+        http,
+        token_cache_path=cfg.data_path("amadeus_token.json") if cfg.token_persist else None,
+        token_refresh_margin_s=cfg.token_refresh_margin_s,
+        cache=search_cache,
+        limiter=bucket_for(cfg.amadeus_host, cfg.amadeus_tps, cfg.amadeus_burst),
+        retry=RetryPolicy(
+            max_attempts=cfg.amadeus_max_attempts,
+            base_delay_s=cfg.amadeus_backoff_base_s,
+            max_delay_s=cfg.amadeus_backoff_max_s,
+        ),
+        keep_raw=cfg.debug_raw_offers,
+        quota=QuotaPlanner(
+            cfg.data_path("amadeus_quota.json"),
+            cfg.amadeus_monthly_quota,
+            reserve_per_day=cfg.quota_reserve_per_day,
+            soft_pct=cfg.quota_soft_pct,
+            hard_pct=cfg.quota_hard_pct,
+        ),
+    )
+    fx = FXConverter(
+        http,
+        usdclp_override=cfg.fx_usdclp,
+        cache_hours=cfg.fx_cache_hours,
+        cache_path=cfg.data_path("fx_rates.json") if cfg.fx_persist else None,
+        refresh_margin_minutes=cfg.fx_refresh_margin_minutes,
+        hedge_min_s=cfg.fx_hedge_min_ms / 1000,
+        hedge_max_s=cfg.fx_hedge_max_ms / 1000,
+        breaker_failures=cfg.fx_breaker_failures,
+        breaker_cooldown_s=cfg.fx_breaker_cooldown_s,
+        dinero_url=cfg.fx_dinero_url,
+        exchangerate_url=cfg.fx_exchangerate_url,
+    )
+    history = None
+    if cfg.history_enabled:
+        history = PriceHistory(
+            cfg.data_path("price_history.sqlite3"),
+            tz=cfg.tz,
+            retention_days=cfg.history_retention_days,
+            daily_retention_days=cfg.history_daily_retention_days,
+        )
+    watches = None
+    if cfg.watch_enabled:
+        watches = WatchStore(cfg.data_path("watches.sqlite3"), max_per_user=cfg.watch_max_per_user)
+    return FlightsService(cfg, amadeus, fx, history=history, watches=watches), http
+
 
 def main():
-    cfg = Settings()
-    if not cfg.token or cfg.channel_id == 0:
-        raise RuntimeError("Faltan DISCORD_TOKEN o DISCORD_CHANNEL_ID")
+    startup = StartupTimer()
+    with startup.phase("config"):
+        cfg = Settings()
+        logs.setup(
+            cfg.log_level,
+            cfg.log_format,
+            sample_burst=cfg.log_sample_burst,
+            sample_window_s=cfg.log_sample_window_s,
+            queue_size=cfg.log_queue_size,
+        )
+        if not cfg.token or cfg.channel_id == 0:
+            raise RuntimeError("Faltan DISCORD_TOKEN o DISCORD_CHANNEL_ID")
 
-    amadeus = AmadeusClient(cfg.amadeus_host, cfg.amadeus_client_id, cfg.amadeus_client_secret)
-    fx = FXConverter(usdclp_override=cfg.fx_usdclp)
-    flights_service = FlightsService(cfg, amadeus, fx)
+    with startup.phase("services"):
+        flights_service, http = build_services(cfg)
 
-    print(f"[DIAG] PRIMARY={cfg.primary_currency}, SECOND={cfg.second_currency}, "
-          f"DEP={cfg.depart_date_env or '(auto)'} RET={cfg.return_date_env or '(auto)'}")
+    log.info("Configuración", extra={
+        "primary": cfg.primary_currency,
+        "second": cfg.second_currency,
+        "dep": cfg.depart_date_env or "(auto)",
+        "ret": cfg.return_date_env or "(auto)",
+    })
 
-    bot = create_bot(cfg, flights_service)
-    bot.run(cfg.token)
+    with startup.phase("bot"):
+        bot = create_bot(cfg, flights_service, http, startup=startup)
+    # log_handler=None: discord.py no instala su propio StreamHandler; sus
+    # loggers se propagan a la raíz y pasan por la misma cola
+    bot.run(cfg.token, log_handler=None)
 
 if __name__ == "__main__":
     main()
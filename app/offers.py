@@ -0,0 +1,110 @@
+import heapq
+from dataclasses import dataclass
+from itertools import islice
+from operator import attrgetter
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+
+@dataclass(slots=True, frozen=True)
+class Offer:
+    """
+    Oferta ya parseada: solo lo que se muestra y con lo que se ordena.
+    El JSON crudo de Amadeus (tarifas, traveler pricings, equipaje…) se
+    descarta al parsear salvo que DEBUG_RAW_OFFERS esté activo.
+    """
+    price: float
+    currency: str
+    origin: str
+    destination: str
+    stops: int
+    duration: str
+    carrier: Optional[str] = None
+    raw: Optional[Dict[str, Any]] = None
+
+    @classmethod
+    def from_amadeus(cls, js: Dict[str, Any], keep_raw: bool = False) -> Optional["Offer"]:
+        try:
+            price = float(js["price"]["grandTotal"])
+        except (KeyError, TypeError, ValueError):
+            return None
+        itin = (js.get("itineraries") or [{}])[0]
+        segs = itin.get("segments") or []
+        first = segs[0] if segs else {}
+        last = segs[-1] if segs else {}
+        carriers = js.get("validatingAirlineCodes") or [first.get("carrierCode")]
+        return cls(
+            price=price,
+            currency=(js["price"].get("currency") or "").upper(),
+            origin=first.get("departure", {}).get("iataCode", "?"),
+            destination=last.get("arrival", {}).get("iataCode", "?"),
+            stops=max(0, len(segs) - 1),
+            duration=itin.get("duration", ""),
+            carrier=carriers[0] if carriers else None,
+            raw=js if keep_raw else None,
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "price": self.price,
+            "currency": self.currency,
+            "origin": self.origin,
+            "destination": self.destination,
+            "stops": self.stops,
+            "duration": self.duration,
+            "carrier": self.carrier,
+        }
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "Offer":
+        return cls(**d)
+
+
+by_price = attrgetter("price")
+
+
+def parse_offers(data: Iterable[Dict[str, Any]], k: int, keep_raw: bool = False) -> List[Offer]:
+    """Parsea y se queda con las k más baratas (heap, sin ordenar todo)."""
+    parsed = (Offer.from_amadeus(js, keep_raw) for js in data)
+    return heapq.nsmallest(k, (o for o in parsed if o is not None), key=by_price)
+
+
+def _endpoints(itin: Dict[str, Any]) -> Tuple[str, str]:
+    segs = itin.get("segments") or [{}]
+    return segs[0].get("departure", {}).get("iataCode", "?"), segs[-1].get("arrival", {}).get("iataCode", "?")
+
+
+def parse_offers_by_route(
+    data: Iterable[Dict[str, Any]], k: int, keep_raw: bool = False
+) -> Dict[Tuple[str, str], List[Offer]]:
+    """
+    Para búsquedas con varios aeropuertos (POST con códigos alternativos):
+    agrupa por (origen, destino) de la ida y se queda con las k más baratas
+    de cada ruta. Las combinaciones abiertas (la vuelta sale de otro
+    aeropuerto o llega a otro) se descartan: no corresponden a ninguna pierna.
+    """
+    routes: Dict[Tuple[str, str], List[Offer]] = {}
+    for js in data:
+        itins = js.get("itineraries") or []
+        if len(itins) != 2:
+            continue
+        out_from, out_to = _endpoints(itins[0])
+        back_from, back_to = _endpoints(itins[1])
+        if (back_from, back_to) != (out_to, out_from):
+            continue
+        offer = Offer.from_amadeus(js, keep_raw)
+        if offer is not None:
+            routes.setdefault((out_from, out_to), []).append(offer)
+    return {route: heapq.nsmallest(k, offers, key=by_price) for route, offers in routes.items()}
+
+
+def top_k(sorted_lists: Iterable[List[Offer]], k: int) -> List[Offer]:
+    """k más baratas entre varias listas ya ordenadas (merge por heap entre piernas)."""
+    return list(islice(heapq.merge(*sorted_lists, key=by_price), k))
+
+
+def offers_to_json(offers: List[Offer]) -> List[Dict[str, Any]]:
+    return [o.to_dict() for o in offers]
+
+
+def offers_from_json(data: List[Dict[str, Any]]) -> List[Offer]:
+    return [Offer.from_dict(d) for d in data]
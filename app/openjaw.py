@@ -0,0 +1,85 @@
+import heapq
+from dataclasses import dataclass
+from typing import List, Optional, Sequence, Tuple
+
+from .offers import Offer, by_price
+
+# Marca del tramo interno en tren (no es una oferta de Amadeus)
+SHINKANSEN = "Shinkansen"
+
+
+@dataclass(frozen=True)
+class OpenJawTrip:
+    """Ida a una ciudad, vuelta desde otra y, opcionalmente, el tramo interno entre ambas."""
+    outbound: Offer
+    inbound: Offer
+    hop: Optional[Offer] = None
+
+    @property
+    def price(self) -> float:
+        return self.outbound.price + self.inbound.price + (self.hop.price if self.hop else 0.0)
+
+
+def shinkansen_offer(fare: float, currency: str, from_city: str, to_city: str) -> Offer:
+    """Tarifa fija del tren como pseudo-oferta, para competir con los vuelos internos."""
+    return Offer(
+        price=fare,
+        currency=currency,
+        origin=from_city,
+        destination=to_city,
+        stops=0,
+        duration="PT2H30M",
+        carrier=SHINKANSEN,
+    )
+
+
+def k_smallest_pairs(a: Sequence[float], b: Sequence[float], k: int) -> List[Tuple[float, int, int]]:
+    """
+    Las k sumas a[i] + b[j] más chicas, con `a` y `b` ordenadas ascendente,
+    sin recorrer el producto: se expande la frontera (i+1, j) / (i, j+1)
+    desde (0, 0) con un heap, O(k log k). Devuelve (suma, i, j).
+    """
+    if not a or not b or k <= 0:
+        return []
+    heap = [(a[0] + b[0], 0, 0)]
+    seen = {(0, 0)}
+    out: List[Tuple[float, int, int]] = []
+    while heap and len(out) < k:
+        total, i, j = heapq.heappop(heap)
+        out.append((total, i, j))
+        for ni, nj in ((i + 1, j), (i, j + 1)):
+            if ni < len(a) and nj < len(b) and (ni, nj) not in seen:
+                seen.add((ni, nj))
+                heapq.heappush(heap, (a[ni] + b[nj], ni, nj))
+    return out
+
+
+def cheapest_trips(
+    outbound: List[Offer],
+    inbound: List[Offer],
+    k: int,
+    hops: Optional[List[Offer]] = None,
+) -> List[OpenJawTrip]:
+    """
+    Los k itinerarios más baratos (listas ya ordenadas por precio). Con tramo
+    interno se combina en dos pasos: los k mejores (ida + tramo) y luego esos
+    contra la vuelta; los k mejores tríos siempre salen de los k mejores pares.
+    """
+    if hops is None:
+        pairs = k_smallest_pairs([o.price for o in outbound], [o.price for o in inbound], k)
+        return [OpenJawTrip(outbound[i], inbound[j]) for _, i, j in pairs]
+    firsts = k_smallest_pairs([o.price for o in outbound], [h.price for h in hops], k)
+    trios = k_smallest_pairs([total for total, _, _ in firsts], [o.price for o in inbound], k)
+    return [
+        OpenJawTrip(outbound[firsts[f][1]], inbound[j], hops[firsts[f][2]])
+        for _, f, j in trios
+    ]
+
+
+def best_trips(candidates: List[List[OpenJawTrip]], k: int) -> List[OpenJawTrip]:
+    """Une los resultados de ambos sentidos (Tokio→Osaka y Osaka→Tokio)."""
+    return heapq.nsmallest(k, (t for trips in candidates for t in trips), key=lambda t: t.price)
+
+
+def sorted_hops(flights: List[Offer], train: Optional[Offer]) -> List[Offer]:
+    return list(heapq.merge(flights, [train] if train else [], key=by_price))
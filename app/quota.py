@@ -0,0 +1,245 @@
+import asyncio
+import json
+import logging
+import math
+import os
+import time
+from calendar import monthrange
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, UTC
+from typing import Any, Dict, Iterator, List, Optional
+
+from . import metrics
+
+log = logging.getLogger(__name__)
+
+SCHEDULED = "scheduled"
+INTERACTIVE = "interactive"
+
+# Quién origina las llamadas en curso. Por defecto, los posts programados
+# (cron, prefetch, revalidaciones); los slash commands lo fijan a INTERACTIVE.
+PURPOSE: ContextVar[str] = ContextVar("quota_purpose", default=SCHEDULED)
+
+
+class CallCount:
+    """Llamadas facturables hechas dentro de un `counting()` (las que sí salieron a la red)."""
+    def __init__(self) -> None:
+        self.n = 0
+
+
+# Contador de la operación en curso (p. ej. un /calendario); None = no se cuenta
+CALLS: ContextVar[Optional[CallCount]] = ContextVar("quota_calls", default=None)
+
+# Modos del planificador (solo afectan a lo interactivo)
+NORMAL = "normal"
+SAVING = "ahorro"
+CACHE_ONLY = "solo-cache"
+
+QUOTA_CALLS = metrics.counter("amadeus_quota_calls_total", "Llamadas facturables a Amadeus por endpoint y origen")
+QUOTA_DENIED = metrics.counter("amadeus_quota_denied_total", "Búsquedas interactivas rechazadas para no tocar la reserva")
+
+
+class QuotaExhausted(RuntimeError):
+    """La búsqueda interactiva no está en cache y la cuota que queda es de los posts programados."""
+
+
+@contextmanager
+def purpose(name: str) -> Iterator[None]:
+    token = PURPOSE.set(name)
+    try:
+        yield
+    finally:
+        PURPOSE.reset(token)
+
+
+@contextmanager
+def counting() -> Iterator[CallCount]:
+    count = CallCount()
+    token = CALLS.set(count)
+    try:
+        yield count
+    finally:
+        CALLS.reset(token)
+
+
+def note_call() -> None:
+    count = CALLS.get()
+    if count is not None:
+        count.n += 1
+
+
+def _month_bounds(now: datetime):
+    start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    days = monthrange(now.year, now.month)[1]
+    return start, days
+
+
+class QuotaPlanner:
+    """
+    Libro de llamadas del mes (UTC) por origen y endpoint, persistido en
+    DATA_DIR, más el planificador que lo lee:
+
+    - reserva para los posts programados lo que resta del mes, al mayor entre
+      `reserve_per_day` y el ritmo programado observado;
+    - con uso + reserva sobre `soft_pct` de la cuota, lo interactivo pasa a
+      ahorro (sirve cache vencida sin revalidar);
+    - sobre `hard_pct`, lo interactivo queda solo-cache: lo que no esté en
+      cache se rechaza para que el post de las 11:00 siga saliendo.
+
+    Con `monthly_quota` = 0 solo lleva la cuenta.
+    """
+    def __init__(
+        self,
+        path: Optional[str],
+        monthly_quota: int,
+        reserve_per_day: float = 10,
+        soft_pct: float = 80,
+        hard_pct: float = 100,
+        flush_interval_s: float = 10.0,
+    ):
+        self.path = path
+        self.monthly_quota = monthly_quota
+        self.reserve_per_day = reserve_per_day
+        self.soft_pct = soft_pct
+        self.hard_pct = hard_pct
+        self.flush_interval_s = flush_interval_s
+        self.month = ""
+        # origen -> endpoint -> llamadas
+        self.calls: Dict[str, Dict[str, int]] = {}
+        self._dirty = False
+        self._saved_at = 0.0
+        self._saving: Optional[asyncio.Task] = None
+        self._load()
+
+    # ---- Libro ----
+    def record(self, endpoint: str) -> None:
+        self._roll()
+        who = PURPOSE.get()
+        per = self.calls.setdefault(who, {})
+        per[endpoint] = per.get(endpoint, 0) + 1
+        QUOTA_CALLS.inc(endpoint=endpoint, purpose=who)
+        self._dirty = True
+        # Guardado agrupado y fuera del loop: como mucho uno cada
+        # flush_interval_s (y el último al cerrar)
+        if time.monotonic() - self._saved_at >= self.flush_interval_s:
+            if self._saving is None or self._saving.done():
+                self._saving = asyncio.ensure_future(self.flush())
+
+    def used(self, who: Optional[str] = None) -> int:
+        self._roll()
+        groups = [self.calls.get(who, {})] if who else list(self.calls.values())
+        return sum(n for per in groups for n in per.values())
+
+    def by_endpoint(self) -> Dict[str, int]:
+        self._roll()
+        out: Dict[str, int] = {}
+        for per in self.calls.values():
+            for endpoint, n in per.items():
+                out[endpoint] = out.get(endpoint, 0) + n
+        return out
+
+    def _roll(self) -> None:
+        month = datetime.now(UTC).strftime("%Y-%m")
+        if month != self.month:
+            self.month, self.calls = month, {}
+            self._dirty = True
+
+    # ---- Plan ----
+    @staticmethod
+    def _days(now: Optional[datetime] = None):
+        """(días transcurridos, días restantes) del mes, fraccionarios."""
+        now = now or datetime.now(UTC)
+        start, days = _month_bounds(now)
+        elapsed = (now - start).total_seconds() / 86400
+        return elapsed, days - elapsed
+
+    def reserve(self) -> int:
+        """Llamadas a guardar para los posts programados hasta fin de mes."""
+        elapsed, left = self._days()
+        observed = self.used(SCHEDULED) / max(1.0, elapsed)
+        return math.ceil(max(self.reserve_per_day, observed) * left)
+
+    def projection(self) -> int:
+        """Uso estimado a fin de mes al ritmo actual (total, no solo programado)."""
+        elapsed, left = self._days()
+        used = self.used()
+        return round(used + used / max(1.0, elapsed) * left)
+
+    def mode(self) -> str:
+        if self.monthly_quota <= 0:
+            return NORMAL
+        committed = (self.used() + self.reserve()) / self.monthly_quota * 100
+        if committed >= self.hard_pct:
+            return CACHE_ONLY
+        if committed >= self.soft_pct:
+            return SAVING
+        return NORMAL
+
+    def prefer_cache(self) -> bool:
+        """Lo interactivo, fuera del modo normal, se conforma con cache vencida y no revalida."""
+        return PURPOSE.get() == INTERACTIVE and self.mode() != NORMAL
+
+    def admit(self) -> None:
+        """Antes de una llamada en vivo: lo interactivo en solo-cache no pasa."""
+        if PURPOSE.get() == INTERACTIVE and self.mode() == CACHE_ONLY:
+            QUOTA_DENIED.inc()
+            raise QuotaExhausted("cuota mensual reservada para los posts programados")
+
+    def report(self) -> List[str]:
+        """Líneas KEY: valor para /diag."""
+        used = self.used()
+        endpoints = ", ".join(f"{e}={n}" for e, n in sorted(self.by_endpoint().items())) or "-"
+        lines = [
+            f"CUOTA_MES: {used} usadas ({self.used(SCHEDULED)} programadas, "
+            f"{self.used(INTERACTIVE)} interactivas) — {endpoints}"
+        ]
+        if self.monthly_quota > 0:
+            projection = self.projection()
+            lines.append(
+                f"CUOTA_PLAN: {max(0, self.monthly_quota - used)}/{self.monthly_quota} restantes, "
+                f"reserva posts {self.reserve()}, proyección fin de mes ~{projection} "
+                f"({projection / self.monthly_quota:.0%}), modo {self.mode()}"
+            )
+        return lines
+
+    # ---- Persistencia ----
+    def _load(self) -> None:
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                js = json.load(f)
+            self.month = js["month"]
+            self.calls = {who: {e: int(n) for e, n in per.items()} for who, per in js["calls"].items()}
+        except Exception as e:
+            log.warning("Libro de cuota ilegible (%s): %s", self.path, e)
+
+    def _snapshot(self) -> Dict[str, Any]:
+        return {"month": self.month, "calls": {who: dict(per) for who, per in self.calls.items()}}
+
+    def _write(self, data: Dict[str, Any]) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp, self.path)
+
+    async def flush(self) -> None:
+        """Guarda el libro si cambió; la escritura va en un hilo (asyncio.to_thread)."""
+        if not self.path or not self._dirty:
+            return
+        # La copia se toma en el loop; lo que llegue mientras se escribe queda para la próxima
+        data = self._snapshot()
+        self._dirty = False
+        self._saved_at = time.monotonic()
+        try:
+            await asyncio.to_thread(self._write, data)
+        except Exception as e:
+            self._dirty = True
+            log.warning("No se pudo guardar el libro de cuota: %s", e)
+
+    async def close(self) -> None:
+        if self._saving is not None:
+            await asyncio.gather(self._saving, return_exceptions=True)
+        await self.flush()
@@ -0,0 +1,83 @@
+import asyncio
+import random
+import time
+from dataclasses import dataclass
+from datetime import datetime, UTC
+from email.utils import parsedate_to_datetime
+from typing import Dict, FrozenSet, Optional
+
+
+class TokenBucket:
+    """Limitador asíncrono: `rate` permisos por segundo con ráfagas de hasta `burst`."""
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = max(rate, 0.001)
+        self.capacity = max(1, burst)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> float:
+        """Espera un permiso; devuelve cuánto se esperó (s)."""
+        waited = 0.0
+        # El lock mantiene el orden de llegada (FIFO) entre los que esperan
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+                waited += delay
+                await asyncio.sleep(delay)
+
+
+_BUCKETS: Dict[str, TokenBucket] = {}
+
+
+def bucket_for(host: str, rate: float, burst: int) -> TokenBucket:
+    """Un único bucket por host: todos los clientes de ese host lo comparten."""
+    key = host.rstrip("/").lower()
+    bucket = _BUCKETS.get(key)
+    if bucket is None:
+        bucket = _BUCKETS[key] = TokenBucket(rate, burst)
+    return bucket
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Retry-After en segundos o como fecha HTTP."""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+        if when.tzinfo is None:
+            when = when.replace(tzinfo=UTC)
+        return max(0.0, (when - datetime.now(UTC)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    max_attempts: int = 4
+    base_delay_s: float = 0.5
+    max_delay_s: float = 8.0
+    # Techo para un Retry-After del servidor (más que esto ya no vale la pena esperar)
+    max_retry_after_s: float = 30.0
+    retry_statuses: FrozenSet[int] = frozenset({429, 500, 502, 503, 504})
+
+    def should_retry(self, status: int, attempt: int) -> bool:
+        return status in self.retry_statuses and attempt + 1 < self.max_attempts
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Backoff exponencial con jitter completo; Retry-After manda si viene."""
+        if retry_after is not None:
+            return min(retry_after, self.max_retry_after_s) + random.uniform(0, self.base_delay_s / 2)
+        cap = min(self.max_delay_s, self.base_delay_s * (2 ** attempt))
+        return random.uniform(self.base_delay_s / 2, cap)
@@ -0,0 +1,82 @@
+import logging
+import time
+from collections import deque
+from typing import Deque, Optional
+
+log = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+    """
+    Cortocircuito simple por proveedor:
+    - cerrado: se llama normalmente;
+    - abierto: tras `failure_threshold` fallos seguidos se salta durante `cooldown_s`;
+    - semiabierto: vencido el cooldown se permite una llamada de prueba; si
+      falla vuelve a abrirse, si funciona se cierra.
+    """
+    def __init__(self, name: str, failure_threshold: int = 3, cooldown_s: float = 300):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.cooldown_s = cooldown_s
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown_s:
+            return "half-open"
+        return "open"
+
+    def available(self) -> bool:
+        """Como allow() pero sin reservar la llamada de prueba del semiabierto."""
+        state = self.state
+        return state == "closed" or (state == "half-open" and not self._probing)
+
+    def allow(self) -> bool:
+        """Reserva la llamada: pedirlo solo justo antes de hacerla."""
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def release(self) -> None:
+        """La llamada permitida no llegó a resolverse (cancelada): libera la prueba sin juzgar."""
+        self._probing = False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self._probing or self.failures >= self.failure_threshold:
+            if self.opened_at is None or self._probing:
+                log.warning("Circuito %s abierto", self.name, extra={"cooldown_s": self.cooldown_s})
+            self.opened_at = time.monotonic()
+        self._probing = False
+
+
+class LatencyTracker:
+    """Ventana móvil de latencias exitosas para estimar el p95 de un proveedor."""
+    def __init__(self, window: int = 50):
+        self._samples: Deque[float] = deque(maxlen=window)
+
+    def add(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def p95(self) -> Optional[float]:
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]
+
+    def hedge_delay(self, floor_s: float, ceil_s: float, default_s: float) -> float:
+        p95 = self.p95()
+        return min(max(p95 if p95 is not None else default_s, floor_s), ceil_s)
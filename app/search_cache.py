@@ -0,0 +1,174 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from . import metrics
+
+CACHE_LOOKUPS = metrics.counter("search_cache_lookups_total", "Consultas a la cache de búsquedas por resultado")
+
+# (origin, destination, departure, return, currency, adults, max)
+CacheKey = Tuple[str, str, str, str, str, int, int]
+
+
+def search_key(
+    origin: str,
+    destination: str,
+    departure_date: str,
+    return_date: str,
+    currency: str,
+    adults: int,
+    max_results: int,
+) -> CacheKey:
+    return (
+        origin.strip().upper(),
+        destination.strip().upper(),
+        departure_date.strip(),
+        (return_date or "").strip(),
+        currency.strip().upper(),
+        int(adults),
+        int(max_results),
+    )
+
+
+def batch_key(key: CacheKey) -> Tuple:
+    """
+    La misma ruta, pero como tajada de un POST múltiple: sale de un cupo
+    compartido entre rutas y puede venir truncada, así que solo la lee otro
+    POST múltiple (nunca un GET de una sola ruta).
+    """
+    return ("batch",) + key
+
+
+class SearchCache:
+    """
+    Cache TTL + LRU para respuestas de búsqueda de ofertas.
+
+    - Fresca hasta `ttl_s`; luego, durante `stale_s`, se sirve igual y el
+      llamador la revalida en segundo plano (stale-while-revalidate).
+    - Como máximo `max_entries` en memoria (se expulsa la menos usada).
+    - Opcionalmente respaldada en SQLite para sobrevivir reinicios.
+    """
+    def __init__(
+        self,
+        ttl_s: float,
+        max_entries: int = 256,
+        stale_s: float = 0,
+        disk_path: Optional[str] = None,
+        dump: Callable[[Any], Any] = lambda v: v,
+        load: Callable[[Any], Any] = lambda v: v,
+    ):
+        self.ttl_s = ttl_s
+        self.stale_s = stale_s
+        self.max_entries = max(1, max_entries)
+        self.disk_path = disk_path
+        # Conversión valor <-> JSON para el respaldo en disco
+        self._dump = dump
+        self._load = load
+        # key -> (valor, fresca_hasta, servible_hasta) en epoch
+        self._mem: "OrderedDict[Hashable, Tuple[Any, float, float]]" = OrderedDict()
+        self._db: Optional[sqlite3.Connection] = None
+        self._disk_lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # ---- API ----
+    async def get(self, key: Hashable) -> Tuple[Optional[Any], bool]:
+        """Devuelve (valor, fresco). (None, False) si no hay nada servible."""
+        now = time.time()
+        entry = self._mem.get(key)
+        if entry is None and self.disk_path:
+            entry = await asyncio.to_thread(self._disk_get, key)
+            if entry is not None:
+                self._remember(key, entry)
+        if entry is not None:
+            value, fresh_until, usable_until = entry
+            if now < fresh_until:
+                self._mem.move_to_end(key)
+                self.hits += 1
+                CACHE_LOOKUPS.inc(result="hit")
+                return value, True
+            if now < usable_until:
+                self._mem.move_to_end(key)
+                self.stale_hits += 1
+                CACHE_LOOKUPS.inc(result="stale")
+                return value, False
+            self._mem.pop(key, None)
+        self.misses += 1
+        CACHE_LOOKUPS.inc(result="miss")
+        return None, False
+
+    async def put(self, key: Hashable, value: Any) -> None:
+        now = time.time()
+        entry = (value, now + self.ttl_s, now + self.ttl_s + self.stale_s)
+        self._remember(key, entry)
+        if self.disk_path:
+            await asyncio.to_thread(self._disk_put, key, entry)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            "size": len(self._mem),
+            "max": self.max_entries,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": ((self.hits + self.stale_hits) / lookups) if lookups else 0.0,
+        }
+
+    def close(self) -> None:
+        with self._disk_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    # ---- memoria ----
+    def _remember(self, key: Hashable, entry: Tuple[Any, float, float]) -> None:
+        self._mem[key] = entry
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.max_entries:
+            self._mem.popitem(last=False)
+            self.evictions += 1
+
+    # ---- disco (se llama vía to_thread) ----
+    def _conn(self) -> sqlite3.Connection:
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.disk_path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(self.disk_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS search_cache ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL,"
+                " fresh_until REAL NOT NULL, usable_until REAL NOT NULL)"
+            )
+        return self._db
+
+    @staticmethod
+    def _disk_key(key: Hashable) -> str:
+        return json.dumps(key, separators=(",", ":"))
+
+    def _disk_get(self, key: Hashable) -> Optional[Tuple[Any, float, float]]:
+        with self._disk_lock:
+            row = self._conn().execute(
+                "SELECT value, fresh_until, usable_until FROM search_cache WHERE key = ? AND usable_until > ?",
+                (self._disk_key(key), time.time()),
+            ).fetchone()
+        if row is None:
+            return None
+        return self._load(json.loads(row[0])), row[1], row[2]
+
+    def _disk_put(self, key: Hashable, entry: Tuple[Any, float, float]) -> None:
+        with self._disk_lock, self._conn() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO search_cache (key, value, fresh_until, usable_until) VALUES (?, ?, ?, ?)",
+                (self._disk_key(key), json.dumps(self._dump(entry[0]), separators=(",", ":")), entry[1], entry[2]),
+            )
+            db.execute("DELETE FROM search_cache WHERE usable_until <= ?", (time.time(),))
+
@@ -0,0 +1,125 @@
+import asyncio
+import contextvars
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple, TypeVar
+
+from . import metrics
+
+T = TypeVar("T")
+
+COALESCED = metrics.counter("singleflight_calls_total", "Operaciones deduplicadas por tipo y resultado (leader/joined/reused)")
+
+
+class _Call:
+    __slots__ = ("task", "waiters", "unclaimed")
+
+    def __init__(self, task: asyncio.Task, unclaimed: bool = False):
+        self.task = task
+        self.waiters = 0
+        # Lanzada con start(): el primero que la espere cuenta como líder
+        self.unclaimed = unclaimed
+
+
+class SingleFlight:
+    """
+    Deduplica operaciones idénticas: mientras una clave está en curso, los
+    siguientes llamadores esperan el resultado del primero en vez de repetirla.
+    Con `reuse_s` > 0, un resultado exitoso se sigue entregando durante ese
+    lapso después de terminar (los errores nunca se reutilizan).
+    La operación compartida solo se cancela si se van todos los que la esperan.
+    Por defecto corre con el contexto (contextvars) de quien la lanzó; con
+    `context` corre en ese, para que el plazo u origen del primero que llegó
+    no se le impongan a los demás.
+    """
+    def __init__(self, kind: str, reuse_s: float = 0.0, enabled: bool = True):
+        self.kind = kind
+        self.reuse_s = reuse_s
+        self.enabled = enabled
+        self._inflight: Dict[Hashable, _Call] = {}
+        self._done: Dict[Hashable, Tuple[float, Any]] = {}
+
+    async def do(
+        self,
+        key: Hashable,
+        fn: Callable[[], Awaitable[T]],
+        context: Optional[contextvars.Context] = None,
+    ) -> Tuple[T, bool]:
+        """Devuelve (resultado, compartido); compartido=True si no lo produjo esta llamada."""
+        if not self.enabled:
+            if context is not None:
+                return await asyncio.get_running_loop().create_task(fn(), context=context), False
+            return await fn(), False
+
+        hit = self._done.get(key)
+        if hit is not None:
+            if time.monotonic() - hit[0] <= self.reuse_s:
+                COALESCED.inc(kind=self.kind, result="reused")
+                return hit[1], True
+            del self._done[key]
+
+        call = self._inflight.get(key)
+        shared = call is not None
+        if call is None:
+            call = self._launch(key, fn, context=context)
+        COALESCED.inc(kind=self.kind, result="joined" if shared and not call.unclaimed else "leader")
+        call.unclaimed = False
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task), shared
+        except asyncio.CancelledError:
+            if call.waiters == 1 and not call.task.done():
+                call.task.cancel()
+            raise
+        finally:
+            call.waiters -= 1
+
+    def start(
+        self,
+        key: Hashable,
+        fn: Callable[[], Awaitable[Any]],
+        context: Optional[contextvars.Context] = None,
+    ) -> bool:
+        """
+        Lanza la operación ya, sin esperarla, si no hay otra con esa clave en
+        curso; quien la pida después con do() (incluido quien la lanzó) se suma.
+        Sirve para registrar varias claves de una vez, sin ceder el loop entre
+        medio. True si la lanzó esta llamada.
+        """
+        if not self.enabled or key in self._inflight:
+            return False
+        self._launch(key, fn, unclaimed=True, context=context)
+        return True
+
+    def _launch(
+        self,
+        key: Hashable,
+        fn: Callable[[], Awaitable[Any]],
+        unclaimed: bool = False,
+        context: Optional[contextvars.Context] = None,
+    ) -> _Call:
+        task = asyncio.get_running_loop().create_task(fn(), context=context)
+        call = self._inflight[key] = _Call(task, unclaimed)
+        call.task.add_done_callback(lambda t, key=key: self._finished(key, t))
+        return call
+
+    def _finished(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is not None and self._inflight[key].task is task:
+            del self._inflight[key]
+        if task.cancelled() or task.exception() is not None or self.reuse_s <= 0:
+            return
+        now = time.monotonic()
+        # Las entradas vencidas se limpian al guardar una nueva (son pocas)
+        for k in [k for k, (at, _) in self._done.items() if now - at > self.reuse_s]:
+            del self._done[k]
+        self._done[key] = (now, task.result())
+
+    def __contains__(self, key: Hashable) -> bool:
+        """Quien pida esa clave ahora se suma a una en curso (o reutiliza una recién terminada)."""
+        if not self.enabled:
+            return False
+        hit = self._done.get(key)
+        return key in self._inflight or (hit is not None and time.monotonic() - hit[0] <= self.reuse_s)
+
+    def in_flight(self) -> int:
+        return len(self._inflight)
@@ -0,0 +1,83 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from . import metrics
+
+log = logging.getLogger(__name__)
+
+PHASE_SECONDS = metrics.histogram("startup_phase_seconds", "Duración de cada fase del arranque")
+
+
+class StartupTimer:
+    """Mide y loguea cada fase del arranque (config, servicios, setup_hook, gateway)."""
+    def __init__(self):
+        self.started = time.monotonic()
+        self.phases: List[Tuple[str, float]] = []
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record(name, time.monotonic() - start)
+
+    def record(self, name: str, took: float) -> None:
+        self.phases.append((name, took))
+        PHASE_SECONDS.observe(took, phase=name)
+        log.info("Arranque: fase %s", name, extra={"phase": name, "latency_ms": round(took * 1000)})
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+
+def tree_digest(tree, guild=None) -> str:
+    """Hash del payload que se le mandaría a Discord en un sync (mismo to_dict que usa tree.sync)."""
+    payload = [cmd.to_dict(tree) for cmd in tree.get_commands(guild=guild)]
+    blob = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class CommandSyncState:
+    """
+    Último hash sincronizado por alcance ("<app>:global" o "<app>:guild:<id>"),
+    persistido en DATA_DIR. Si el árbol no cambió desde el último sync exitoso,
+    el reinicio o redeploy no vuelve a gastar llamadas (con rate limit) a Discord.
+    """
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self._synced: Dict[str, str] = {}
+        self._load()
+
+    def changed(self, scope: str, digest: str) -> bool:
+        return self._synced.get(scope) != digest
+
+    def mark(self, scope: str, digest: str) -> None:
+        self._synced[scope] = digest
+        self._save()
+
+    def _load(self) -> None:
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self._synced = dict(json.load(f))
+        except Exception as e:
+            log.warning("Estado de sync de comandos ilegible (%s): %s", self.path, e)
+
+    def _save(self) -> None:
+        if not self.path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp = f"{self.path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self._synced, f)
+            os.replace(tmp, self.path)
+        except Exception as e:
+            log.warning("No se pudo guardar el estado de sync de comandos: %s", e)
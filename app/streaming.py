@@ -0,0 +1,80 @@
+import asyncio
+import logging
+import time
+from typing import Any, Optional
+
+from . import metrics
+
+log = logging.getLogger(__name__)
+
+EDIT_SECONDS = metrics.histogram("discord_edit_seconds", "Duración de message.edit en respuestas progresivas")
+
+
+class ProgressiveMessage:
+    """
+    Mensaje de Discord que se publica de inmediato (placeholder) y se va
+    editando a medida que llegan resultados. Las ediciones se agrupan: como
+    mucho una cada `min_interval_s` y siempre con el contenido más reciente,
+    así que una ráfaga de piernas terminadas cuesta una sola edición.
+    """
+    def __init__(self, channel, min_interval_s: float = 1.0):
+        self.channel = channel
+        self.min_interval_s = min_interval_s
+        self.message: Optional[Any] = None
+        self.edits = 0
+        self._shown: Optional[str] = None
+        self._latest: Optional[str] = None
+        self._last_edit = 0.0
+        self._flusher: Optional[asyncio.Task] = None
+
+    async def start(self, content: str) -> None:
+        self.message = await self.channel.send(content)
+        self._shown = content
+        self._last_edit = time.monotonic()
+
+    def update(self, content: str) -> None:
+        """No bloquea: deja `content` como próxima edición (pensado para callbacks)."""
+        if self.message is None or content == self._shown:
+            return
+        self._latest = content
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush())
+
+    async def _wait_slot(self) -> None:
+        wait = self._last_edit + self.min_interval_s - time.monotonic()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    async def _flush(self) -> None:
+        while self._latest is not None:
+            await self._wait_slot()
+            content, self._latest = self._latest, None
+            if content != self._shown:
+                await self._edit(content)
+
+    async def _edit(self, content: str) -> bool:
+        try:
+            with metrics.span(EDIT_SECONDS):
+                await self.message.edit(content=content)
+        except Exception as e:
+            log.warning("No se pudo editar el mensaje en curso: %s", e)
+            return False
+        self._shown = content
+        self._last_edit = time.monotonic()
+        self.edits += 1
+        return True
+
+    async def finish(self, content: str) -> None:
+        """Render final consolidado; si el placeholder no se pudo editar, se envía aparte."""
+        if self._flusher is not None and not self._flusher.done():
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+        self._latest = None
+        if self.message is None:
+            self.message = await self.channel.send(content)
+            return
+        if content == self._shown:
+            return
+        # Sin esperar el intervalo: es la última edición y discord.py respeta los 429
+        if not await self._edit(content):
+            await self.channel.send(content)
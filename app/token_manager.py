@@ -0,0 +1,154 @@
+import asyncio
+import contextvars
+import json
+import logging
+import os
+from datetime import datetime, timedelta, UTC
+from typing import Awaitable, Callable, Optional
+
+from . import metrics
+from .http_session import HttpResponse
+
+log = logging.getLogger(__name__)
+
+TOKEN_SECONDS = metrics.histogram("amadeus_token_refresh_seconds", "Duración de la obtención del token OAuth")
+
+# Margen de seguridad sobre el expires_in que informa Amadeus
+_EXPIRY_SKEW_S = 60
+
+
+class TokenManager:
+    """
+    Token OAuth de Amadeus (client_credentials):
+    - una sola renovación en vuelo aunque haya muchas búsquedas concurrentes,
+    - renovación en segundo plano antes de vencer (nadie paga el round-trip),
+    - persistencia en disco para que un reinicio no tenga que pedir uno nuevo.
+    """
+    def __init__(
+        self,
+        send: Callable[..., Awaitable[HttpResponse]],
+        host: str,
+        client_id: Optional[str],
+        client_secret: Optional[str],
+        cache_path: Optional[str] = None,
+        refresh_margin_s: int = 300,
+    ):
+        # send(method, url, **kwargs): el cliente lo pasa con su limitador y reintentos
+        self.send = send
+        self.host = host.rstrip("/")
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.cache_path = cache_path
+        self.refresh_margin = timedelta(seconds=refresh_margin_s)
+        self.token: Optional[str] = None
+        self.expires_at: Optional[datetime] = None
+        self.issued_at: Optional[datetime] = None
+        self._lock = asyncio.Lock()
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._load()
+
+    def _valid(self) -> bool:
+        return bool(self.token and self.expires_at and datetime.now(UTC) < self.expires_at)
+
+    async def get(self) -> str:
+        if not self._valid():
+            async with self._lock:
+                # Otro llamador pudo haberlo renovado mientras esperábamos
+                if not self._valid():
+                    await self._fetch()
+        elif self._refresh_task is None:
+            # Token cargado desde disco: programa su renovación
+            self._schedule_refresh()
+        return self.token
+
+    async def invalidate(self, stale_token: Optional[str]) -> str:
+        """Para un 401: descarta el token rechazado y devuelve uno nuevo (una sola vez)."""
+        async with self._lock:
+            if self.token == stale_token or not self._valid():
+                self.token = None
+                await self._fetch()
+        return self.token
+
+    async def _fetch(self) -> None:
+        url = f"{self.host}/v1/security/oauth2/token"
+        headers = {"Content-Type": "application/x-www-form-urlencoded"}
+        data = {
+            "grant_type": "client_credentials",
+            "client_id": self.client_id or "",
+            "client_secret": self.client_secret or "",
+        }
+        with metrics.span(TOKEN_SECONDS):
+            r = await self.send("POST", url, data=data, headers=headers)
+        if r.status != 200:
+            log.error("Token: la API lo rechazó: %s", r.text()[:300], extra={"status": r.status})
+            raise RuntimeError(f"Amadeus token {r.status}")
+        js = r.json()
+        now = datetime.now(UTC)
+        self.token = js["access_token"]
+        self.issued_at = now
+        self.expires_at = now + timedelta(seconds=int(js.get("expires_in", 1800)) - _EXPIRY_SKEW_S)
+        self._schedule_refresh()
+        await asyncio.to_thread(self._save)
+
+    def _schedule_refresh(self) -> None:
+        if self._refresh_task is not None and not self._refresh_task.done():
+            if self._refresh_task is not asyncio.current_task():
+                self._refresh_task.cancel()
+        # Contexto propio: dispara ~25 min después y no debe heredar el plazo
+        # (ya vencido) de la búsqueda que pidió el token
+        self._refresh_task = asyncio.get_running_loop().create_task(
+            self._refresh_later(), context=contextvars.Context()
+        )
+
+    async def _refresh_later(self) -> None:
+        delay = (self.expires_at - self.refresh_margin - datetime.now(UTC)).total_seconds()
+        await asyncio.sleep(max(0.0, delay))
+        try:
+            async with self._lock:
+                await self._fetch()
+        except Exception as e:
+            # La próxima búsqueda lo reintentará en línea
+            log.warning("Token: falló la renovación en segundo plano: %s", e)
+
+    def _cache_key(self) -> str:
+        return f"{self.host}|{self.client_id}"
+
+    def _load(self) -> None:
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                js = json.load(f)
+            if js.get("key") != self._cache_key():
+                return
+            self.token = js["access_token"]
+            self.expires_at = datetime.fromisoformat(js["expires_at"])
+            self.issued_at = datetime.fromisoformat(js["issued_at"])
+        except Exception as e:
+            log.warning("Token: cache ilegible (%s): %s", self.cache_path, e)
+
+    def _save(self) -> None:
+        if not self.cache_path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.cache_path) or ".", exist_ok=True)
+            tmp = f"{self.cache_path}.tmp"
+            fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(
+                    {
+                        "key": self._cache_key(),
+                        "access_token": self.token,
+                        "expires_at": self.expires_at.isoformat(),
+                        "issued_at": self.issued_at.isoformat(),
+                    },
+                    f,
+                )
+            os.replace(tmp, self.cache_path)
+        except Exception as e:
+            log.warning("Token: no se pudo guardar: %s", e)
+
+    async def close(self) -> None:
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            self._refresh_task = None
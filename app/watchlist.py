@@ -0,0 +1,168 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Tuple
+
+# (origen, destino, salida, regreso) — mismo formato que flights_service.Leg
+Leg = Tuple[str, str, str, str]
+# Lo que define una búsqueda compartible: (origen, destino, salida, flex, noches)
+WatchSpec = Tuple[str, str, str, int, int]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS watches (
+    id          INTEGER PRIMARY KEY,
+    user_id     INTEGER NOT NULL,
+    origin      TEXT NOT NULL,
+    destination TEXT NOT NULL,
+    departure   TEXT NOT NULL,
+    flex_days   INTEGER NOT NULL,
+    nights      INTEGER NOT NULL,
+    max_price   REAL,
+    created_at  REAL NOT NULL,
+    UNIQUE (user_id, origin, destination, departure, flex_days, nights)
+);
+CREATE INDEX IF NOT EXISTS ix_watches_user ON watches (user_id);
+CREATE INDEX IF NOT EXISTS ix_watches_departure ON watches (departure);
+"""
+
+
+@dataclass(frozen=True)
+class Watch:
+    """Ruta seguida por un usuario: salidas entre `departure` y `departure + flex_days`."""
+    id: int
+    user_id: int
+    origin: str
+    destination: str
+    departure: str
+    flex_days: int
+    nights: int
+    max_price: Optional[float] = None
+
+    @property
+    def spec(self) -> WatchSpec:
+        return (self.origin, self.destination, self.departure, self.flex_days, self.nights)
+
+    def legs(self, today: date) -> List[Leg]:
+        """Una pierna por fecha de salida de la ventana que todavía no pasó."""
+        start = date.fromisoformat(self.departure)
+        out: List[Leg] = []
+        for i in range(self.flex_days + 1):
+            dep = start + timedelta(days=i)
+            if dep <= today:
+                continue
+            ret = dep + timedelta(days=self.nights)
+            out.append((self.origin, self.destination, dep.isoformat(), ret.isoformat()))
+        return out
+
+
+def plan(watches: List[Watch], today: date) -> Tuple[List[Leg], Dict[WatchSpec, List[Watch]]]:
+    """
+    Colapsa las watches de todos los usuarios en el mínimo de consultas:
+    - watches idénticas (misma spec) se agrupan y se resuelven una sola vez;
+    - ventanas que se solapan comparten las piernas en común.
+    Devuelve (piernas únicas a buscar, spec -> suscriptores).
+    """
+    groups: Dict[WatchSpec, List[Watch]] = {}
+    for w in watches:
+        groups.setdefault(w.spec, []).append(w)
+    legs: Dict[Leg, None] = {}
+    for subs in groups.values():
+        for leg in subs[0].legs(today):
+            legs.setdefault(leg)
+    return list(legs), groups
+
+
+class WatchStore:
+    """Watches persistidas en SQLite (misma disciplina que PriceHistory: un lock y to_thread)."""
+    def __init__(self, path: str, max_per_user: int = 10):
+        self.path = path
+        self.max_per_user = max_per_user
+        self._db: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _conn(self) -> sqlite3.Connection:
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            db = sqlite3.connect(self.path, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(_SCHEMA)
+            self._db = db
+        return self._db
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    @staticmethod
+    def _row(r: tuple) -> Watch:
+        return Watch(*r)
+
+    _COLS = "id, user_id, origin, destination, departure, flex_days, nights, max_price"
+
+    # ---- API async ----
+    async def add(
+        self,
+        user_id: int,
+        origin: str,
+        destination: str,
+        departure: str,
+        flex_days: int,
+        nights: int,
+        max_price: Optional[float] = None,
+    ) -> Tuple[Optional[Watch], str]:
+        """Devuelve (watch, "") o (None, motivo) si se superó el límite o ya existía."""
+        return await asyncio.to_thread(
+            self._add, user_id, origin.upper(), destination.upper(), departure, flex_days, nights, max_price
+        )
+
+    async def list(self, user_id: int) -> List[Watch]:
+        return await asyncio.to_thread(self._select, "WHERE user_id = ? ORDER BY departure, id", (user_id,))
+
+    async def remove(self, user_id: int, watch_id: int) -> bool:
+        return await asyncio.to_thread(self._remove, user_id, watch_id)
+
+    async def active(self, today: date) -> List[Watch]:
+        """Watches con al menos una salida futura; las vencidas se borran de paso."""
+        return await asyncio.to_thread(self._active, today)
+
+    # ---- SQLite (se usa desde to_thread) ----
+    def _add(self, user_id, origin, destination, departure, flex_days, nights, max_price):
+        with self._lock, self._conn() as db:
+            (count,) = db.execute("SELECT COUNT(*) FROM watches WHERE user_id = ?", (user_id,)).fetchone()
+            if count >= self.max_per_user:
+                return None, f"ya tienes {count} watches (máximo {self.max_per_user})"
+            try:
+                cur = db.execute(
+                    "INSERT INTO watches (user_id, origin, destination, departure, flex_days, nights,"
+                    " max_price, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (user_id, origin, destination, departure, flex_days, nights, max_price, time.time()),
+                )
+            except sqlite3.IntegrityError:
+                return None, "ya sigues esa misma ruta y fechas"
+            return Watch(cur.lastrowid, user_id, origin, destination, departure, flex_days, nights, max_price), ""
+
+    def _select(self, where: str, params: tuple) -> List[Watch]:
+        with self._lock:
+            rows = self._conn().execute(f"SELECT {self._COLS} FROM watches {where}", params).fetchall()
+        return [self._row(r) for r in rows]
+
+    def _remove(self, user_id: int, watch_id: int) -> bool:
+        with self._lock, self._conn() as db:
+            cur = db.execute("DELETE FROM watches WHERE id = ? AND user_id = ?", (watch_id, user_id))
+            return cur.rowcount > 0
+
+    def _active(self, today: date) -> List[Watch]:
+        with self._lock, self._conn() as db:
+            # Vencida = la última salida de la ventana ya pasó
+            db.execute(
+                "DELETE FROM watches WHERE date(departure, '+' || flex_days || ' days') <= ?",
+                (today.isoformat(),),
+            )
+            rows = db.execute(f"SELECT {self._COLS} FROM watches ORDER BY id").fetchall()
+        return [self._row(r) for r in rows]
@@ -0,0 +1,229 @@
+"""
+Servidor local que imita a Amadeus (token + flight-offers GET y POST) y a
+los proveedores FX, para medir el bot sin cuota ni red.
+
+    python -m bench.fake_server --port 8765 --latency-ms 200 --offers 50
+"""
+import argparse
+import asyncio
+import json
+import random
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Tuple
+
+from aiohttp import web
+
+CARRIERS = ("LA", "AA", "DL", "QR", "EK", "AF", "KL", "NH", "JL")
+
+
+@dataclass
+class FakeConfig:
+    latency_ms: float = 200          # latencia media de flight-offers
+    jitter_ms: float = 50            # ± uniforme sobre la latencia
+    token_latency_ms: float = 50
+    fx_latency_ms: float = 30
+    offers: int = 50                 # ofertas por respuesta (tamaño del payload)
+    segments: int = 2                # tramos por itinerario
+    error_rate: float = 0.0          # fracción de respuestas 500
+    rate_429: float = 0.0            # fracción de respuestas 429
+    retry_after_s: float = 0.0
+    seed: int = 1234
+
+
+@dataclass
+class FakeStats:
+    counts: Dict[str, int] = field(default_factory=dict)
+
+    def hit(self, name: str) -> None:
+        self.counts[name] = self.counts.get(name, 0) + 1
+
+    def reset(self) -> None:
+        self.counts.clear()
+
+
+def _offer(
+    rnd: random.Random,
+    origin: str,
+    destination: str,
+    price: float,
+    segments: int,
+    back_from: Optional[str] = None,
+    one_way: bool = False,
+) -> Dict:
+    """Ida y vuelta; con `back_from` la vuelta sale de otro aeropuerto (combinación abierta)."""
+    def itinerary(a: str, b: str) -> Dict:
+        hops = [a] + [rnd.choice(("GRU", "DFW", "DOH", "DXB", "CDG", "AMS")) for _ in range(segments - 1)] + [b]
+        carrier = rnd.choice(CARRIERS)
+        return {
+            "duration": f"PT{rnd.randint(26, 40)}H{rnd.randint(0, 59)}M",
+            "segments": [
+                {
+                    "departure": {"iataCode": hops[i], "at": "2025-01-01T10:00:00"},
+                    "arrival": {"iataCode": hops[i + 1], "at": "2025-01-01T20:00:00"},
+                    "carrierCode": carrier,
+                    "number": str(rnd.randint(100, 9999)),
+                    "aircraft": {"code": "789"},
+                    "duration": "PT10H",
+                }
+                for i in range(len(hops) - 1)
+            ],
+        }
+
+    return {
+        "type": "flight-offer",
+        "id": str(rnd.randint(1, 10**6)),
+        "source": "GDS",
+        "itineraries": [itinerary(origin, destination)]
+        + ([] if one_way else [itinerary(back_from or destination, origin)]),
+        "price": {"currency": "USD", "total": f"{price:.2f}", "base": f"{price * 0.8:.2f}",
+                  "grandTotal": f"{price:.2f}", "fees": [{"amount": "0.00", "type": "SUPPLIER"}]},
+        "validatingAirlineCodes": [rnd.choice(CARRIERS)],
+        "travelerPricings": [{"travelerId": "1", "fareOption": "STANDARD", "travelerType": "ADULT",
+                              "price": {"currency": "USD", "total": f"{price:.2f}"},
+                              "fareDetailsBySegment": [{"segmentId": str(i), "cabin": "ECONOMY",
+                                                        "fareBasis": "QLOWCL", "class": "Q"}
+                                                       for i in range(segments * 2)]}],
+    }
+
+
+def build_app(cfg: FakeConfig, stats: FakeStats) -> web.Application:
+    rnd = random.Random(cfg.seed)
+    # El cuerpo se genera una vez por consulta: el costo del servidor no debe
+    # contaminar lo que se mide del lado del bot.
+    bodies: Dict[Tuple, bytes] = {}
+
+    async def sleep_ms(ms: float) -> None:
+        if ms > 0:
+            await asyncio.sleep(max(0.0, ms + rnd.uniform(-cfg.jitter_ms, cfg.jitter_ms)) / 1000)
+
+    def injected_failure() -> Optional[web.Response]:
+        roll = rnd.random()
+        if roll < cfg.rate_429:
+            stats.hit("429")
+            return web.json_response({"errors": [{"status": 429, "code": 38194}]}, status=429,
+                                     headers={"Retry-After": str(cfg.retry_after_s)})
+        if roll < cfg.rate_429 + cfg.error_rate:
+            stats.hit("5xx")
+            return web.json_response({"errors": [{"status": 500, "code": 141}]}, status=500)
+        return None
+
+    async def token(request: web.Request) -> web.Response:
+        stats.hit("token")
+        await sleep_ms(cfg.token_latency_ms)
+        return web.json_response({"access_token": f"fake-{stats.counts['token']}", "expires_in": 1799,
+                                  "token_type": "Bearer"})
+
+    async def flight_offers(request: web.Request) -> web.Response:
+        stats.hit("search")
+        failure = injected_failure()
+        if failure is not None:
+            return failure
+        await sleep_ms(cfg.latency_ms)
+        q = request.query
+        origin, destination = q.get("originLocationCode", "SCL"), q.get("destinationLocationCode", "NRT")
+        n = min(cfg.offers, int(q.get("max", cfg.offers)))
+        key = (origin, destination, q.get("departureDate"), q.get("returnDate"), n)
+        body = bodies.get(key)
+        if body is None:
+            r = random.Random(f"{cfg.seed}|{key}")
+            one_way = not q.get("returnDate")
+            # Solo ida cuesta aprox. la mitad
+            scale = 0.5 if one_way else 1.0
+            base = 700 + r.randint(0, 600)
+            data = [_offer(r, origin, destination, (base + r.uniform(0, 900)) * scale, cfg.segments, one_way=one_way)
+                    for _ in range(n)]
+            body = bodies[key] = json.dumps({"meta": {"count": n}, "data": data}).encode()
+        return web.Response(body=body, content_type="application/json")
+
+    async def flight_offers_post(request: web.Request) -> web.Response:
+        """Búsqueda multi-ruta: productos origen × destino con códigos alternativos."""
+        stats.hit("search")
+        failure = injected_failure()
+        if failure is not None:
+            return failure
+        await sleep_ms(cfg.latency_ms)
+        js = await request.json()
+        out, back = js["originDestinations"][:2]
+        origins = [out["originLocationCode"]] + out.get("alternativeOriginsCodes", [])
+        dests = [out["destinationLocationCode"]] + out.get("alternativeDestinationsCodes", [])
+        n = min(cfg.offers * len(origins) * len(dests), int(js.get("searchCriteria", {}).get("maxFlightOffers", 250)))
+        key = ("POST", tuple(origins), tuple(dests), out["departureDateTimeRange"]["date"],
+               back["departureDateTimeRange"]["date"], n)
+        body = bodies.get(key)
+        if body is None:
+            r = random.Random(f"{cfg.seed}|{key}")
+            data = []
+            for i in range(n):
+                o, d = r.choice(origins), r.choice(dests)
+                # Como Amadeus, alguna combinación abierta cuando hay alternativas
+                back_from = r.choice(dests) if len(dests) > 1 and i % 10 == 9 else None
+                data.append(_offer(r, o, d, 700 + r.uniform(0, 1500), cfg.segments, back_from))
+            body = bodies[key] = json.dumps({"meta": {"count": n}, "data": data}).encode()
+        return web.Response(body=body, content_type="application/json")
+
+    async def fx(request: web.Request) -> web.Response:
+        stats.hit("fx")
+        await sleep_ms(cfg.fx_latency_ms)
+        return web.json_response({"base": "USD", "rates": {"USD": 1, "CLP": 950.0, "JPY": 150.0, "EUR": 0.92}})
+
+    app = web.Application()
+    app.router.add_post("/v1/security/oauth2/token", token)
+    app.router.add_get("/v2/shopping/flight-offers", flight_offers)
+    app.router.add_post("/v2/shopping/flight-offers", flight_offers_post)
+    app.router.add_get("/fx/dinero/latest.json", fx)
+    app.router.add_get("/fx/exchangerate/latest", fx)
+    return app
+
+
+async def start(cfg: FakeConfig, stats: FakeStats, host: str = "127.0.0.1", port: int = 0):
+    """Levanta el servidor; devuelve (runner, url_base). port=0 elige uno libre."""
+    runner = web.AppRunner(build_app(cfg, stats), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    bound = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://{host}:{bound}"
+
+
+class ServerThread:
+    """Servidor falso en su propio hilo y loop, aparte del loop que se mide."""
+    def __init__(self, cfg: FakeConfig, stats: FakeStats, host: str = "127.0.0.1", port: int = 0):
+        self.cfg = cfg
+        self.stats = stats
+        self.host = host
+        self.port = port
+        self.url = ""
+        self._loop = asyncio.new_event_loop()
+        self._runner: Optional[web.AppRunner] = None
+        self._thread = threading.Thread(target=self._loop.run_forever, name="fake-server", daemon=True)
+
+    def start(self) -> str:
+        self._thread.start()
+        fut = asyncio.run_coroutine_threadsafe(start(self.cfg, self.stats, self.host, self.port), self._loop)
+        self._runner, self.url = fut.result(timeout=10)
+        return self.url
+
+    def stop(self) -> None:
+        if self._runner is not None:
+            asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result(timeout=10)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=10)
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8765)
+    p.add_argument("--latency-ms", type=float, default=FakeConfig.latency_ms)
+    p.add_argument("--offers", type=int, default=FakeConfig.offers)
+    p.add_argument("--error-rate", type=float, default=FakeConfig.error_rate)
+    p.add_argument("--rate-429", type=float, default=FakeConfig.rate_429)
+    args = p.parse_args()
+    cfg = FakeConfig(latency_ms=args.latency_ms, offers=args.offers,
+                     error_rate=args.error_rate, rate_429=args.rate_429)
+    web.run_app(build_app(cfg, FakeStats()), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
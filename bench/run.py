@@ -0,0 +1,266 @@
+"""
+Benchmark offline: levanta el servidor falso (bench/fake_server.py), arma los
+servicios reales con build_services() apuntando a él y mide de punta a punta.
+
+    python -m bench.run --scenario publish --iterations 20 --latency-ms 200
+    python -m bench.run --scenario calendar --offers 250 --out bench.json
+    python -m bench.run --cassette .data/cassette.amc --cassette-latency zero
+
+Imprime un JSON con p50/p95/p99, requests por corrida, asignaciones y pico de
+memoria, para comparar cambios en el fan-out, la cache y el parseo.
+Con --cassette no se levanta el servidor falso: se reproducen respuestas
+reales grabadas con CASSETTE_MODE=record (mismos hosts y fechas del .env).
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from .fake_server import FakeConfig, FakeStats, ServerThread
+
+SCENARIOS = ("publish", "city", "calendar")
+
+
+class FakeMessage:
+    def __init__(self, channel: "FakeChannel", index: int):
+        self.channel = channel
+        self.index = index
+
+    async def edit(self, content: str) -> None:
+        self.channel.sent[self.index] = content
+        self.channel.edits += 1
+
+
+class FakeChannel:
+    def __init__(self):
+        self.sent: List[str] = []
+        self.edits = 0
+
+    async def send(self, content: str) -> FakeMessage:
+        self.sent.append(content)
+        return FakeMessage(self, len(self.sent) - 1)
+
+
+class FakeBot:
+    """Lo único que publish_daily le pide al bot: get_channel()."""
+    def __init__(self):
+        self.channel = FakeChannel()
+
+    def get_channel(self, _channel_id: int) -> FakeChannel:
+        return self.channel
+
+
+def _configure_env(args: argparse.Namespace, base_url: Optional[str], data_dir: str) -> None:
+    if base_url:
+        os.environ.update({
+            "AMADEUS_HOST": base_url,
+            "FX_DINERO_URL": f"{base_url}/fx/dinero/latest.json",
+            "FX_EXCHANGERATE_URL": f"{base_url}/fx/exchangerate/latest",
+        })
+    else:
+        os.environ.update({
+            "CASSETTE_MODE": "replay",
+            "CASSETTE_PATH": os.path.abspath(args.cassette),
+            "CASSETTE_LATENCY": args.cassette_latency,
+        })
+    os.environ.setdefault("AMADEUS_CLIENT_ID", "bench")
+    os.environ.setdefault("AMADEUS_CLIENT_SECRET", "bench")
+    os.environ.update({
+        "FX_USDCLP": "",
+        "DATA_DIR": data_dir,
+        "SEARCH_CACHE_TTL_SECONDS": str(args.cache_ttl),
+        "HISTORY_ENABLED": "true" if args.history else "false",
+        "CALENDAR_DAYS": str(args.calendar_days),
+    })
+    if args.max_results is not None:
+        os.environ["MAX_RESULTS"] = str(args.max_results)
+    if args.tps is not None:
+        os.environ["AMADEUS_TPS"] = str(args.tps)
+    if args.concurrency is not None:
+        os.environ["SEARCH_CONCURRENCY"] = str(args.concurrency)
+    if not args.stream:
+        os.environ["STREAM_RESULTS"] = "false"
+    os.environ["AMADEUS_BATCH_SEARCH"] = "true" if args.batch else "false"
+    # Por defecto cada iteración hace todo el trabajo (sin reutilizar la anterior)
+    os.environ["COALESCE"] = args.coalesce
+
+
+def _scenario(name: str, svc, bot: FakeBot) -> Callable[[], Awaitable[Any]]:
+    cfg = svc.cfg
+    if name == "publish":
+        return lambda: svc.publish_daily(bot)
+
+    async def command() -> None:
+        # Igual que los slash commands: se arma el mensaje y se envía
+        if name == "city":
+            msg = await svc._fetch_city_codes(cfg.tokyo_codes, "bench")
+        else:
+            msg = await svc.fetch_price_calendar(cfg.tokyo_codes, "bench")
+        await bot.channel.send(msg)
+
+    return command
+
+
+def _summary(values: List[float]) -> Dict[str, float]:
+    from app.history import percentile
+
+    return {
+        "p50": round(percentile(values, 50), 2),
+        "p95": round(percentile(values, 95), 2),
+        "p99": round(percentile(values, 99), 2),
+        "mean": round(statistics.fmean(values), 2),
+        "min": round(min(values), 2),
+        "max": round(max(values), 2),
+    }
+
+
+async def _run(args: argparse.Namespace, stats: Optional[FakeStats]) -> Dict[str, Any]:
+    from app.config import Settings
+    from app.main import build_services
+
+    svc, http = build_services(Settings())
+    # Requests vistos por el servidor falso, o servidos desde el cassette
+    counter: Dict[str, int] = stats.counts if stats is not None else http.stats
+    bot = FakeBot()
+    call = _scenario(args.scenario, svc, bot)
+    try:
+        for _ in range(args.warmup):
+            await call()
+
+        latencies: List[float] = []
+        requests: List[Dict[str, int]] = []
+        peaks: List[float] = []
+        allocs: List[float] = []
+        for _ in range(args.iterations):
+            seen = dict(counter)
+            bot.channel.sent.clear()
+            bot.channel.edits = 0
+            if args.tracemalloc:
+                tracemalloc.reset_peak()
+                before, _ = tracemalloc.get_traced_memory()
+            t0 = time.perf_counter()
+            await call()
+            latencies.append((time.perf_counter() - t0) * 1000)
+            if args.tracemalloc:
+                current, peak = tracemalloc.get_traced_memory()
+                peaks.append((peak - before) / 1024)
+                allocs.append((current - before) / 1024)
+            requests.append({k: v - seen.get(k, 0) for k, v in counter.items()})
+    finally:
+        await svc.close()
+        await http.close()
+
+    keys = sorted({k for r in requests for k in r})
+    result: Dict[str, Any] = {
+        "latency_ms": _summary(latencies),
+        "requests_per_run": {k: round(statistics.fmean(r.get(k, 0) for r in requests), 2) for k in keys},
+        "messages_per_run": len(bot.channel.sent),
+        "message_chars": sum(len(m) for m in bot.channel.sent),
+        "message_edits": bot.channel.edits,
+    }
+    if args.tracemalloc:
+        result["memory_kib"] = {
+            "peak": _summary(peaks),
+            "retained": _summary(allocs),
+        }
+    return result
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--scenario", choices=SCENARIOS, default="publish")
+    p.add_argument("--iterations", type=int, default=20)
+    p.add_argument("--warmup", type=int, default=1)
+    # Servidor falso
+    p.add_argument("--latency-ms", type=float, default=FakeConfig.latency_ms)
+    p.add_argument("--jitter-ms", type=float, default=FakeConfig.jitter_ms)
+    p.add_argument("--offers", type=int, default=FakeConfig.offers,
+                   help="ofertas por respuesta (acotado por el `max` que pide el bot)")
+    p.add_argument("--error-rate", type=float, default=FakeConfig.error_rate)
+    p.add_argument("--rate-429", type=float, default=FakeConfig.rate_429)
+    p.add_argument("--seed", type=int, default=FakeConfig.seed)
+    # Bot
+    p.add_argument("--max-results", type=int, default=None, help="MAX_RESULTS (por defecto el de .env)")
+    p.add_argument("--cache-ttl", type=int, default=0, help="SEARCH_CACHE_TTL_SECONDS (0 = sin cache)")
+    p.add_argument("--history", action="store_true", help="registrar en el histórico SQLite")
+    p.add_argument("--calendar-days", type=int, default=7)
+    p.add_argument("--tps", type=float, default=None, help="AMADEUS_TPS (por defecto el de .env)")
+    p.add_argument("--concurrency", type=int, default=None, help="SEARCH_CONCURRENCY")
+    p.add_argument("--no-stream", dest="stream", action="store_false",
+                   help="STREAM_RESULTS=false (un solo send por mensaje, sin ediciones)")
+    p.add_argument("--no-batch", dest="batch", action="store_false",
+                   help="AMADEUS_BATCH_SEARCH=false (un GET por ruta)")
+    p.add_argument("--coalesce", choices=("off", "inflight", "reuse"), default="off",
+                   help="COALESCE (con reuse las iteraciones repetidas no consultan)")
+    p.add_argument("--no-tracemalloc", dest="tracemalloc", action="store_false",
+                   help="sin medición de memoria (latencias sin overhead de tracemalloc)")
+    p.add_argument("--cassette", help="reproduce este cassette en vez del servidor falso")
+    p.add_argument("--cassette-latency", choices=("original", "zero"), default="original")
+    p.add_argument("--out", help="además de stdout, escribe el JSON en este archivo")
+    args = p.parse_args()
+
+    fake_cfg = FakeConfig(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        offers=args.offers,
+        error_rate=args.error_rate,
+        rate_429=args.rate_429,
+        seed=args.seed,
+    )
+    stats: Optional[FakeStats] = None
+    server: Optional[ServerThread] = None
+    base_url = None
+    if not args.cassette:
+        stats = FakeStats()
+        server = ServerThread(fake_cfg, stats)
+        base_url = server.start()
+
+    with tempfile.TemporaryDirectory(prefix="amadeus-bench-") as data_dir:
+        _configure_env(args, base_url, data_dir)
+        if args.tracemalloc:
+            tracemalloc.start()
+        try:
+            # Los logs del bot van a stderr: stdout queda solo para el JSON
+            with contextlib.redirect_stdout(sys.stderr):
+                result = asyncio.run(_run(args, stats))
+        finally:
+            if args.tracemalloc:
+                tracemalloc.stop()
+            if server is not None:
+                server.stop()
+
+    report = {
+        "scenario": args.scenario,
+        "iterations": args.iterations,
+        "python": platform.python_version(),
+        "fake_server": None if args.cassette else vars(fake_cfg),
+        "cassette": args.cassette,
+        "bot": {
+            "max_results": args.max_results,
+            "cache_ttl_s": args.cache_ttl,
+            "history": args.history,
+            "tps": args.tps,
+            "concurrency": args.concurrency,
+            "stream": args.stream,
+            "coalesce": args.coalesce,
+            "batch": args.batch,
+        },
+        **result,
+    }
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    print(text)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,113 @@
+import asyncio
+
+import pytest
+
+from app import deadline, quota
+from app.config import Settings
+from app.flights_service import FlightsService, pack_legs
+
+LEG = ("SCL", "NRT", "2026-12-01", "2026-12-15")
+
+
+@pytest.fixture
+def service(monkeypatch):
+    monkeypatch.setenv("AMADEUS_CLIENT_ID", "x")
+    monkeypatch.setenv("AMADEUS_CLIENT_SECRET", "x")
+    monkeypatch.setenv("COALESCE", "inflight")
+    # Sin Amadeus ni FX: las pruebas pasan la búsqueda en vivo con `live`
+    return FlightsService(Settings(), amadeus=None, fx=None)
+
+
+def _slow_search(seen):
+    async def live():
+        seen.append((deadline.DEADLINE.get(), quota.PURPOSE.get()))
+        await asyncio.sleep(0.05)
+        return ["oferta"]
+    return live
+
+
+def test_leader_deadline_does_not_cut_the_shared_leg_search(service):
+    seen = []
+
+    async def leader():
+        with quota.purpose(quota.INTERACTIVE), deadline.budget(0.01):
+            return await service._search_leg(LEG, live=_slow_search(seen))
+
+    async def joiner():
+        with quota.purpose(quota.INTERACTIVE):
+            return await service._search_leg(LEG, live=_slow_search(seen))
+
+    async def main():
+        first = asyncio.ensure_future(leader())
+        await asyncio.sleep(0)
+        return await asyncio.gather(first, joiner())
+
+    (_, lead_offers, lead_err), (_, offers, err) = asyncio.run(main())
+    # El líder se rinde en su plazo; quien se sumó recibe la búsqueda completa
+    assert isinstance(lead_err, deadline.DeadlineExceeded) and lead_offers == []
+    assert err is None and offers == ["oferta"]
+    # Una sola búsqueda, sin el plazo del líder y con su origen de cuota
+    assert seen == [(None, quota.INTERACTIVE)]
+
+
+def test_joiner_waits_only_until_its_own_deadline(service):
+    seen = []
+
+    async def joiner():
+        with deadline.budget(0.01):
+            return await service._search_leg(LEG, live=_slow_search(seen))
+
+    async def main():
+        first = asyncio.ensure_future(service._search_leg(LEG, live=_slow_search(seen)))
+        await asyncio.sleep(0)
+        return await asyncio.gather(first, joiner())
+
+    (_, offers, err), (_, _, join_err) = asyncio.run(main())
+    assert err is None and offers == ["oferta"]
+    assert isinstance(join_err, deadline.DeadlineExceeded)
+    assert seen == [(None, quota.SCHEDULED)]
+
+
+def test_pack_legs_groups_same_dates_up_to_max_codes():
+    legs = [("SCL", d, "2026-12-01", "2026-12-15") for d in ("NRT", "HND", "KIX", "ITM")]
+    legs.append(("SCL", "NRT", "2026-12-02", "2026-12-16"))
+    batches = pack_legs(legs, 3)
+    assert sorted(len(b) for b in batches) == [1, 1, 3]
+    assert sorted(leg for b in batches for leg in b) == sorted(legs)
+    assert all(len({(leg[2], leg[3]) for leg in b}) == 1 for b in batches)
+
+
+def test_pack_legs_never_asks_for_routes_nobody_searched():
+    # SCL busca NRT y HND; LIM solo NRT: juntarlos pediría LIM-HND
+    legs = [("SCL", "NRT", "d", "r"), ("SCL", "HND", "d", "r"), ("LIM", "NRT", "d", "r")]
+    batches = pack_legs(legs, 3)
+    assert sorted(map(sorted, batches)) == [[("LIM", "NRT", "d", "r")], sorted(legs[:2])]
+
+
+class FakeAmadeus:
+    def __init__(self):
+        self.batches = []
+        self.gets = []
+
+    async def search_round_trip_batch(self, origins, destinations, **kwargs):
+        self.batches.append((origins, destinations))
+        await asyncio.sleep(0.01)
+        return {(o, d): [f"{o}-{d}"] for o in origins for d in destinations}
+
+    async def search_round_trip(self, origin, destination, **kwargs):
+        self.gets.append((origin, destination))
+        return [f"GET {origin}-{destination}"]
+
+
+def test_get_for_a_leg_in_a_running_batch_joins_the_post(service):
+    service.amadeus = FakeAmadeus()
+    hnd = ("SCL", "HND") + LEG[2:]
+
+    async def main():
+        return await asyncio.gather(service._search_batch([LEG, hnd]), service._search_leg(LEG))
+
+    batch, (_, offers, err) = asyncio.run(main())
+    assert service.amadeus.batches == [(["SCL"], ["NRT", "HND"])]
+    assert service.amadeus.gets == []
+    assert [o for _, o, _ in batch] == [["SCL-NRT"], ["SCL-HND"]]
+    assert err is None and offers == ["SCL-NRT"]
@@ -0,0 +1,93 @@
+import asyncio
+import json
+
+import pytest
+
+from app import deadline
+from app.fx import FXConverter
+from app.http_session import HttpResponse
+
+DINERO = "http://fx.test/dinero"
+EXCHANGERATE = "http://fx.test/exchangerate"
+RATES = {"base": "USD", "rates": {"USD": 1, "CLP": 950.0, "JPY": 150.0}}
+
+
+class FakeHttp:
+    """Responde como los proveedores FX; registra qué URL se pidió y con qué plazo."""
+    def __init__(self, fail=()):
+        self.fail = set(fail)
+        self.calls = []
+
+    async def request(self, method, url, **kwargs):
+        self.calls.append((url, deadline.DEADLINE.get()))
+        # Como el pool real: el timeout se recorta al plazo heredado (y falla si ya venció)
+        deadline.clamp(kwargs.get("timeout"))
+        if url in self.fail:
+            return HttpResponse(500, b"{}")
+        return HttpResponse(200, json.dumps(RATES).encode())
+
+
+def _converter(http, **kwargs):
+    return FXConverter(http, dinero_url=DINERO, exchangerate_url=EXCHANGERATE, **kwargs)
+
+
+def test_unlaunched_hedge_provider_keeps_its_half_open_probe():
+    async def main():
+        fx = _converter(FakeHttp(), breaker_failures=1, breaker_cooldown_s=0)
+        backup = fx.providers[1].breaker
+        backup.record_failure()  # cooldown 0: queda semiabierto de inmediato
+        snap = await fx.refresh()
+        await fx.close()
+        return snap, backup
+
+    snap, backup = asyncio.run(main())
+    assert snap is not None and snap.source == "dinero.today"
+    # El primario contestó antes del hedge: el respaldo nunca se lanzó
+    assert backup.state == "half-open" and backup.available()
+
+
+def test_failing_provider_falls_back_and_opens_its_breaker():
+    async def main():
+        http = FakeHttp(fail={DINERO})
+        fx = _converter(http, breaker_failures=1)
+        snap = await fx.refresh()
+        await fx.close()
+        return snap, fx.providers[0].breaker, [url for url, _ in http.calls]
+
+    snap, primary, urls = asyncio.run(main())
+    assert snap is not None and snap.source == "exchangerate.host"
+    assert urls == [DINERO, EXCHANGERATE]
+    assert primary.state == "open"
+
+
+def test_refresh_under_an_expired_deadline_still_downloads():
+    async def main():
+        http = FakeHttp()
+        fx = _converter(http)
+        with deadline.budget(0.01):
+            await asyncio.sleep(0.02)
+            snap = await fx.refresh()
+        await fx.close()
+        return snap, http.calls
+
+    snap, calls = asyncio.run(main())
+    # La descarga compartida corre sin el plazo (ya vencido) de quien la pidió
+    assert snap is not None
+    assert calls == [(DINERO, None)]
+
+
+def test_deadline_exceeded_is_not_a_provider_failure():
+    async def main():
+        fx = _converter(FakeHttp(), breaker_failures=1, breaker_cooldown_s=0)
+        prov = fx.providers[0]
+        prov.breaker.record_failure()
+        assert prov.breaker.allow()  # toma la prueba del semiabierto
+        with deadline.budget(0.01):
+            await asyncio.sleep(0.02)
+            with pytest.raises(deadline.DeadlineExceeded):
+                await fx._call(prov)
+        return prov.breaker
+
+    breaker = asyncio.run(main())
+    # Sin veredicto: la prueba queda libre y el proveedor no vuelve a abrirse
+    assert breaker.state == "half-open" and breaker.available()
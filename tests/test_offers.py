@@ -0,0 +1,40 @@
+from app.offers import parse_offers_by_route
+
+
+def _itinerary(a, b):
+    return {"segments": [{"departure": {"iataCode": a}, "arrival": {"iataCode": b}, "carrierCode": "LA"}]}
+
+
+def _offer(price, out, back):
+    return {
+        "itineraries": [_itinerary(*out), _itinerary(*back)],
+        "price": {"currency": "USD", "grandTotal": f"{price:.2f}"},
+        "validatingAirlineCodes": ["LA"],
+    }
+
+
+def test_groups_by_route_and_keeps_k_cheapest():
+    data = [
+        _offer(900, ("SCL", "NRT"), ("NRT", "SCL")),
+        _offer(700, ("SCL", "NRT"), ("NRT", "SCL")),
+        _offer(800, ("SCL", "NRT"), ("NRT", "SCL")),
+        _offer(650, ("SCL", "HND"), ("HND", "SCL")),
+    ]
+    routes = parse_offers_by_route(data, k=2)
+    assert {r: [o.price for o in offers] for r, offers in routes.items()} == {
+        ("SCL", "NRT"): [700.0, 800.0],
+        ("SCL", "HND"): [650.0],
+    }
+
+
+def test_drops_open_jaw_one_way_and_unpriced_offers():
+    data = [
+        _offer(500, ("SCL", "NRT"), ("HND", "SCL")),  # vuelve desde otro aeropuerto
+        _offer(500, ("SCL", "NRT"), ("NRT", "LIM")),  # vuelve a otro aeropuerto
+        {"itineraries": [_itinerary("SCL", "NRT")], "price": {"grandTotal": "300.00"}},
+        {"itineraries": [_itinerary("SCL", "NRT"), _itinerary("NRT", "SCL")], "price": {}},
+        _offer(950, ("SCL", "NRT"), ("NRT", "SCL")),
+    ]
+    routes = parse_offers_by_route(data, k=5)
+    assert list(routes) == [("SCL", "NRT")]
+    assert [o.price for o in routes[("SCL", "NRT")]] == [950.0]
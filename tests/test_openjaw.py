@@ -0,0 +1,42 @@
+import itertools
+import random
+
+from app.offers import Offer
+from app.openjaw import cheapest_trips, k_smallest_pairs
+
+
+def _offers(prices, origin="SCL", destination="NRT"):
+    return [Offer(p, "USD", origin, destination, 1, "PT30H") for p in sorted(prices)]
+
+
+def test_k_smallest_pairs_matches_brute_force():
+    rnd = random.Random(7)
+    for _ in range(50):
+        a = sorted(rnd.randint(100, 999) for _ in range(rnd.randint(1, 12)))
+        b = sorted(rnd.randint(100, 999) for _ in range(rnd.randint(1, 12)))
+        k = rnd.randint(1, 20)
+        pairs = k_smallest_pairs(a, b, k)
+        expected = sorted(x + y for x, y in itertools.product(a, b))[:k]
+        assert [total for total, _, _ in pairs] == expected
+        # Índices válidos, sin repetir combinaciones
+        assert all(a[i] + b[j] == total for total, i, j in pairs)
+        assert len({(i, j) for _, i, j in pairs}) == len(pairs)
+
+
+def test_k_smallest_pairs_edge_cases():
+    assert k_smallest_pairs([], [1.0], 3) == []
+    assert k_smallest_pairs([1.0], [2.0], 0) == []
+    assert k_smallest_pairs([1.0], [2.0, 3.0], 10) == [(3.0, 0, 0), (4.0, 0, 1)]
+
+
+def test_cheapest_trips_with_hop_matches_brute_force():
+    rnd = random.Random(11)
+    for _ in range(30):
+        outbound = _offers(rnd.randint(400, 900) for _ in range(rnd.randint(1, 6)))
+        hops = _offers(rnd.randint(50, 200) for _ in range(rnd.randint(1, 6)))
+        inbound = _offers(rnd.randint(400, 900) for _ in range(rnd.randint(1, 6)))
+        k = rnd.randint(1, 8)
+        trips = cheapest_trips(outbound, inbound, k, hops)
+        expected = sorted(o.price + h.price + i.price for o, h, i in itertools.product(outbound, hops, inbound))[:k]
+        assert [t.price for t in trips] == expected
+        assert all(t.hop is not None for t in trips)
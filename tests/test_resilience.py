@@ -0,0 +1,59 @@
+from types import SimpleNamespace
+
+import pytest
+
+from app import resilience
+from app.resilience import CircuitBreaker
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = SimpleNamespace(t=1000.0)
+    monkeypatch.setattr(resilience, "time", SimpleNamespace(monotonic=lambda: now.t))
+    return now
+
+
+def test_opens_after_threshold_and_half_opens_after_cooldown(clock):
+    cb = CircuitBreaker("test", failure_threshold=2, cooldown_s=60)
+    cb.record_failure()
+    assert cb.state == "closed" and cb.allow()
+    cb.record_failure()
+    assert cb.state == "open"
+    assert not cb.available() and not cb.allow()
+    clock.t += 60
+    assert cb.state == "half-open"
+
+
+def test_half_open_allows_a_single_probe(clock):
+    cb = CircuitBreaker("test", failure_threshold=1, cooldown_s=60)
+    cb.record_failure()
+    clock.t += 60
+    # available() solo mira; allow() toma la prueba
+    assert cb.available() and cb.available()
+    assert cb.allow()
+    assert not cb.available() and not cb.allow()
+
+
+def test_failed_probe_reopens_and_success_closes(clock):
+    cb = CircuitBreaker("test", failure_threshold=3, cooldown_s=60)
+    for _ in range(3):
+        cb.record_failure()
+    clock.t += 60
+    assert cb.allow()
+    # Un solo fallo de la prueba basta para reabrir, aunque el umbral sea 3
+    cb.record_failure()
+    assert cb.state == "open"
+    clock.t += 60
+    assert cb.allow()
+    cb.record_success()
+    assert cb.state == "closed" and cb.failures == 0 and cb.allow()
+
+
+def test_release_frees_the_probe_without_a_verdict(clock):
+    cb = CircuitBreaker("test", failure_threshold=1, cooldown_s=60)
+    cb.record_failure()
+    clock.t += 60
+    assert cb.allow()
+    cb.release()  # p. ej. el perdedor del hedge, cancelado
+    assert cb.state == "half-open"
+    assert cb.allow()
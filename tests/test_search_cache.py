@@ -0,0 +1,66 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app import search_cache
+from app.search_cache import SearchCache, batch_key, search_key
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = SimpleNamespace(t=1_000_000.0)
+    monkeypatch.setattr(search_cache, "time", SimpleNamespace(time=lambda: now.t))
+    return now
+
+
+def test_fresh_then_stale_then_gone(clock):
+    async def main():
+        cache = SearchCache(ttl_s=60, stale_s=30)
+        await cache.put("k", [1])
+        states = [await cache.get("k")]
+        clock.t += 61
+        states.append(await cache.get("k"))
+        clock.t += 30
+        states.append(await cache.get("k"))
+        return states, cache.stats()
+
+    states, stats = asyncio.run(main())
+    assert states == [([1], True), ([1], False), (None, False)]
+    assert (stats["hits"], stats["stale_hits"], stats["misses"], stats["size"]) == (1, 1, 1, 0)
+
+
+def test_lru_evicts_least_recently_used(clock):
+    async def main():
+        cache = SearchCache(ttl_s=60, max_entries=2)
+        await cache.put("a", 1)
+        await cache.put("b", 2)
+        await cache.get("a")  # "b" pasa a ser la menos usada
+        await cache.put("c", 3)
+        return [(await cache.get(k))[0] for k in "abc"], cache.evictions
+
+    assert asyncio.run(main()) == ([1, None, 3], 1)
+
+
+def test_disk_backing_survives_a_new_instance(clock, tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    key = search_key(" scl", "nrt ", "2026-12-01", "2026-12-15", "usd", 1, 5)
+
+    async def main():
+        first = SearchCache(ttl_s=60, stale_s=30, disk_path=path)
+        await first.put(key, ["oferta"])
+        first.close()
+        second = SearchCache(ttl_s=60, stale_s=30, disk_path=path)
+        fresh = await second.get(key)
+        clock.t += 61
+        stale = await second.get(key)
+        # Una tajada de POST múltiple no la lee un GET (ni al revés)
+        other = await second.get(batch_key(key))
+        second.close()
+        return fresh, stale, other
+
+    fresh, stale, other = asyncio.run(main())
+    assert key == ("SCL", "NRT", "2026-12-01", "2026-12-15", "USD", 1, 5)
+    assert fresh == (["oferta"], True)
+    assert stale == (["oferta"], False)
+    assert other == (None, False)
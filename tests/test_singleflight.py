@@ -0,0 +1,143 @@
+import asyncio
+import contextvars
+
+import pytest
+
+from app import deadline
+from app.singleflight import SingleFlight
+
+
+def test_concurrent_calls_share_one_run():
+    runs = 0
+
+    async def fetch():
+        nonlocal runs
+        runs += 1
+        await asyncio.sleep(0.01)
+        return "ok"
+
+    async def main():
+        sf = SingleFlight("test")
+        return await asyncio.gather(*(sf.do("k", fetch) for _ in range(3)))
+
+    results = asyncio.run(main())
+    assert runs == 1
+    assert results == [("ok", False), ("ok", True), ("ok", True)]
+
+
+def test_reuse_window_serves_last_success_but_never_errors():
+    runs = 0
+
+    async def flaky():
+        nonlocal runs
+        runs += 1
+        if runs == 1:
+            raise RuntimeError("boom")
+        return runs
+
+    async def main():
+        sf = SingleFlight("test", reuse_s=60)
+        with pytest.raises(RuntimeError):
+            await sf.do("k", flaky)
+        assert "k" not in sf
+        first = await sf.do("k", flaky)
+        assert "k" in sf
+        return first, await sf.do("k", flaky)
+
+    assert asyncio.run(main()) == ((2, False), (2, True))
+    assert runs == 2
+
+
+def test_disabled_runs_every_call():
+    runs = 0
+
+    async def fetch():
+        nonlocal runs
+        runs += 1
+        return runs
+
+    async def main():
+        sf = SingleFlight("test", reuse_s=60, enabled=False)
+        await asyncio.gather(sf.do("k", fetch), sf.do("k", fetch))
+        return "k" in sf
+
+    assert asyncio.run(main()) is False
+    assert runs == 2
+
+
+def test_start_registers_without_yielding():
+    runs = 0
+
+    async def fetch():
+        nonlocal runs
+        runs += 1
+        return "ok"
+
+    async def main():
+        sf = SingleFlight("test")
+        assert sf.start("k", fetch) is True
+        # Ya registrada: ni otro start ni un do la vuelven a lanzar
+        assert "k" in sf
+        assert sf.start("k", fetch) is False
+        value, _ = await sf.do("k", fetch)
+        return value, sf.in_flight()
+
+    assert asyncio.run(main()) == ("ok", 0)
+    assert runs == 1
+
+
+def test_shared_run_survives_until_last_waiter_leaves():
+    async def main():
+        sf = SingleFlight("test")
+        release = asyncio.Event()
+
+        async def slow():
+            await release.wait()
+            return "ok"
+
+        first = asyncio.ensure_future(sf.do("k", slow))
+        second = asyncio.ensure_future(sf.do("k", slow))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        assert sf.in_flight() == 1
+        release.set()
+        assert await second == ("ok", True)
+
+        lonely = asyncio.ensure_future(sf.do("j", asyncio.Event().wait))
+        await asyncio.sleep(0)
+        shared = sf._inflight["j"].task
+        lonely.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await lonely
+        await asyncio.sleep(0)
+        return shared.cancelled(), sf.in_flight()
+
+    assert asyncio.run(main()) == (True, 0)
+
+
+def test_context_keeps_leader_deadline_out_of_shared_run():
+    seen = []
+
+    async def fetch():
+        seen.append(deadline.DEADLINE.get())
+        await asyncio.sleep(0.05)
+        return "ok"
+
+    async def leader(sf):
+        with deadline.budget(0.01):
+            return await deadline.bounded(sf.do("k", fetch, context=contextvars.Context()))
+
+    async def main():
+        sf = SingleFlight("test")
+        first = asyncio.ensure_future(leader(sf))
+        while "k" not in sf:
+            await asyncio.sleep(0)
+        second = await sf.do("k", fetch)
+        with pytest.raises(deadline.DeadlineExceeded):
+            await first
+        return second
+
+    # El líder se rinde a los 10 ms, pero la búsqueda compartida sigue para el otro
+    assert asyncio.run(main()) == ("ok", True)
+    assert seen == [None]
@@ -0,0 +1,32 @@
+import asyncio
+import json
+
+from app import deadline
+from app.http_session import HttpResponse
+from app.token_manager import TokenManager
+
+
+def test_background_refresh_does_not_inherit_the_expired_deadline():
+    seen = []
+
+    async def main():
+        refreshed = asyncio.Event()
+
+        async def send(method, url, **kwargs):
+            seen.append(deadline.DEADLINE.get())
+            # Como el pool real: con el plazo ya vencido la llamada ni sale
+            deadline.clamp(None)
+            if len(seen) == 2:
+                refreshed.set()
+            return HttpResponse(200, json.dumps({"access_token": f"t{len(seen)}", "expires_in": 1800}).encode())
+
+        # Margen casi igual a la vida del token: la renovación dispara a los ~50 ms
+        tokens = TokenManager(send, "http://amadeus.test", "id", "secret", refresh_margin_s=1739.95)
+        with deadline.budget(0.01):
+            first = await tokens.get()
+        await asyncio.wait_for(refreshed.wait(), 2)
+        await tokens.close()
+        return first, tokens.token
+
+    assert asyncio.run(main()) == ("t1", "t2")
+    assert seen[0] is not None and seen[1] is None